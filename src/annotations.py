@@ -0,0 +1,104 @@
+""" annotations.py - Defines the compact representation of the matches of the names in the sentences of an article """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from array import array
+import binascii
+import json
+import sys
+
+# The matches of an article are a flat array('i') of quadruples (sentence, entity, start, length) in which:
+#   - 'sentence' - The index of the sentence in the column 'tokenizedSentences'
+#   - 'entity' - The index of the matched name in the column 'tokenizedNames'
+#   - 'start' - The index of the first token of the match in the sentence
+#   - 'length' - The number of tokens of the match
+# The quadruples are sorted by sentence, then entity, then start, as returned by 'pack'.
+#
+# On the disk the array is written as its 32 bits little-endian integers: as raw bytes in the binary
+# formats and as a base64 string of them in the CSV format (see 'storage.py').
+TYPECODE = "i"
+FIELDS = 4
+
+def pack(annotated_entities):
+    """
+    Recieves the matches of each sentence in the nested format of 'tasks.match_entities',
+    [ [[(init,offset) ...] ...] ...], and returns them as a flat array of quadruples
+    """
+    packed = array(TYPECODE)
+    for sentence_index, sentence_matches in enumerate(annotated_entities):
+        for entity_index, entity_matches in enumerate(sentence_matches):
+            for init, offset in entity_matches:
+                packed.extend((sentence_index, entity_index, init, offset + 1))
+    return packed
+
+def unpack(packed, n_sentences, n_entities):
+    """
+    Returns the nested format of the quadruples (see 'pack') of an article with 'n_sentences'
+    sentences and 'n_entities' tokenized names
+    """
+    annotated_entities = [[[] for j in range(n_entities)] for i in range(n_sentences)]
+    for sentence_index, entity_index, start, length in iter_matches(packed):
+        annotated_entities[sentence_index][entity_index].append([start, length - 1])
+    return annotated_entities
+
+def iter_matches(packed):
+    """
+    Yields the quadruples (sentence, entity, start, length) of the array
+    """
+    values = iter(packed)
+    return zip(values, values, values, values)
+
+def to_bytes(packed):
+    """
+    Returns the 32 bits little-endian integers of the array
+    """
+    packed = load(packed)
+    if sys.byteorder == "big":
+        packed = array(TYPECODE, packed)
+        packed.byteswap()
+    return packed.tobytes()
+
+def from_bytes(data):
+    """
+    Returns the array of the bytes written by 'to_bytes'
+    """
+    packed = array(TYPECODE)
+    packed.frombytes(data)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed
+
+def encode(packed):
+    """
+    Returns the base64 string of the array, written into the CSV files
+    """
+    return binascii.b2a_base64(to_bytes(packed), newline=False).decode("ascii")
+
+def decode(text):
+    """
+    Returns the array of a value of the CSV files: a base64 string written by 'encode', or the
+    JSON of the nested format written by older versions of the pipeline
+    """
+    if text.startswith("["):
+        return pack(json.loads(text))
+    return from_bytes(binascii.a2b_base64(text))
+
+def load(value):
+    """
+    Returns the array of a value in any of the forms above: an array, the bytes of the binary
+    formats, the string of the CSV files or a list in the nested format
+    """
+    if isinstance(value, array):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return from_bytes(value)
+    if isinstance(value, str):
+        return decode(value)
+    return pack(value)
@@ -0,0 +1,231 @@
+""" articlestore.py - Defines a memory-mapped store of the Wikipedia articles used by the pipeline """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from array import array
+import argparse
+import sqlite3
+import bisect
+import struct
+import mmap
+import sys
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import storage
+
+# The store is a single file with:
+#   - The header: magic bytes, compression, offset of the index and number of articles
+#   - The articles: for each one, the lengths of the title and the text followed by their UTF-8 bytes.
+#     The text may be compressed with zstd
+#   - The index: the sorted article ids followed by the offsets of the articles, as little-endian int64
+_MAGIC = b"NERARTS\x00"
+_HEADER = struct.Struct("<8sB7xQQ")
+_RECORD = struct.Struct("<II")
+
+_NO_COMPRESSION = 0
+_ZSTD_COMPRESSION = 1
+
+def is_article_store(path):
+    """
+    True if the file is an article store written by 'pack'
+    """
+    with open(path, 'rb') as file:
+        return file.read(len(_MAGIC)) == _MAGIC
+
+def _int64_array(values):
+    """
+    Returns an array of little-endian int64 with the values
+    """
+    values = array('q', values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def _read_ids(id_files):
+    """
+    Returns the set of the values of the 'wikiPageID' column of the files (see 'storage.RowReader')
+    """
+    ids = set()
+    for id_file in id_files:
+        with storage.RowReader(id_file, decode=[]) as inputs:
+            for row in inputs:
+                try:
+                    ids.add(int(row["wikiPageID"]))
+                except ValueError:
+                    pass
+    return ids
+
+def pack(db, output_file, ids=None, compress=False):
+    """
+    Recieves:
+        - db - The SQLite database with the table WikiElement(id, title, content)
+        - output_file - The file of the store to be written
+        - ids - The set of the integer ids of the articles to be exported. If None, all the articles are exported
+        - compress - Compresses the text of each article with zstd
+
+    Writes the articles into a single file, read by 'ArticleStore'.
+    Articles whose id is found more than once or whose text is empty are not exported, as they are
+    discarded by 'tasks.get_wikipedia_page'.
+    Returns the number of exported articles.
+    """
+    if compress and zstandard is None:
+        raise ImportError("Compressing the articles requires the zstandard package")
+    compressor = zstandard.ZstdCompressor() if compress else None
+
+    from urllib.request import pathname2url
+    conn = sqlite3.connect("file:%s?mode=ro" % pathname2url(db), uri=True)
+    query = """
+            SELECT id, title, content
+            FROM WikiElement
+            ORDER BY id
+            """
+
+    def unique_articles():
+        """
+        Yields the (id, title, content) of the articles found once
+        """
+        previous = None
+        repeated = False
+        for article in conn.execute(query):
+            if previous is not None and article[0] == previous[0]:
+                repeated = True
+                continue
+            if previous is not None and not repeated:
+                yield previous
+            previous = article
+            repeated = False
+        if previous is not None and not repeated:
+            yield previous
+
+    article_ids = []
+    offsets = []
+    temporary_file = output_file + ".tmp"
+    with open(temporary_file, 'wb') as outputs:
+        outputs.write(b"\0" * _HEADER.size)
+        offset = _HEADER.size
+
+        for article_id, title, content in unique_articles():
+            if not content or not isinstance(article_id, int) or (ids is not None and article_id not in ids):
+                continue
+
+            title = title.encode()
+            text = content.encode()
+            if compressor is not None:
+                text = compressor.compress(text)
+
+            article_ids.append(article_id)
+            offsets.append(offset)
+            outputs.write(_RECORD.pack(len(title), len(text)))
+            outputs.write(title)
+            outputs.write(text)
+            offset += _RECORD.size + len(title) + len(text)
+
+        _int64_array(article_ids).tofile(outputs)
+        _int64_array(offsets).tofile(outputs)
+
+        outputs.seek(0)
+        outputs.write(_HEADER.pack(_MAGIC, _ZSTD_COMPRESSION if compress else _NO_COMPRESSION, offset, len(article_ids)))
+
+    conn.close()
+    os.replace(temporary_file, output_file)
+    return len(article_ids)
+
+class ArticleStore:
+    """
+    Reads the articles of a store written by 'pack'.
+
+    The file is memory-mapped, so the processes reading the same store share its pages in the page
+    cache, and the index is searched in place without being loaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, compression, index_offset, n_articles = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            raise ValueError("%s is not an article store"%(path))
+
+        self._decompressor = None
+        if compression == _ZSTD_COMPRESSION:
+            if zstandard is None:
+                raise ImportError("Reading %s requires the zstandard package"%(path))
+            self._decompressor = zstandard.ZstdDecompressor()
+
+        self._view = memoryview(self._map)
+        index = self._view[index_offset:index_offset + 16*n_articles]
+        if sys.byteorder == "big":
+            self._ids = _int64_array(index[:8*n_articles].cast('q'))
+            self._offsets = _int64_array(index[8*n_articles:].cast('q'))
+        else:
+            self._ids = index[:8*n_articles].cast('q')
+            self._offsets = index[8*n_articles:].cast('q')
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, article_id):
+        """
+        Returns the pair (title, content) of the article, or None if it is not in the store
+        """
+        try:
+            article_id = int(article_id)
+        except (TypeError, ValueError):
+            return None
+
+        position = bisect.bisect_left(self._ids, article_id)
+        if position == len(self._ids) or self._ids[position] != article_id:
+            return None
+
+        offset = self._offsets[position]
+        title_length, text_length = _RECORD.unpack_from(self._map, offset)
+        offset += _RECORD.size
+        title = str(self._view[offset:offset + title_length], "utf-8")
+        offset += title_length
+        text = self._view[offset:offset + text_length]
+        if self._decompressor is not None:
+            text = self._decompressor.decompress(text)
+        return title, str(text, "utf-8")
+
+# Opened stores, one for each (process, path)
+_stores = {}
+
+def open_store(path):
+    """
+    Returns the store of the file, opened once for each process
+    """
+    key = (os.getpid(), path)
+    if key not in _stores:
+        _stores[key] = ArticleStore(path)
+    return _stores[key]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Packs the articles of the Wikipedia dump into a memory-mapped store")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    pack_parser = subparsers.add_parser("pack", help="Exports the articles of the SQLite dump")
+    pack_parser.add_argument("db", help="The SQLite database with the table WikiElement")
+    pack_parser.add_argument("output_file", help="The store to be written")
+    pack_parser.add_argument("--ids", nargs="*", default=None,
+                             help="Files with a 'wikiPageID' column, i.e. the input .csv or .st1 files. "
+                                  "Only their articles are exported")
+    pack_parser.add_argument("--zstd", action="store_true", help="Compresses the text of each article with zstd")
+
+    args = parser.parse_args()
+    if args.command == "pack":
+        n_articles = pack(args.db, args.output_file, _read_ids(args.ids) if args.ids is not None else None, args.zstd)
+        print("%d articles written to %s"%(n_articles, args.output_file))
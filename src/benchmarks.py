@@ -0,0 +1,415 @@
+""" benchmarks.py - Defines benchmarks comparing implementations of the pipeline tasks """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from os.path import dirname, join, abspath
+import importlib.util
+import subprocess
+import platform
+import argparse
+import tempfile
+import sqlite3
+import shutil
+import shlex
+import random
+import timeit
+import storage
+import tasks
+import json
+import time
+import csv
+import sys
+import os
+
+# Folders of the synthetic corpus, one for each entity type (see 'tasks._entity_type_flag')
+ENTITY_TYPES = ["Organisation","Person","Place"]
+
+def _read_sentences(sample_file, max_rows=None):
+    """
+    Recieves a CSV file with the columns 'names' and 'sentences', i.e. a .st4 or .st5 file
+    Returns the list of all the names and sentences of the file
+    """
+    sentences = []
+    with open(sample_file, 'r') as inputs:
+        for i, row in enumerate(csv.DictReader(inputs)):
+            if max_rows is not None and i == max_rows:
+                break
+            sentences.extend(json.loads(row["names"]))
+            sentences.extend(json.loads(row["sentences"]))
+    return sentences
+
+def benchmark_split_words(sample_file, repeat=5, max_rows=None):
+    """
+    Recieves a CSV file with the columns 'names' and 'sentences' of real articles, i.e. a .st4 file
+
+    Checks that 'tasks.split_words', 'tasks.split_words_batch' and 'tasks.split_words_charwise'
+    return the same tokens for all the sentences and names of the file, then times each of them.
+    Returns a dict with the best time, in seconds, of tokenizing all the sentences with each one.
+    """
+    sentences = _read_sentences(sample_file, max_rows)
+
+    expected = [tasks.split_words_charwise(sentence) for sentence in sentences]
+    if [tasks.split_words(sentence) for sentence in sentences] != expected or tasks.split_words_batch(sentences) != expected:
+        raise AssertionError("The tokenizers disagree on %s"%(sample_file))
+
+    implementations = {
+        "split_words_charwise": lambda: [tasks.split_words_charwise(sentence) for sentence in sentences],
+        "split_words": lambda: [tasks.split_words(sentence) for sentence in sentences],
+        "split_words_batch": lambda: tasks.split_words_batch(sentences)}
+
+    results = {name: min(timeit.repeat(function, number=1, repeat=repeat)) for name, function in implementations.items()}
+
+    n_chars = sum(len(sentence) for sentence in sentences)
+    print("%d sentences, %d characters"%(len(sentences), n_chars))
+    for name, seconds in results.items():
+        print("%-22s %8.3fs %10.0f sentences/s  x%.1f"%(name, seconds, len(sentences)/seconds, results["split_words_charwise"]/seconds))
+    return results
+
+def benchmark_split_sentences(sample_file, repeat=5, max_rows=None):
+    """
+    Recieves a file in any of the intermediate formats with the column 'page' of real articles, i.e. a .st2 file
+
+    Checks that 'tasks.iter_article_sentences' and 'tasks.iter_wikitext_sentences' return exactly the
+    same sentences as 'tasks.split_article_sentences_listwise' for all the articles of the file, then
+    times each of them.
+    Returns a dict with the best time, in seconds, of splitting all the articles with each one.
+    """
+    wiki_texts = []
+    with storage.RowReader(sample_file, decode=["page"]) as inputs:
+        for i, row in enumerate(inputs):
+            if max_rows is not None and i == max_rows:
+                break
+            wiki_texts.append(row["page"]["text"])
+    plain_texts = [tasks._plain_text(wiki_text) for wiki_text in wiki_texts]
+
+    for wiki_text, plain_text in zip(wiki_texts, plain_texts):
+        expected = tasks.split_article_sentences_listwise(plain_text)
+        if list(tasks.iter_article_sentences(plain_text)) != expected or list(tasks.iter_wikitext_sentences(wiki_text)) != expected:
+            raise AssertionError("The sentence splitters disagree on %s:\n%s"%(sample_file, plain_text[:200]))
+
+    implementations = {
+        "split_article_sentences_listwise": lambda: [tasks.split_article_sentences_listwise(text) for text in plain_texts],
+        "iter_article_sentences": lambda: [list(tasks.iter_article_sentences(text)) for text in plain_texts]}
+
+    results = {name: min(timeit.repeat(function, number=1, repeat=repeat)) for name, function in implementations.items()}
+
+    print("%d articles, %d characters"%(len(plain_texts), sum(len(text) for text in plain_texts)))
+    for name, seconds in results.items():
+        print("%-34s %8.3fs  x%.1f"%(name, seconds, results["split_article_sentences_listwise"]/seconds))
+    return results
+
+def _words(rng, n_words):
+    """
+    Returns a list of distinct pseudo-words made of random syllables
+    """
+    syllables = ["ba","de","ri","lo","mu","sa","te","vi","no","ca","pe","ra","li","go","fu","ma","zo","que","lha","nte"]
+    words = set()
+    while len(words) < n_words:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(1,4))))
+    return sorted(words)
+
+def _wiki_sentence(rng, vocabulary, sentence_words, mention):
+    """
+    Returns a sentence of wikitext with about 'sentence_words' words, mentioning the name if sent
+    """
+    words = [rng.choice(vocabulary) for _ in range(max(1, int(rng.gauss(sentence_words, sentence_words/4))))]
+    if mention is not None:
+        words.insert(rng.randint(0, len(words)), rng.choice([mention, "[[%s]]"%(mention), "'''%s'''"%(mention), mention + ","]))
+    if rng.random() < 0.2:
+        words.insert(rng.randint(0, len(words)), "{{citation|%s}}"%(rng.choice(vocabulary)))
+    if rng.random() < 0.1:
+        words.append("<ref>%s</ref>"%(rng.choice(vocabulary)))
+    return " ".join(words) + rng.choice([".",".",".","?","!"])
+
+def make_corpus(folder, n_articles=100, sentences=30, sentence_words=20, aliases=2, seed=0):
+    """
+    Writes a deterministic synthetic corpus into the folder:
+        - Folders 'Organisation', 'Person' and 'Place', each with an input CSV file of 'n_articles'
+          entities with a name and up to 'aliases' other names
+        - 'wikipedia.db' - A SQLite database with the table WikiElement(id, title, content) of their
+          articles, each with about 'sentences' sentences of 'sentence_words' words of wikitext.
+          A few articles are missing, empty or repeated, so that they are discarded
+        - 'corpus.json' - The parameters of the corpus
+
+    The same parameters always write the same corpus.
+    Returns the dict of the parameters.
+    """
+    rng = random.Random(seed)
+    vocabulary = _words(rng, 2000)
+    parameters = {"n_articles":n_articles, "sentences":sentences, "sentence_words":sentence_words, "aliases":aliases, "seed":seed}
+
+    os.makedirs(folder, exist_ok=True)
+    db = join(folder, "wikipedia.db")
+    if os.path.exists(db):
+        os.remove(db)
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE WikiElement (id INTEGER, title TEXT, content TEXT)")
+
+    article_id = 0
+    for entity_type in ENTITY_TYPES:
+        os.makedirs(join(folder, entity_type), exist_ok=True)
+        with open(join(folder, entity_type, "%s0.csv"%(entity_type.lower())), 'w') as outputs:
+            CSV_outputs = csv.writer(outputs)
+            CSV_outputs.writerow(["isPrimaryTopicOf","wikiPageID","name","alias"])
+
+            for _ in range(n_articles):
+                article_id += 1
+                name = " ".join(word.capitalize() for word in rng.sample(vocabulary, rng.randint(1,3)))
+                other_names = [" ".join(word.capitalize() for word in rng.sample(vocabulary, rng.randint(1,2)))
+                               for _ in range(rng.randint(0, aliases))]
+                CSV_outputs.writerow(["http://pt.wikipedia.org/wiki/%s"%(name.replace(" ","_")), article_id, name, ";;".join(other_names)])
+
+                kind = rng.random()
+                if kind < 0.03:
+                    continue
+
+                names = [name] + other_names
+                paragraphs = []
+                while sum(paragraph.count(". ") + 1 for paragraph in paragraphs) < sentences:
+                    paragraphs.append(" ".join(_wiki_sentence(rng, vocabulary, sentence_words, rng.choice(names) if rng.random() < 0.4 else None)
+                                               for _ in range(rng.randint(1,6))))
+                    if rng.random() < 0.1:
+                        paragraphs.append("[[Ficheiro:%s.jpg|thumb|left]]"%(rng.choice(vocabulary)))
+
+                content = "" if kind < 0.05 else "\n\n".join(paragraphs)
+                conn.execute("INSERT INTO WikiElement VALUES (?,?,?)", (article_id, name, content))
+                if kind > 0.99:
+                    conn.execute("INSERT INTO WikiElement VALUES (?,?,?)", (article_id, name, content))
+
+    conn.commit()
+    conn.close()
+
+    with open(join(folder, "corpus.json"), 'w') as outputs:
+        json.dump(parameters, outputs)
+    return parameters
+
+def _corpus_files(corpus):
+    """
+    Returns the input CSV files of the corpus
+    """
+    return sorted(join(corpus, entity_type, file) for entity_type in ENTITY_TYPES
+                  for file in os.listdir(join(corpus, entity_type)) if file.endswith(".csv"))
+
+def _copy_corpus(corpus, folder):
+    """
+    Copies the corpus into the folder, so that the benchmarks never write into it.
+    Returns the copied folder.
+    """
+    copy = join(folder, "corpus")
+    shutil.copytree(corpus, copy)
+    return copy
+
+# Stages run by 'benchmark_stages': the name, the suffixes of their input and output files and
+# the function running them on a file
+def _stages(db, discarded_file, workers):
+    return [
+        ("summarize_entity_names", ".csv", ".st1", lambda i, o: tasks.summarize_entity_names(i, o)),
+        ("get_wikipedia_page", ".st1", ".st2", lambda i, o: tasks.get_wikipedia_page(i, o, discarded_file=discarded_file, db=db)),
+        ("get_wikipedia_plain_text", ".st2", ".st3", lambda i, o: tasks.get_wikipedia_plain_text(i, o, workers=workers)),
+        ("sentence_splitting", ".st3", ".st4", lambda i, o: tasks.sentence_splitting(i, o, workers=workers)),
+        ("filter_sentences_with_entities", ".st4", ".st5", lambda i, o: tasks.filter_sentences_with_entities(i, o, workers=workers)),
+        ("split_sentences_entities", ".st5", ".st6", lambda i, o: tasks.split_sentences_entities(i, o, tasks.split_words, workers=workers)),
+        ("annotate_sentences_entities", ".st6", ".st7", lambda i, o: tasks.annotate_sentences_entities(i, o, workers=workers)),
+        ("IOB", ".st7", ".conllu", lambda i, o: tasks.IOB(i, o, workers=workers))]
+
+def benchmark_stages(corpus, repeat=3, workers=1):
+    """
+    Recieves the folder of a corpus written by 'make_corpus'
+
+    Runs each stage of 'tasks.py' on its own over the files of the corpus, in a temporary copy of it,
+    each one reading the files written by the previous one.
+    Returns a dict with the best time, in seconds, of running each stage over all the files and their sum.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        copy = _copy_corpus(corpus, folder)
+        stems = [file[:-len(".csv")] for file in _corpus_files(copy)]
+        stages = _stages(join(copy, "wikipedia.db"), join(folder, "discarded.csv"), workers)
+
+        for _ in range(repeat):
+            for name, input_suffix, output_suffix, function in stages:
+                start = time.perf_counter()
+                for stem in stems:
+                    function(stem + input_suffix, stem + output_suffix)
+                seconds = time.perf_counter() - start
+                results[name] = min(results.get(name, seconds), seconds)
+
+    results["total"] = sum(results.values())
+    for name, seconds in results.items():
+        print("%-32s %8.3fs"%(name, seconds))
+    return results
+
+def benchmark_pipeline(corpus, repeat=3, pipeline_args=()):
+    """
+    Recieves the folder of a corpus written by 'make_corpus'
+
+    Runs 'pipeline.py' end to end over a fresh copy of the corpus each time, with the extra
+    'pipeline_args' (i.e. ['--fused', '--workers', '4']).
+    Returns a dict with the best time, in seconds, of a run.
+    """
+    pipeline = join(dirname(abspath(__file__)), "pipeline.py")
+    best = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as folder:
+            copy = _copy_corpus(corpus, folder)
+            command = [sys.executable, pipeline, "--input_folders"] + [join(copy, entity_type) for entity_type in ENTITY_TYPES]
+            command += ["--wikipedia_db", join(copy, "wikipedia.db")] + list(pipeline_args)
+
+            start = time.perf_counter()
+            subprocess.run(command, cwd=folder, check=True, stdout=subprocess.DEVNULL)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+
+    print("%-32s %8.3fs"%("pipeline " + " ".join(pipeline_args), best))
+    return {"pipeline":best}
+
+# Modules imported by 'tasks.py', 'postaggers.py' and 'pipeline.py' when these are imported, before
+# they were loaded on first use through 'registry.py'
+EAGER_MODULES = ["mwparserfromhell","wikipedia","polyglot.text","polyglot.tag"]
+
+def _best_run_time(command, repeat):
+    """
+    Returns the best wall time, in seconds, of running the command in the folder of the sources
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=dirname(abspath(__file__)), check=True, stdout=subprocess.DEVNULL)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def benchmark_startup(repeat=5):
+    """
+    Times the startup of new processes, as paid by '--help', a single task rerun or each Ruffus job:
+        - python - An empty interpreter
+        - import tasks - Importing the tasks, with the parsers and taggers loaded lazily
+        - import tasks + eager modules - Importing the tasks together with the installed EAGER_MODULES,
+          as done before the registry
+        - pipeline.py --help
+    Returns a dict with the best time, in seconds, of each one.
+    """
+    eager_modules = [module for module in EAGER_MODULES if importlib.util.find_spec(module.split(".")[0]) is not None]
+    commands = {
+        "python": [sys.executable, "-c", "pass"],
+        "import tasks": [sys.executable, "-c", "import tasks"],
+        "import tasks + eager modules": [sys.executable, "-c", "import tasks, " + ", ".join(eager_modules) if eager_modules else "import tasks"],
+        "pipeline.py --help": [sys.executable, "pipeline.py", "--help"]}
+
+    results = {name: _best_run_time(command, repeat) for name, command in commands.items()}
+    print("Eager modules: %s"%(", ".join(eager_modules)))
+    for name, seconds in results.items():
+        print("%-32s %8.3fs"%(name, seconds))
+    return results
+
+def _commit():
+    """
+    Returns the git commit of the source files, or None outside a git repository
+    """
+    try:
+        return subprocess.run(["git","rev-parse","HEAD"], cwd=dirname(abspath(__file__)), check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_results(output_file, benchmark, results, corpus=None, arguments=None):
+    """
+    Writes the results of a benchmark into a JSON file, along with the commit, the Python version and
+    the parameters of the corpus, so that results of different commits can be compared (see 'compare_results')
+    """
+    parameters = None
+    if corpus is not None and os.path.exists(join(corpus, "corpus.json")):
+        with open(join(corpus, "corpus.json"), 'r') as inputs:
+            parameters = json.load(inputs)
+
+    with open(output_file, 'w') as outputs:
+        json.dump({"benchmark":benchmark, "commit":_commit(), "time":time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "python":platform.python_version(), "machine":platform.machine(), "corpus":parameters,
+                   "arguments":arguments, "results":results}, outputs, indent=4)
+
+def compare_results(old_file, new_file):
+    """
+    Prints the times of two result files written by 'save_results' and the speedup of the new one
+    """
+    with open(old_file, 'r') as old_inputs, open(new_file, 'r') as new_inputs:
+        old, new = json.load(old_inputs), json.load(new_inputs)
+    if old["corpus"] != new["corpus"]:
+        print("Warning: the results were measured on different corpora")
+
+    print("%-32s %10s %10s %8s"%("", (old["commit"] or "old")[:10], (new["commit"] or "new")[:10], "speedup"))
+    for name in old["results"]:
+        if name in new["results"]:
+            print("%-32s %9.3fs %9.3fs %7.2fx"%(name, old["results"][name], new["results"][name], old["results"][name]/new["results"][name]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the pipeline tasks")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    split_words_parser = subparsers.add_parser("split_words", help="Compares the implementations of the tokenizer")
+    split_words_parser.add_argument("sample_file", help="A CSV file with the columns 'names' and 'sentences', i.e. a .st4 file")
+    split_words_parser.add_argument("--repeat", type=int, default=5)
+    split_words_parser.add_argument("--max_rows", type=int, default=None)
+
+    split_sentences_parser = subparsers.add_parser("split_sentences", help="Compares the sentence splitter with its reference implementation")
+    split_sentences_parser.add_argument("sample_file", help="A file with the column 'page', i.e. a .st2 file")
+    split_sentences_parser.add_argument("--repeat", type=int, default=5)
+    split_sentences_parser.add_argument("--max_rows", type=int, default=None)
+
+    corpus_parser = subparsers.add_parser("corpus", help="Writes a synthetic corpus and its Wikipedia database")
+    corpus_parser.add_argument("folder")
+    corpus_parser.add_argument("--n_articles", type=int, default=100, help="Articles of each entity type")
+    corpus_parser.add_argument("--sentences", type=int, default=30, help="Sentences of each article")
+    corpus_parser.add_argument("--sentence_words", type=int, default=20, help="Average words of each sentence")
+    corpus_parser.add_argument("--aliases", type=int, default=2, help="Maximum number of other names of each entity")
+    corpus_parser.add_argument("--seed", type=int, default=0)
+
+    stages_parser = subparsers.add_parser("stages", help="Times each stage of tasks.py on its own over a corpus")
+    stages_parser.add_argument("corpus", help="A folder written by the 'corpus' benchmark")
+    stages_parser.add_argument("--repeat", type=int, default=3)
+    stages_parser.add_argument("--workers", type=int, default=1)
+    stages_parser.add_argument("--output", default=None, help="JSON file of the results")
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="Times the whole pipeline.py over a corpus")
+    pipeline_parser.add_argument("corpus", help="A folder written by the 'corpus' benchmark")
+    pipeline_parser.add_argument("--repeat", type=int, default=3)
+    pipeline_parser.add_argument("--output", default=None, help="JSON file of the results")
+    pipeline_parser.add_argument("--pipeline_args", default="", help="Options of pipeline.py, i.e. \"--fused --workers 4\"")
+
+    startup_parser = subparsers.add_parser("startup", help="Times the startup of the pipeline processes")
+    startup_parser.add_argument("--repeat", type=int, default=5)
+    startup_parser.add_argument("--output", default=None, help="JSON file of the results")
+
+    compare_parser = subparsers.add_parser("compare", help="Compares two JSON files of results")
+    compare_parser.add_argument("old_file")
+    compare_parser.add_argument("new_file")
+
+    args = parser.parse_args()
+    if args.benchmark == "split_words":
+        benchmark_split_words(args.sample_file, args.repeat, args.max_rows)
+    elif args.benchmark == "split_sentences":
+        benchmark_split_sentences(args.sample_file, args.repeat, args.max_rows)
+    elif args.benchmark == "corpus":
+        make_corpus(args.folder, args.n_articles, args.sentences, args.sentence_words, args.aliases, args.seed)
+    elif args.benchmark == "stages":
+        results = benchmark_stages(args.corpus, args.repeat, args.workers)
+        if args.output:
+            save_results(args.output, "stages", results, args.corpus, {"workers":args.workers})
+    elif args.benchmark == "pipeline":
+        pipeline_args = shlex.split(args.pipeline_args)
+        results = benchmark_pipeline(args.corpus, args.repeat, pipeline_args)
+        if args.output:
+            save_results(args.output, "pipeline", results, args.corpus, {"pipeline_args":pipeline_args})
+    elif args.benchmark == "startup":
+        results = benchmark_startup(args.repeat)
+        if args.output:
+            save_results(args.output, "startup", results)
+    elif args.benchmark == "compare":
+        compare_results(args.old_file, args.new_file)
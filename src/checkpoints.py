@@ -0,0 +1,148 @@
+""" checkpoints.py - Defines the checkpoints of the outputs of the pipeline, used to resume an interrupted task """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from os.path import abspath, exists, getmtime, getsize
+from collections import deque
+from itertools import islice
+import json
+import os
+
+import storage
+
+# Number of rows written between two checkpoints
+INTERVAL = 1000
+
+class Checkpoint:
+    """
+    Checkpoints the output file of a task processing the rows of an input file in order.
+
+    The rows are written into 'output_file.partial', which is renamed to the output file by 'commit'
+    once all of them were written, so Ruffus never sees a half-written output. Every 'interval' input
+    rows the partial output is flushed, and the last wikiPageID written, the number of input rows up
+    to it and the size of the partial output are written into 'output_file.checkpoint', also renamed
+    into place.
+
+    When the task is run again on the same input file, with the same 'signature' (i.e. the format
+    of the output), the partial output is truncated to the checkpointed size and the checkpointed
+    number of input rows is skipped (see 'skip'). If the input row at that position doesn't have the
+    checkpointed wikiPageID, i.e. the input file was written again, the partial output is removed
+    and the task starts over from the first row.
+    """
+
+    def __init__(self, input_file, output_file, signature="", interval=INTERVAL):
+        self.output_file = output_file
+        self.partial_file = output_file + ".partial"
+        self.path = output_file + ".checkpoint"
+        self.interval = interval
+        self._input = {"input_file":abspath(input_file), "input_size":getsize(input_file),
+                       "input_mtime":getmtime(input_file), "signature":signature}
+        self._state = None
+        # Pairs (wikiPageID, position) of the rows yielded by 'skip' and not checkpointed yet
+        self._positions = deque()
+
+        state = self._read()
+        if state is not None and exists(self.partial_file) and getsize(self.partial_file) >= state["offset"] \
+           and _article_at(input_file, state["rows"]) == state["wikiPageID"]:
+            os.truncate(self.partial_file, state["offset"])
+            self._state = state
+        else:
+            if state is not None:
+                print("Starting %s over: the checkpoint doesn't match the input %s"%(output_file, input_file))
+            for path in (self.partial_file, self.path):
+                if exists(path):
+                    os.remove(path)
+
+    def _read(self):
+        """
+        Returns the checkpoint written for the same input file and signature, or None
+        """
+        if not exists(self.path):
+            return None
+        with open(self.path) as file:
+            try:
+                state = json.load(file)
+            except ValueError:
+                return None
+        if any(state.get(key) != value for key, value in self._input.items()):
+            return None
+        return state
+
+    @property
+    def resumed(self):
+        """
+        True if the task continues the partial output of a previous run
+        """
+        return self._state is not None
+
+    @property
+    def rows(self):
+        """
+        The number of input rows up to the last checkpoint
+        """
+        return self._state["rows"] if self._state is not None else 0
+
+    def skip(self, rows):
+        """
+        Yields the rows after the checkpointed number of rows, or all of them if the task was not resumed
+        """
+        rows = iter(rows)
+        if self._state is not None:
+            print("Resuming %s after article %s (%d rows read)"%(self.output_file, self._state["wikiPageID"], self._state["rows"]))
+            for _ in islice(rows, self._state["rows"]):
+                pass
+        for position, row in enumerate(rows, self.rows + 1):
+            self._positions.append((row.get("wikiPageID"), position))
+            yield row
+
+    def update(self, outputs, article_id, files=()):
+        """
+        Records that the rows up to the article, a row yielded by 'skip', were written into the RowWriter
+        'outputs'. Every 'interval' input rows, flushes the outputs and the other open 'files' and writes
+        the checkpoint.
+        """
+        # The rows are written in the order of the input, though some of them may be left out
+        while True:
+            row_id, position = self._positions.popleft()
+            if row_id == article_id:
+                break
+        if position - self.rows < self.interval:
+            return
+
+        for file in files:
+            file.flush()
+        outputs.flush()
+
+        state = dict(self._input, wikiPageID=article_id, offset=outputs.tell(), rows=position)
+        with open(self.path + ".tmp", 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self._state = state
+
+    def commit(self):
+        """
+        Renames the partial output to the output file and removes the checkpoint.
+        Called only once all the rows were written and the output closed.
+        """
+        os.replace(self.partial_file, self.output_file)
+        if exists(self.path):
+            os.remove(self.path)
+
+def _article_at(input_file, position):
+    """
+    Returns the wikiPageID of the row of the input file at the position, counted from 1, or None if
+    the file has fewer rows
+    """
+    with storage.RowReader(input_file, decode=[]) as inputs:
+        for row in islice(inputs, position - 1, position):
+            return row.get("wikiPageID")
+    return None
@@ -0,0 +1,134 @@
+""" config.py - Defines the configuration of a run of the pipeline """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from os.path import abspath, basename, dirname, join
+import glob
+import json
+import os
+
+# Defaults of the configuration, used when neither the configuration file nor the command line sets them
+INPUT_GLOBS = ["/home/daniel/Repositories/ruffusTests/MyTests/Organisation/*.csv",
+               "/home/daniel/Repositories/ruffusTests/MyTests/Person/*.csv",
+               "/home/daniel/Repositories/ruffusTests/MyTests/Place/*.csv"]
+ARTICLE_STORE = "/home/daniel/Documents/wikipedia dump/wikipedia2016.db"
+
+# Name of the Ruffus history file kept in the work folder
+HISTORY_FILE = ".ruffus_history.sqlite"
+
+class RunConfig:
+    """
+    The configuration of a run of the pipeline, resolved once at startup and passed to the tasks:
+        - input_globs - Glob patterns of the input .csv files, i.e. 'data/Person/*.csv'. The entity
+          type of the files is taken from the name of their folder or their own (see 'tasks._entity_type_flag')
+        - article_store - The SQLite dump of the Wikipedia articles, or an article store packed from it
+          (see 'articlestore.py')
+        - work_dir - Folder of the intermediate files: the .stN files, the shards, the discarded rows
+          and the gazetteer. If None, they are written next to the input files, as before
+        - output_dir - Folder of the .conllu files. If None, they are written into the 'work_dir'
+
+    The files of an input file are written into a subfolder named after its folder, i.e.
+    'work_dir/Person/person0.st2', which keeps its entity type. Each task writes its own files only,
+    so pipelines run at once with different work folders don't share any file.
+    """
+
+    FIELDS = ("input_globs","article_store","work_dir","output_dir")
+
+    def __init__(self, input_globs=INPUT_GLOBS, article_store=ARTICLE_STORE, work_dir=None, output_dir=None):
+        self.input_globs = list(input_globs)
+        self.article_store = abspath(article_store)
+        self.work_dir = abspath(work_dir) if work_dir is not None else None
+        self.output_dir = abspath(output_dir) if output_dir is not None else self.work_dir
+        self.input_files = self._input_files()
+
+    @classmethod
+    def load(cls, path=None, **values):
+        """
+        Returns the configuration of the JSON file with some of the FIELDS keys, if sent. Relative paths
+        of the file are relative to its folder. The keyword arguments that are not None replace its values.
+        """
+        fields = {}
+        if path is not None:
+            with open(path) as file:
+                fields = json.load(file)
+            unknown = set(fields) - set(cls.FIELDS)
+            if unknown:
+                raise ValueError("Unknown keys in the configuration %s: %s"%(path, ", ".join(sorted(unknown))))
+            folder = dirname(abspath(path))
+            for key, value in fields.items():
+                if key == "input_globs":
+                    fields[key] = [join(folder, pattern) for pattern in value]
+                elif value is not None:
+                    fields[key] = join(folder, value)
+        fields.update((key, value) for key, value in values.items() if value is not None)
+        return cls(**fields)
+
+    def to_dict(self):
+        """
+        Returns the dict of the FIELDS, as written into a configuration file
+        """
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def _input_files(self):
+        """
+        Returns the input files matching the globs, in the order of the globs, each once
+        """
+        files = []
+        seen = set()
+        for pattern in self.input_globs:
+            for file in sorted(glob.glob(pattern)):
+                if abspath(file) not in seen:
+                    seen.add(abspath(file))
+                    files.append(file)
+
+        # The files of input files with the same name in folders with the same name would collide
+        if self.work_dir is not None:
+            names = {}
+            for file in files:
+                name = join(basename(dirname(abspath(file))), basename(file))
+                if name in names:
+                    raise ValueError("The input files %s and %s would be written into the same files of %s"%(names[name], file, self.work_dir))
+                names[name] = file
+        return files
+
+    def make_dirs(self):
+        """
+        Creates the subfolders of the work and output folders for the folders of the input files
+        """
+        for folder in (self.work_dir, self.output_dir):
+            if folder is None:
+                continue
+            for file in self.input_files:
+                os.makedirs(join(folder, basename(dirname(abspath(file)))), exist_ok=True)
+
+    def work_path(self, name):
+        """
+        Returns the Ruffus output of a task writing into the work folder (see 'ruffus.formatter'), in
+        which 'name' is the file name, i.e. '{basename[0]}.st1'
+        """
+        if self.work_dir is None:
+            return "{path[0]}/" + name
+        return join(self.work_dir, "{subdir[0][0]}", name)
+
+    def output_path(self, name):
+        """
+        Returns the Ruffus output of a task writing into the output folder, as 'work_path'
+        """
+        if self.output_dir is None:
+            return "{path[0]}/" + name
+        return join(self.output_dir, "{subdir[0][0]}", name)
+
+    def work_file(self, name):
+        """
+        Returns the path of a file of the whole run in the work folder, i.e. the gazetteer
+        """
+        if self.work_dir is None:
+            return name
+        return join(self.work_dir, name)
@@ -0,0 +1,551 @@
+""" fetcher.py - Defines a concurrent client of the MediaWiki API fetching the wikitext of the articles missing from the dump """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from urllib.parse import urljoin, urlsplit, urlencode, parse_qs
+import argparse
+import threading
+import asyncio
+import sqlite3
+import json
+import gzip
+import time
+import ssl
+
+import manifest
+
+# API of the Portuguese Wikipedia
+API_URL = "https://pt.wikipedia.org/w/api.php"
+
+# Sent with every request, as asked by the Wikimedia API etiquette
+USER_AGENT = "NerDatasetPipeline/1.0 (danielssmenezes@gmail.com)"
+
+# Maximum number of page ids of a single API request
+BATCH_SIZE = 50
+
+# Responses of the statuses below are retried after a backoff
+_RETRIED_STATUSES = {429, 500, 502, 503, 504}
+
+# Responses of the statuses below are followed to their 'Location', up to MAX_REDIRECTS times a request
+_REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+MAX_REDIRECTS = 5
+
+class FetchError(Exception):
+    """
+    Raised when the API answers a request with an unexpected status or an error
+    """
+
+class ResponseCache:
+    """
+    SQLite cache of the fetched articles, keyed by the API URL and the page id.
+    Pages missing from the API are cached too, with None as their text.
+    The file may be shared by tasks running at the same time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS Pages (key TEXT PRIMARY KEY, title TEXT, text TEXT, fetched REAL)")
+        self._conn.commit()
+
+    def get_many(self, api_url, page_ids):
+        """
+        Returns a dict mapping the cached page ids to their pair (title, text)
+        """
+        keys = {"%s#%s"%(api_url, page_id): page_id for page_id in page_ids}
+        return {keys[key]: (title, text)
+                for key, title, text in manifest.select_in(self._conn, "SELECT key, title, text FROM Pages WHERE key IN (%s)", keys)}
+
+    def put_many(self, api_url, pages):
+        """
+        Caches the pairs (title, text) of the dict of pages, keyed by page id
+        """
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO Pages VALUES (?,?,?,?)",
+                                   [("%s#%s"%(api_url, page_id), title, text, time.time()) for page_id, (title, text) in pages.items()])
+
+    def close(self):
+        self._conn.close()
+
+class _RateLimiter:
+    """
+    Spaces the requests so that at most 'rate' requests start each second
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+class WikipediaFetcher:
+    """
+    Fetches the wikitext of articles by page id from the MediaWiki API at 'api_url'.
+
+    The pages are requested in batches of 'batch_size' ids, with at most 'concurrency' requests at
+    once, started at no more than 'rate' requests per second. The HTTP connections are kept alive
+    and reused by the following requests, also across calls to 'fetch'. Failed requests (timeouts,
+    closed connections, statuses 429 and 5xx) are retried up to 'retries' times, waiting
+    'backoff' * 2^attempt seconds, or the time asked by the server in 'Retry-After'. Redirects are
+    followed, and the following requests are sent straight to the location of permanent ones (the
+    pages are still cached under 'api_url').
+    Counts the 'requests', the 'retried' ones and the pages whose requests 'failed'.
+
+    If a 'cache_file' is sent, the fetched pages are cached in it (see 'ResponseCache') and never
+    requested again.
+    """
+
+    def __init__(self, api_url=API_URL, concurrency=4, rate=10.0, retries=3, backoff=1.0, timeout=60.0,
+                 cache_file=None, batch_size=BATCH_SIZE):
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+
+        self._origin, self._path = _split_url(api_url)
+        self._rate = rate
+
+        self._cache = ResponseCache(cache_file) if cache_file is not None else None
+        self._loop = asyncio.new_event_loop()
+        # Connections kept alive, by origin (https, host, port)
+        self._idle = {}
+        # Created in the event loop by '_fetch_all'
+        self._semaphore = None
+        self._limiter = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def fetch(self, page_ids):
+        """
+        Returns a dict mapping each of the page ids to the pair (title, wikitext) of its article,
+        or None if the article is missing or could not be fetched
+        """
+        page_ids = [str(page_id) for page_id in dict.fromkeys(page_ids)]
+        results = {}
+        if self._cache is not None:
+            results.update(self._cache.get_many(self.api_url, page_ids))
+
+        missing = [page_id for page_id in page_ids if page_id not in results]
+        if missing:
+            fetched = self._loop.run_until_complete(self._fetch_all(missing))
+            if self._cache is not None:
+                self._cache.put_many(self.api_url, fetched)
+            results.update(fetched)
+
+        return {page_id: results[page_id] if page_id in results and results[page_id][1] is not None else None
+                for page_id in page_ids}
+
+    async def _fetch_all(self, page_ids):
+        """
+        Returns the dict of the pairs (title, text) of the pages fetched, keyed by page id. The text
+        of the pages the API marked as missing is None. Pages whose requests failed are left out.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._limiter = _RateLimiter(self._rate)
+        batches = [page_ids[i:i+self.batch_size] for i in range(0, len(page_ids), self.batch_size)]
+
+        results = {}
+        for batch, pages in zip(batches, await asyncio.gather(*[self._fetch_batch(batch) for batch in batches], return_exceptions=True)):
+            if isinstance(pages, Exception):
+                print("Could not fetch %d pages from %s: %s"%(len(batch), self.api_url, pages))
+                self.failed += len(batch)
+                continue
+            results.update(pages)
+            if len(pages) < len(batch):
+                print("Could not fetch %d pages from %s: not in the responses"%(len(batch) - len(pages), self.api_url))
+                self.failed += len(batch) - len(pages)
+        return results
+
+    async def _fetch_batch(self, page_ids):
+        """
+        Returns the dict of the pairs (title, text) of the pages, keyed by page id. The text of the
+        pages the API marked as missing is None, and the pages it returned no revision of are left out.
+
+        The API returns the content of as many pages as fit in a response, and a 'continue' to be sent
+        in the next request for the others, which is followed until the pages are complete.
+        Raises a FetchError if the API answers with an error.
+        """
+        parameters = {"action":"query", "prop":"revisions", "rvprop":"content", "rvslots":"main",
+                      "format":"json", "formatversion":"2", "pageids":"|".join(page_ids)}
+        pages = {}
+        continuation = {}
+        while True:
+            response = json.loads((await self._get(urlencode(dict(parameters, **continuation)))).decode("utf-8"))
+            if "error" in response:
+                error = response["error"]
+                raise FetchError("%s answered with the error %s: %s"%(self.api_url, error.get("code"), error.get("info")))
+
+            for page in response.get("query", {}).get("pages", []):
+                page_id = str(page.get("pageid", ""))
+                revisions = page.get("revisions")
+                if page.get("missing") or page.get("invalid"):
+                    pages[page_id] = (page.get("title"), None)
+                elif revisions:
+                    revision = revisions[0]
+                    text = revision["slots"]["main"]["content"] if "slots" in revision else revision.get("content")
+                    pages[page_id] = (page.get("title"), text)
+
+            if "continue" not in response:
+                return {page_id: pages[page_id] for page_id in page_ids if page_id in pages}
+            if response["continue"] == continuation:
+                raise FetchError("%s answered with the same continuation twice: %s"%(self.api_url, continuation))
+            continuation = response["continue"]
+
+    async def _get(self, query):
+        """
+        Returns the body of the response to a GET of the API with the query, retrying the failed requests
+        """
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt
+            host = self._origin[1]
+            async with self._semaphore:
+                try:
+                    status, headers, body = await asyncio.wait_for(self._follow("%s?%s"%(self._path, query)), self.timeout)
+                except (OSError, EOFError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as error:
+                    if attempt == self.retries:
+                        raise
+                    print("Retrying %s after %.1fs: %r"%(host, delay, error))
+                else:
+                    if status == 200:
+                        return body
+                    if status not in _RETRIED_STATUSES or attempt == self.retries:
+                        raise FetchError("%s answered with status %d"%(host, status))
+                    if "retry-after" in headers and headers["retry-after"].isdigit():
+                        delay = float(headers["retry-after"])
+                    print("Retrying %s after %.1fs: status %d"%(host, delay, status))
+            self.retried += 1
+            await asyncio.sleep(delay)
+
+    async def _follow(self, target):
+        """
+        Sends a GET request of the target of the API origin and follows the redirects of the responses.
+        Returns the tuple (status, headers, body) of the last response. After a permanent redirect,
+        the following requests are sent to its location.
+        """
+        origin = self._origin
+        permanent = True
+        for redirect in range(MAX_REDIRECTS + 1):
+            await self._limiter.wait()
+            self.requests += 1
+            status, headers, body = await self._request(origin, target)
+            if status not in _REDIRECT_STATUSES or "location" not in headers:
+                return status, headers, body
+            if redirect == MAX_REDIRECTS:
+                raise FetchError("%s redirected the request more than %d times"%(origin[1], MAX_REDIRECTS))
+
+            url = urljoin(_join_url(origin, target), headers["location"])
+            origin, path = _split_url(url)
+            target = "%s?%s"%(path, urlsplit(url).query) if urlsplit(url).query else path
+            permanent = permanent and status in (301, 308)
+            if permanent:
+                self._origin, self._path = origin, path
+
+    async def _request(self, origin, target):
+        """
+        Sends a GET request of the target to the origin (https, host, port) over an idle connection,
+        or a new one. Returns the tuple (status, headers, body). The connection is kept for the next
+        requests unless the server closes it.
+        """
+        idle = self._idle.get(origin)
+        if idle:
+            reader, writer = idle.pop()
+            try:
+                return await self._exchange(reader, writer, origin, target)
+            except (EOFError, ConnectionError):
+                # The server closed the idle connection, the request is sent again over a new one
+                pass
+
+        https, host, port = origin
+        context = ssl.create_default_context() if https else None
+        reader, writer = await asyncio.open_connection(host, port, ssl=context)
+        return await self._exchange(reader, writer, origin, target)
+
+    async def _exchange(self, reader, writer, origin, target):
+        """
+        Sends the request over the connection and reads the response (see '_request')
+        """
+        host = origin[1]
+        try:
+            writer.write(("GET %s HTTP/1.1\r\nHost: %s\r\nUser-Agent: %s\r\nAccept-Encoding: gzip\r\nConnection: keep-alive\r\n\r\n"
+                          %(target, host, USER_AGENT)).encode("ascii"))
+            await writer.drain()
+
+            status_line = await reader.readline()
+            if not status_line:
+                raise EOFError("Connection closed by %s"%(host))
+            status = int(status_line.split()[1])
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            keep_alive = headers.get("connection", "").lower() != "close"
+            if headers.get("transfer-encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int((await reader.readline()).split(b";")[0], 16)
+                    if size == 0:
+                        await reader.readline()
+                        break
+                    chunks.append(await reader.readexactly(size))
+                    await reader.readline()
+                body = b"".join(chunks)
+            elif "content-length" in headers:
+                body = await reader.readexactly(int(headers["content-length"]))
+            else:
+                body = await reader.read()
+                keep_alive = False
+
+            if headers.get("content-encoding", "").lower() == "gzip":
+                body = gzip.decompress(body)
+        except BaseException:
+            writer.close()
+            raise
+
+        if keep_alive:
+            self._idle.setdefault(origin, []).append((reader, writer))
+        else:
+            writer.close()
+        return status, headers, body
+
+    def close(self):
+        """
+        Closes the connections kept alive and the cache
+        """
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle = {}
+        self._loop.run_until_complete(asyncio.sleep(0))
+        self._loop.close()
+        if self._cache is not None:
+            self._cache.close()
+
+def _split_url(url):
+    """
+    Returns the pair (origin, path) of the URL, where origin is the tuple (https, host, port)
+    """
+    url = urlsplit(url)
+    https = url.scheme == "https"
+    return (https, url.hostname, url.port or (443 if https else 80)), url.path or "/"
+
+def _join_url(origin, path):
+    """
+    Returns the URL of the path at the origin (see '_split_url')
+    """
+    https, host, port = origin
+    return "%s://%s:%d%s"%("https" if https else "http", host, port, path)
+
+class MockServer:
+    """
+    Local stand-in of the MediaWiki API, answering the queries of 'WikipediaFetcher' with the articles
+    of a SQLite dump with the table WikiElement(id, title, content), i.e. the 'wikipedia.db' of
+    'benchmarks.make_corpus'. Used for trying the fetcher without reaching Wikipedia.
+
+    Keeps the connections alive as the API does. Every 'fail_every' requests, one is answered
+    with the status 503, to exercise the retries. As the API does:
+        - At most 'page_limit' pages are returned with their content, along with a 'continue' for the others
+        - Requests of more than BATCH_SIZE page ids are answered with the error 'toomanyvalues'
+        - Requests of any other path than the one of the 'url' are redirected to it, as for a moved API
+    Counts the 'requests' and 'connections'.
+    """
+
+    def __init__(self, db, host="127.0.0.1", port=0, fail_every=0, delay=0.0, page_limit=0):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with server._lock:
+                    server.connections += 1
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    failed = server.fail_every and server.requests % server.fail_every == 0
+                if server.delay:
+                    time.sleep(server.delay)
+
+                url = urlsplit(self.path)
+                if failed:
+                    body = b"Service unavailable"
+                    self.send_response(503)
+                elif url.path != server.PATH:
+                    body = b""
+                    self.send_response(301)
+                    self.send_header("Location", "%s?%s"%(server.PATH, url.query))
+                else:
+                    query = parse_qs(url.query)
+                    body = json.dumps(server._response(query.get("pageids", [""])[0].split("|"), query.get("rvcontinue", [None])[0])).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.db = db
+        self.fail_every = fail_every
+        self.delay = delay
+        self.page_limit = page_limit
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    # Path of the API, the others are redirected to it
+    PATH = "/w/api.php"
+
+    @property
+    def url(self):
+        """
+        The API URL to be sent to 'WikipediaFetcher'
+        """
+        host, port = self._server.server_address[:2]
+        return "http://%s:%d%s"%(host, port, self.PATH)
+
+    def _response(self, page_ids, rvcontinue=None):
+        """
+        Returns the response of the API to a query of the pages of the ids, continuing from the
+        page of the 'rvcontinue' of a previous response if sent
+        """
+        if len(page_ids) > BATCH_SIZE:
+            return {"error":{"code":"toomanyvalues", "info":"Too many values supplied for parameter \"pageids\". The limit is %d."%(BATCH_SIZE)}}
+
+        pages = self._pages(page_ids)
+        start = 0
+        if rvcontinue is not None:
+            start = next(i for i, page in enumerate(pages) if str(page["pageid"]) == rvcontinue.split("|")[0])
+        response = {}
+        with_content = 0
+        for i, page in enumerate(pages):
+            if "revisions" not in page:
+                continue
+            if i < start or "continue" in response:
+                del page["revisions"]
+            elif self.page_limit and with_content == self.page_limit:
+                response["continue"] = {"rvcontinue":"%d|0"%(page["pageid"]), "continue":"||"}
+                del page["revisions"]
+            else:
+                with_content += 1
+        if "continue" not in response:
+            response["batchcomplete"] = True
+        response["query"] = {"pages":pages}
+        return response
+
+    def _pages(self, page_ids):
+        """
+        Returns the list of the pages of the ids, as the API does in its 'formatversion' 2
+        """
+        conn = sqlite3.connect(self.db)
+        try:
+            articles = {}
+            for page_id in page_ids:
+                if page_id.isdigit():
+                    for title, content in conn.execute("SELECT title, content FROM WikiElement WHERE id = ?", (int(page_id),)):
+                        articles[page_id] = (title, content)
+        finally:
+            conn.close()
+
+        pages = []
+        for page_id in page_ids:
+            if page_id in articles:
+                title, content = articles[page_id]
+                pages.append({"pageid":int(page_id), "ns":0, "title":title,
+                              "revisions":[{"slots":{"main":{"contentmodel":"wikitext", "content":content}}}]})
+            else:
+                pages.append({"pageid":int(page_id) if page_id.isdigit() else 0, "missing":True})
+        return pages
+
+    def start(self):
+        """
+        Serves the requests in a background thread
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetches articles from the MediaWiki API, or serves a local stand-in of it")
+    commands = parser.add_subparsers(dest="command")
+
+    fetch = commands.add_parser("fetch", help="Prints the titles and sizes of the fetched articles")
+    fetch.add_argument("page_ids", nargs="+")
+    fetch.add_argument("--api_url", default=API_URL)
+    fetch.add_argument("--cache", default=None, help="SQLite file caching the fetched articles")
+    fetch.add_argument("--concurrency", type=int, default=4)
+    fetch.add_argument("--rate", type=float, default=10.0, help="Maximum number of requests per second")
+
+    serve = commands.add_parser("serve", help="Serves the articles of a SQLite dump as the MediaWiki API does")
+    serve.add_argument("db")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--fail_every", type=int, default=0, help="Answers one of this many requests with the status 503")
+    serve.add_argument("--page_limit", type=int, default=0, help="Maximum number of pages returned with their content by a response")
+
+    options = parser.parse_args()
+    if options.command == "fetch":
+        with WikipediaFetcher(options.api_url, options.concurrency, options.rate, cache_file=options.cache) as fetcher:
+            start = time.time()
+            for page_id, article in fetcher.fetch(options.page_ids).items():
+                print("%s\t%s"%(page_id, "%s (%d characters)"%(article[0], len(article[1])) if article else "missing"))
+            print("%d requests, %d retried, %d pages failed, in %.2fs"%(fetcher.requests, fetcher.retried, fetcher.failed, time.time() - start))
+    elif options.command == "serve":
+        server = MockServer(options.db, port=options.port, fail_every=options.fail_every, page_limit=options.page_limit)
+        print("Serving %s at %s"%(options.db, server.url))
+        try:
+            server._server.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
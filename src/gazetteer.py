@@ -0,0 +1,180 @@
+""" gazetteer.py - Defines a multi-pattern matcher over the names of the entities of the pipeline """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from collections import deque
+import pickle
+
+class Gazetteer:
+    """
+    Aho-Corasick automaton over the characters of a set of entity names.
+
+    Finds all the names occuring in a text with a single scan of the text. A name is found
+    whenever 'name in text' is True, as done by 'tasks.filter_sentences_by_mentions', or with
+    'whole_words' only where it isn't part of a longer word, i.e. "7" isn't found in "17 de maio".
+
+    Each name may be associated with any number of values, i.e. the ids of the entities it names.
+    The automaton is made of lists and dicts only, so it can be pickled and sent to worker processes.
+    """
+
+    def __init__(self, names=()):
+        # Per state: the transitions, the fallback state, the id of the name ending in the state and
+        # the ids of all the names ending in the state, including those ending in its fallback states
+        self._goto = [{}]
+        self._fail = [0]
+        self._end = [None]
+        self._output = [[]]
+
+        self.names = []
+        self.values = []
+        self._ids = {}
+        self._built = True
+
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def name_id(self, name):
+        """
+        Returns the id of the name, or None if the name was not added
+        """
+        return self._ids.get(name)
+
+    def add(self, name, value=None):
+        """
+        Adds the name to the automaton, associating the value to it if sent.
+        Empty names are ignored.
+        Returns the id of the name.
+        """
+        if not name:
+            return None
+
+        name_id = self._ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self._ids[name] = name_id
+            self.names.append(name)
+            self.values.append(set())
+
+            state = 0
+            for char in name:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._end.append(None)
+                    self._output.append([])
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._end[state] = name_id
+            self._built = False
+
+        if value is not None:
+            self.values[name_id].add(value)
+        return name_id
+
+    def build(self):
+        """
+        Computes the fallback transitions of the automaton.
+        Called by 'find' when names were added since the last build.
+        """
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            self._output[state] = [self._end[state]] if self._end[state] is not None else []
+            queue.append(state)
+
+        # Breadth first, so the fallback states are complete when reached
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                fallback = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = fallback
+
+                # Names ending in the fallback state also end in this state
+                output = [self._end[next_state]] if self._end[next_state] is not None else []
+                self._output[next_state] = output + self._output[fallback]
+
+        self._built = True
+
+    def find(self, text, whole_words=False):
+        """
+        Returns the set of the ids of the names occuring in the text.
+        With 'whole_words', the names whose first or last character is alphanumeric are found only
+        where the character before or after them in the text is not (see '_whole_word').
+        """
+        if not self._built:
+            self.build()
+
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+
+        found = set()
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                if whole_words:
+                    found.update(name_id for name_id in output[state] if self._whole_word(text, position, name_id))
+                else:
+                    found.update(output[state])
+        return found
+
+    def _whole_word(self, text, position, name_id):
+        """
+        Returns whether the name found ending at the position of the text is not part of a longer word
+        """
+        name = self.names[name_id]
+        start = position + 1 - len(name)
+        if start > 0 and name[0].isalnum() and text[start-1].isalnum():
+            return False
+        return not (position + 1 < len(text) and name[-1].isalnum() and text[position+1].isalnum())
+
+    def mentions(self, text, whole_words=False):
+        """
+        Returns the sorted list of the names occuring in the text (see 'find')
+        """
+        return sorted(self.names[name_id] for name_id in self.find(text, whole_words))
+
+    def save(self, path):
+        """
+        Pickles the automaton into the file
+        """
+        if not self._built:
+            self.build()
+        with open(path, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+# Loaded gazetteers, one for each path in each process
+_loaded = {}
+
+def load(path):
+    """
+    Returns the gazetteer pickled in the file.
+    The file is read once for each process.
+    """
+    if path not in _loaded:
+        with open(path, 'rb') as file:
+            _loaded[path] = pickle.load(file)
+    return _loaded[path]
@@ -0,0 +1,180 @@
+""" manifest.py - Defines the manifests of the outputs of the pipeline, used to process only new or changed rows """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from functools import partial
+import hashlib
+import sqlite3
+import pickle
+import json
+import sys
+
+# Number of pending writes committed at once
+_FLUSH_SIZE = 1000
+
+# Version of the results kept in the manifests. Part of the signature of every function (see
+# 'code_signature'), increased when the results change without the sources of the functions changing,
+# i.e. on changes to the modules they call
+MANIFEST_VERSION = 2
+
+def function_signature(function):
+    """
+    Returns a string identifying the function and the arguments bound to it by 'functools.partial'.
+    Functions are identified by their module and name, so the signature is the same across runs.
+    """
+    if isinstance(function, partial):
+        arguments = [function_signature(argument) for argument in function.args]
+        arguments += ["%s=%s"%(name, function_signature(value)) for name, value in sorted(function.keywords.items())]
+        return "%s(%s)"%(function_signature(function.func), ", ".join(arguments))
+    if callable(function) and hasattr(function, "__qualname__"):
+        return "%s.%s"%(getattr(function, "__module__", ""), function.__qualname__)
+    return repr(function)
+
+def file_digest(path):
+    """
+    Returns the sha256 hex digest of the contents of the file, used in the signatures of the
+    functions depending on it
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _function_modules(function):
+    """
+    Yields the names of the modules of the function and of the functions bound to it by 'functools.partial'
+    """
+    if isinstance(function, partial):
+        yield from _function_modules(function.func)
+        for argument in list(function.args) + list(function.keywords.values()):
+            yield from _function_modules(argument)
+    elif callable(function) and getattr(function, "__module__", None):
+        yield function.__module__
+
+def source_digest(function):
+    """
+    Returns the sha256 hex digest of the source files of the modules of the function and of the
+    functions bound to it, so that the results computed by older code are not reused
+    """
+    paths = set()
+    for name in _function_modules(function):
+        path = getattr(sys.modules.get(name), "__file__", None)
+        if path is not None and path.endswith(".py"):
+            paths.add(path)
+    return hashlib.sha256("\n".join(file_digest(path) for path in sorted(paths)).encode()).hexdigest()
+
+def code_signature(function):
+    """
+    Returns the signature of the results of the function: its 'function_signature', the MANIFEST_VERSION
+    and the 'source_digest' of its code
+    """
+    return "%s\nversion %d\n%s"%(function_signature(function), MANIFEST_VERSION, source_digest(function))
+
+def select_in(conn, query, keys, batch_size=500):
+    """
+    Yields the rows of the query for the keys, where the query has a '%s' in place of the
+    parameters of its 'IN (...)', i.e. "SELECT key, result FROM Rows WHERE key IN (%s)". The keys
+    are sent in batches, since older versions of SQLite limit a query to 999 parameters.
+    """
+    keys = list(keys)
+    for i in range(0, len(keys), batch_size):
+        batch = keys[i:i+batch_size]
+        yield from conn.execute(query%(",".join("?"*len(batch))), batch)
+
+def _json_value(value):
+    """
+    Returns a JSON value for the values of the rows JSON can't write: the bytes and arrays of the
+    packed matches of the names (see 'annotations.py')
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return list(value)
+
+class Manifest:
+    """
+    Maps the rows recieved by a task to the results computed for them in previous runs.
+
+    The manifest of an output file is kept in the SQLite file 'output_file.manifest'. Each row is
+    keyed by a hash of its values and of the 'signature' of the function applied to it, and its
+    'wikiPageID' is kept along with the pickled result.
+
+    Rows not found in a run are removed from the manifest when it is closed. Including the
+    'code_signature' of the function in the signature, the results of older code are not reused
+    and are removed too.
+
+    Counts the 'hits' and 'misses' of 'get_many'.
+    """
+
+    def __init__(self, output_file, signature, row_key=None):
+        self.path = output_file + ".manifest"
+        self.hits = 0
+        self.misses = 0
+        self._prefix = ("%s\n"%(signature)).encode()
+        self._row_key = row_key
+        self._puts = []
+        self._touches = []
+
+        self._conn = sqlite3.connect(self.path, timeout=60)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS Rows (key BLOB PRIMARY KEY, wikiPageID TEXT, result BLOB, run INTEGER)")
+        self._conn.commit()
+        self._run = self._conn.execute("SELECT COALESCE(MAX(run),0) + 1 FROM Rows").fetchone()[0]
+
+    def key(self, row):
+        """
+        Returns the key of the row. Rows may be pairs whose first element is the row when 'row_key' is sent
+        """
+        if self._row_key is not None:
+            row = self._row_key(row)
+        return hashlib.sha256(self._prefix + json.dumps(row, sort_keys=True, default=_json_value).encode()).digest()
+
+    def get_many(self, keys):
+        """
+        Returns a dict mapping the keys found in the manifest to their results
+        """
+        results = {key: pickle.loads(result)
+                   for key, result in select_in(self._conn, "SELECT key, result FROM Rows WHERE key IN (%s)", set(keys))}
+
+        self._touches.extend((self._run, key) for key in results)
+        self.hits += sum(1 for key in keys if key in results)
+        self.misses += sum(1 for key in keys if key not in results)
+        if len(self._touches) >= _FLUSH_SIZE:
+            self.flush()
+        return results
+
+    def put(self, key, row, result):
+        """
+        Records the result computed for the row
+        """
+        if self._row_key is not None:
+            row = self._row_key(row)
+        self._puts.append((key, str(row.get("wikiPageID","")), pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), self._run))
+        if len(self._puts) >= _FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the pending results and the rows found in this run
+        """
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO Rows VALUES (?,?,?,?)", self._puts)
+            self._conn.executemany("UPDATE Rows SET run = ? WHERE key = ?", self._touches)
+        self._puts = []
+        self._touches = []
+
+    def close(self):
+        """
+        Writes the pending results and removes the rows not found in this run.
+        Called only once all the rows were processed.
+        """
+        self.flush()
+        with self._conn:
+            self._conn.execute("DELETE FROM Rows WHERE run < ?", (self._run,))
+        self._conn.close()
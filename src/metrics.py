@@ -0,0 +1,323 @@
+""" metrics.py - Defines the instrumentation of the tasks of the pipeline """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from os.path import basename, exists, getsize, join
+from collections import Counter
+from operator import itemgetter
+from functools import wraps
+import threading
+import argparse
+import heapq
+import cProfile
+import json
+import time
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The metrics of a run are written as JSON lines into the file, one line for each:
+#   - Stage run on a file: {"type":"stage", "stage", "input_file", "output_file", "wall", "cpu",
+#     "rows_in", "rows_out", "discarded", "peak_rss", "bytes_read", "bytes_written", "counters", "unmatched_aliases", ...}
+#   - Article processed by a stage: {"type":"article", "stage", "input_file", "wikiPageID", "wall", "cpu"}
+# Set by 'configure', no metrics are written while it is None
+_config = {"metrics_file":None, "profile_stage":None, "profile_dir":".", "run":None}
+
+_lock = threading.Lock()
+_local = threading.local()
+
+def configure(metrics_file=None, profile_stage=None, profile_dir="."):
+    """
+    Recieves:
+        - metrics_file - The JSON lines file to which the metrics are appended. If None, no metrics are written
+        - profile_stage - The name of a stage (i.e. 'sentence_splitting') to be run under cProfile
+        - profile_dir - The folder of the profiles, written as 'stage.input_file.prof'
+
+    Called once before running the tasks. Processes started afterwards inherit the configuration.
+    """
+    _config["metrics_file"] = metrics_file
+    _config["profile_stage"] = profile_stage
+    _config["profile_dir"] = profile_dir
+    _config["run"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    # Created at once, as an input of the report of the pipeline even if no task is run
+    if metrics_file is not None:
+        open(metrics_file, 'a').close()
+
+def enabled():
+    """
+    True if the metrics are written
+    """
+    return _config["metrics_file"] is not None
+
+def _usage():
+    """
+    Returns the pair (CPU seconds, peak RSS in bytes) of this process and of its finished child processes
+    """
+    if resource is None:
+        return time.process_time(), 0
+    # The threads of the tasks run by Ruffus with --use_threads are measured separately where possible
+    own = resource.getrusage(getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF))
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    # ru_maxrss is in kilobytes on Linux
+    return cpu, max(own.ru_maxrss, children.ru_maxrss) * 1024
+
+def _size(files):
+    """
+    Returns the total size in bytes of the existing files
+    """
+    if isinstance(files, str):
+        files = [files]
+    return sum(getsize(file) for file in files if isinstance(file, str) and exists(file))
+
+def _write(records):
+    """
+    Appends the records to the metrics file
+    """
+    lines = "".join(json.dumps(record) + "\n" for record in records)
+    with _lock, open(_config["metrics_file"], 'a') as file:
+        file.write(lines)
+
+class StageMetrics:
+    """
+    The counters of a stage run on a file, updated by the stage while it runs (see 'current_stage').
+    Written to the metrics file when the stage ends.
+
+    Besides the rows, the stages count what they produce in 'counters', i.e. the sentences and tokens
+    written, and the names of the articles never matched in their sentences in 'unmatched_aliases'.
+    """
+
+    # Number of article records kept before being written
+    _BUFFER_SIZE = 1000
+
+    def __init__(self, name, input_file, output_file):
+        self.name = name
+        self.input_file = input_file
+        self.output_file = output_file
+        self.enabled = enabled()
+        self.rows_in = 0
+        self.rows_out = 0
+        self.discarded = 0
+        self.counters = Counter()
+        self.unmatched_aliases = Counter()
+        self._articles = []
+
+    def count(self, name, value=1):
+        """
+        Adds the value to the counter of the stage
+        """
+        self.counters[name] += value
+
+    def aliases(self, names, unmatched, pseudo_names=()):
+        """
+        Records the names of an article and those of them never matched in its sentences. The
+        'pseudo_names', i.e. the wikiPageID and URL of the article listed among its names by older
+        versions of 'tasks.summarize_entity_names', are left out.
+        """
+        pseudo_names = set(pseudo_names)
+        names = [name for name in names if name not in pseudo_names]
+        unmatched = [name for name in unmatched if name not in pseudo_names]
+        self.counters["aliases"] += len(names)
+        self.counters["matched_aliases"] += len(names) - len(unmatched)
+        self.unmatched_aliases.update(unmatched)
+
+    def article(self, article_id, wall, cpu):
+        """
+        Records the time spent processing an article
+        """
+        if not self.enabled:
+            return
+        self._articles.append({"type":"article", "run":_config["run"], "stage":self.name, "input_file":self.input_file,
+                               "wikiPageID":article_id, "wall":wall, "cpu":cpu})
+        if len(self._articles) >= self._BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._articles:
+            _write(self._articles)
+            self._articles = []
+
+def current_stage():
+    """
+    Returns the metrics of the stage running in this thread, or metrics that are not written if
+    no stage is running
+    """
+    stage = getattr(_local, "stage", None)
+    if stage is None:
+        stage = StageMetrics(None, None, None)
+        stage.enabled = False
+    return stage
+
+def instrumented(function):
+    """
+    Decorates a stage function recieving the input and output files as its first arguments.
+
+    Records the wall and CPU time, the peak RSS, the bytes read and written and the counters of
+    the 'current_stage', and profiles the stage if it is the configured 'profile_stage'.
+    """
+    @wraps(function)
+    def wrapper(input_file, output_file, *args, **kwargs):
+        profile = _config["profile_stage"] == function.__name__
+        if not enabled() and not profile:
+            return function(input_file, output_file, *args, **kwargs)
+
+        stage = StageMetrics(function.__name__, input_file, output_file)
+        previous = getattr(_local, "stage", None)
+        _local.stage = stage
+
+        profiler = cProfile.Profile() if profile else None
+        start_cpu, _ = _usage()
+        start = time.time()
+        try:
+            if profiler is not None:
+                result = profiler.runcall(function, input_file, output_file, *args, **kwargs)
+            else:
+                result = function(input_file, output_file, *args, **kwargs)
+        finally:
+            _local.stage = previous
+
+        wall = time.time() - start
+        cpu, peak_rss = _usage()
+
+        if profiler is not None:
+            name = basename(input_file) if isinstance(input_file, str) else "merge"
+            profiler.dump_stats(join(_config["profile_dir"], "%s.%s.prof"%(function.__name__, name)))
+
+        if stage.enabled:
+            stage.flush()
+            _write([{"type":"stage", "run":_config["run"], "stage":stage.name, "input_file":input_file, "output_file":output_file,
+                     "pid":os.getpid(), "start":start, "wall":wall, "cpu":cpu - start_cpu,
+                     "rows_in":stage.rows_in, "rows_out":stage.rows_out, "discarded":stage.discarded,
+                     "peak_rss":peak_rss, "bytes_read":_size(input_file), "bytes_written":_size(output_file),
+                     "counters":stage.counters, "unmatched_aliases":stage.unmatched_aliases}])
+        return result
+    return wrapper
+
+def _records(metrics_file):
+    """
+    Yields the records of the metrics file
+    """
+    with open(metrics_file) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+def _latest_stages(metrics_file):
+    """
+    Returns a dict mapping each pair (stage, input file) to the record of its last run, leaving out
+    the files that no longer exist, i.e. the shards of a previous run (see 'tasks.shard_file')
+    """
+    stages = {}
+    for record in _records(metrics_file):
+        if record["type"] == "stage":
+            stages[(record["stage"], json.dumps(record["input_file"]))] = record
+    return {key: record for key, record in stages.items()
+            if not isinstance(record["input_file"], str) or exists(record["input_file"])}
+
+def report(metrics_file, top=10):
+    """
+    Recieves:
+        - metrics_file - The JSON lines file written by the instrumented stages
+        - top - The number of slowest articles and unmatched aliases reported
+
+    Returns a dict with the statistics of the last run of each stage on each file:
+        - 'stages' - For each stage, in the order in which they were run: the number of files, the sums of
+          the time, rows, bytes and 'counters' of its runs, the peak RSS, and the rows and megabytes read
+          per second of the stage
+        - 'slowest_articles' - The 'top' article records of the greatest wall time, of any stage
+        - 'aliases' - The number of names of the articles, of those matched in their sentences, the hit
+          rate and the 'top' names never matched in the greatest number of articles. Taken from the stage
+          run last among those matching the names, so a run with --fused is not added to one without it.
+    The metrics of the stages must be enabled (see 'configure') for the articles to be timed.
+    """
+    stages = _latest_stages(metrics_file)
+    records = sorted(stages.values(), key=itemgetter("start"))
+
+    summaries = {}
+    for record in records:
+        summary = summaries.setdefault(record["stage"], {"files":0, "wall":0.0, "cpu":0.0, "rows_in":0, "rows_out":0, "discarded":0,
+                                                         "bytes_read":0, "bytes_written":0, "peak_rss":0, "counters":Counter()})
+        summary["files"] += 1
+        for key in ("wall","cpu","rows_in","rows_out","discarded","bytes_read","bytes_written"):
+            summary[key] += record[key]
+        summary["peak_rss"] = max(summary["peak_rss"], record["peak_rss"])
+        summary["counters"].update(record.get("counters", {}))
+    for summary in summaries.values():
+        summary["rows_per_second"] = summary["rows_in"] / summary["wall"] if summary["wall"] else None
+        summary["mb_per_second"] = summary["bytes_read"] / 1024**2 / summary["wall"] if summary["wall"] else None
+
+    runs = {key: record["run"] for key, record in stages.items()}
+    articles = (record for record in _records(metrics_file)
+                if record["type"] == "article" and runs.get((record["stage"], json.dumps(record["input_file"]))) == record["run"])
+    slowest = heapq.nlargest(top, articles, key=itemgetter("wall"))
+
+    aliases = {"aliases":0, "matched":0, "hit_rate":None, "unmatched":[]}
+    alias_records = [record for record in records if record.get("counters", {}).get("aliases")]
+    if alias_records:
+        alias_stage = alias_records[-1]["stage"]
+        unmatched = Counter()
+        for record in alias_records:
+            if record["stage"] == alias_stage:
+                aliases["aliases"] += record["counters"]["aliases"]
+                aliases["matched"] += record["counters"].get("matched_aliases", 0)
+                unmatched.update(record["unmatched_aliases"])
+        aliases["hit_rate"] = aliases["matched"] / aliases["aliases"]
+        aliases["unmatched"] = unmatched.most_common(top)
+
+    return {"stages":summaries, "slowest_articles":slowest, "aliases":aliases}
+
+def format_report(statistics):
+    """
+    Returns the report (see 'report') as a text table
+    """
+    lines = ["%-30s %6s %9s %9s %9s %9s %9s %8s"%("stage","files","wall","rows in","rows out","discarded","rows/s","MB/s")]
+    for name, summary in statistics["stages"].items():
+        lines.append("%-30s %6d %9.1f %9d %9d %9d %9s %8s"%(name, summary["files"], summary["wall"], summary["rows_in"], summary["rows_out"],
+                     summary["discarded"], "%.1f"%(summary["rows_per_second"]) if summary["rows_per_second"] is not None else "-",
+                     "%.2f"%(summary["mb_per_second"]) if summary["mb_per_second"] is not None else "-"))
+        if summary["counters"]:
+            lines.append("    " + ", ".join("%s: %d"%(counter, value) for counter, value in sorted(summary["counters"].items())))
+
+    lines.append("")
+    lines.append("Slowest articles:")
+    for record in statistics["slowest_articles"]:
+        lines.append("    %9.3fs %-30s %s %s"%(record["wall"], record["stage"], record["wikiPageID"], basename(record["input_file"])))
+
+    aliases = statistics["aliases"]
+    if aliases["hit_rate"] is not None:
+        lines.append("")
+        lines.append("Aliases: %d of %d matched (%.1f%%). Never matched in the greatest number of articles:"%(
+                     aliases["matched"], aliases["aliases"], aliases["hit_rate"] * 100))
+        for name, articles in aliases["unmatched"]:
+            lines.append("    %6d %s"%(articles, name))
+    return "\n".join(lines)
+
+def write_report(metrics_file, output_file, top=10):
+    """
+    Writes the report of the metrics file (see 'report') into the JSON file and returns it
+    """
+    statistics = report(metrics_file, top)
+    with open(output_file, 'w') as file:
+        json.dump(statistics, file, indent=2)
+    return statistics
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reports the statistics of the runs of the pipeline from its metrics file")
+    parser.add_argument("metrics_file", help="The JSON lines file written with --metrics")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest articles and unmatched aliases reported")
+    parser.add_argument("--output", default=None, help="JSON file into which the report is also written")
+    args = parser.parse_args()
+    if args.output is not None:
+        print(format_report(write_report(args.metrics_file, args.output, args.top)))
+    else:
+        print(format_report(report(args.metrics_file, args.top)))
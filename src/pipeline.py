@@ -1,107 +1,247 @@
 from ruffus import *
-import postaggers
-import wikipedia
+import metrics
+import config
+import storage
 import tasks
 import json
 import csv
 import os
 import re
 
-def getFiles():
-    folders = ["/home/daniel/Repositories/ruffusTests/MyTests/Organisation",
-           "/home/daniel/Repositories/ruffusTests/MyTests/Person",
-           "/home/daniel/Repositories/ruffusTests/MyTests/Place"]
-    files =[]
-    for folder in folders:
-        for file in os.listdir(folder):
-            if file.endswith(".csv"):
-                files.append(os.path.join(folder,file))
-    return files
-
-starting_files =  getFiles()
-#print (starting_files)
+parser = cmdline.get_argparse(description="Builds a NER dataset from Wikipedia articles")
+parser.add_argument("--config", default=None,
+                    help="JSON file of the run configuration, with the keys 'input_globs', 'article_store', 'work_dir' and 'output_dir' "
+                         "(see config.py). The options below replace its values")
+parser.add_argument("--input", nargs="+", default=None,
+                    help="Glob patterns of the input .csv files, i.e. 'data/Person/*.csv'. The entity type of the files is taken from the folder names, or else from the file names, i.e. 'data/Person.csv'")
+parser.add_argument("--input_folders", nargs="+", default=None,
+                    help="Folders of the input .csv files, as --input 'folder/*.csv'")
+parser.add_argument("--wikipedia_db", default=None,
+                    help="The SQLite dump of the Wikipedia articles, or an article store packed from it with articlestore.py")
+parser.add_argument("--work_dir", default=None,
+                    help="Folder of the intermediate files, the discarded rows and the Ruffus history. By default they are written "
+                         "next to the input files. Pipelines run at once on the same input files must use different folders")
+parser.add_argument("--output_dir", default=None,
+                    help="Folder of the .conllu files, by default the --work_dir")
+parser.add_argument("--wikipedia_api", default=None,
+                    help="URL of the MediaWiki API from which the articles missing from --wikipedia_db are fetched, "
+                         "i.e. https://pt.wikipedia.org/w/api.php")
+parser.add_argument("--wikipedia_api_cache", default=None,
+                    help="SQLite file caching the articles fetched from --wikipedia_api across runs, i.e. api.cache")
+parser.add_argument("--wikipedia_api_concurrency", type=int, default=4,
+                    help="Maximum number of requests to --wikipedia_api at once, by each task")
+parser.add_argument("--wikipedia_api_rate", type=float, default=10.0,
+                    help="Maximum number of requests per second to --wikipedia_api, by each task")
+parser.add_argument("--fused", action="store_true",
+                    help="Runs the stages 3 to 7 in a single pass, writing only the .conllu files")
+parser.add_argument("--workers", type=int, default=1,
+                    help="Number of processes used by each task to process the articles of a file. "
+                         "Combine with --use_threads when running several tasks at once (--jobs)")
+parser.add_argument("--intermediate_format", choices=storage.FORMATS, default="csv",
+                    help="Format of the intermediate .stN files. Convert them back to CSV with storage.py")
+parser.add_argument("--gazetteer", action="store_true",
+                    help="Filters the sentences with a single automaton of the names of all the input files, "
+                         "tagging the mentions of every known entity")
+parser.add_argument("--keep_other_mentions", action="store_true",
+                    help="With --gazetteer and --multi_type, keeps the sentences mentioning only other known entities. "
+                         "Requires --multi_type, so those mentions are labelled with their class instead of O")
+parser.add_argument("--plain_text_cache", default=None,
+                    help="SQLite file caching the plain text of the articles across runs, i.e. plaintext.cache")
+parser.add_argument("--plain_text_cache_size", type=int, default=1024,
+                    help="Size bound of the plain text cache, in megabytes")
+parser.add_argument("--incremental", action="store_true",
+                    help="Reuses the rows processed by previous runs, kept in a .manifest file next to each output, "
+                         "so rerunning a task processes only the new or changed rows")
+parser.add_argument("--metrics", default=None,
+                    help="JSON lines file to which the time, rows, memory and bytes of each task are appended, i.e. metrics.jsonl")
+parser.add_argument("--profile_stage", default=None,
+                    help="Runs the function of tasks.py with this name (i.e. sentence_splitting) under cProfile. "
+                         "The profiles are written as stage.input_file.prof, use --workers 1 to profile the articles too")
+parser.add_argument("--profile_dir", default=".", help="Folder of the profiles written with --profile_stage")
+parser.add_argument("--max_row_mb", type=float, default=None,
+                    help="Articles whose text is longer than this, in millions of characters, are not processed "
+                         "but written into a .spill file next to the output of the task")
+parser.add_argument("--postag", action="store_true",
+                    help="Also annotates the filtered sentences with the postaggers, writing a .pos file next to each .st5 file. "
+                         "Not available with --fused")
+parser.add_argument("--shard_rows", type=int, default=None,
+                    help="Splits each .st1 file into shards of this many rows, running the stages 2 to 7 on each shard. "
+                         "The .conllu files of the shards are then concatenated in order into the .conllu of the input file")
+parser.add_argument("--shard_mb", type=float, default=None,
+                    help="As --shard_rows, splitting the .st1 files into shards of about this many megabytes")
+parser.add_argument("--gzip", action="store_true",
+                    help="Writes the .conllu files compressed with gzip, as .conllu.gz")
+parser.add_argument("--dedup_sentences", action="store_true",
+                    help="Drops the annotated sentences already written into the same .conllu file (or shard)")
+parser.add_argument("--multi_type", action="store_true",
+                    help="With --gazetteer, also labels the mentions of the other known entities in the sentences, "
+                         "each with the class of its own input files")
+parser.add_argument("--report", default=None,
+                    help="JSON file into which the statistics of the run are written once the .conllu files are done, i.e. report.json. "
+                         "Gathered from the --metrics file: the throughput and counters of each stage, the slowest articles "
+                         "and the names never matched in their articles")
+parser.add_argument("--report_top", type=int, default=10,
+                    help="Number of slowest articles and unmatched names in the --report")
+options = parser.parse_args()
+if options.multi_type and not options.gazetteer:
+    parser.error("--multi_type requires --gazetteer")
+if options.keep_other_mentions and not options.multi_type:
+    parser.error("--keep_other_mentions requires --multi_type")
+if options.report is not None and options.metrics is None:
+    parser.error("--report requires --metrics")
+
+# Resolved once, the tasks only use the paths of the run configuration
+input_globs = options.input
+if options.input_folders is not None:
+    input_globs = (input_globs or []) + [os.path.join(folder, "*.csv") for folder in options.input_folders]
+try:
+    run_config = config.RunConfig.load(options.config, input_globs=input_globs, article_store=options.wikipedia_db,
+                                       work_dir=options.work_dir, output_dir=options.output_dir)
+except ValueError as error:
+    parser.error(str(error))
+if not run_config.input_files:
+    parser.error("No input files match %s"%(" ".join(run_config.input_globs)))
+run_config.make_dirs()
+if options.history_file is None and run_config.work_dir is not None:
+    options.history_file = run_config.work_file(config.HISTORY_FILE)
+
+metrics.configure(options.metrics, options.profile_stage, options.profile_dir)
+
+max_row_size = int(options.max_row_mb*1024**2) if options.max_row_mb is not None else None
+
+sharded = options.shard_rows is not None or options.shard_mb is not None
+shard_bytes = int(options.shard_mb*1024**2) if options.shard_mb is not None else None
+
+iob_extension = ".conllu.gz" if options.gzip else ".conllu"
+# The .conllu files of the shards are kept in the work folder, and gathered into the output folder
+iob_output = (run_config.work_path if sharded else run_config.output_path)("{basename[0]}" + iob_extension)
+
+api_options = {"concurrency":options.wikipedia_api_concurrency, "rate":options.wikipedia_api_rate,
+               "cache_file":options.wikipedia_api_cache}
+
+starting_files = run_config.input_files
 
 # STAGE 1 .csv -> .st1
-@transform(input=starting_files,filter=suffix(".csv"),output=".st1")
+@transform(input=starting_files,filter=formatter(r"\.csv$"),output=run_config.work_path("{basename[0]}.st1"))
 def summarize_entity_names (input_file, output_file):
-    tasks.summarize_entity_names(input_file, output_file)
+    tasks.summarize_entity_names(input_file, output_file, fmt=options.intermediate_format)
+
+if sharded:
+    # SUBDIVIDE the stage 1 files in shards .st1 -> .NNNNN.cst1
+    # Huge input files are processed by several tasks at once (--jobs), each running the stages 2 to 7 on a shard
+    @subdivide(summarize_entity_names,
+               formatter(),
+               "{path[0]}/{basename[0]}.*.cst1",
+               "{path[0]}/{basename[0]}")
+    def shard_entity_names (input_file, output_files, output_file_stem):
+        tasks.shard_file(input_file, output_file_stem, shard_rows=options.shard_rows, shard_bytes=shard_bytes, extension=".cst1")
+
+    stage_1_task, stage_1_suffix = shard_entity_names, ".cst1"
+else:
+    stage_1_task, stage_1_suffix = summarize_entity_names, ".st1"
 
 # STAGE 2 .cst1 -> .st2
-@transform(input=summarize_entity_names,filter=suffix(".st1"),output=".st2")
+@transform(input=stage_1_task,filter=suffix(stage_1_suffix),output=".st2")
 def get_wikipedia_pages (input_file, output_file):
     print("Doing: %s"%(input_file))
-    tasks.get_wikipedia_page(input_file, output_file)
+    tasks.get_wikipedia_page(input_file, output_file, db=run_config.article_store, fmt=options.intermediate_format,
+                             api_url=options.wikipedia_api, api_options=api_options)
     print("Done")
 
-# STAGE 3 .cst2 -> .st3
-@transform(input=get_wikipedia_pages,filter=suffix(".st2"),output=".st3")
-def get_article_plain_text (input_file, output_file):
-    tasks.get_wikipedia_plain_text(input_file, output_file)
-
-# STAGE 3 .cst3 -> .st4
-@transform(input=get_article_plain_text,filter=suffix(".st3"),output=".st4")
-def split_sentences (input_file, output_file):
-    tasks.sentence_splitting(input_file, output_file)
-
-# STAGE 4 .cst4 -> .st5
-@transform(input=split_sentences,filter=suffix(".st4"),output=".st5")
-def filter_sentences_with_mentions (input_file, output_file):
-    tasks.filter_sentences_with_entities(input_file, output_file)
-
-# STAGE 5 .cst5 -> .st6
-@transform(input=filter_sentences_with_mentions,filter=suffix(".st5"),output=".st6",extras=[{"splitter":tasks.split_words}])
-def split_sentence_and_entitites (input_file, output_file,extras):
-    tasks.split_sentences_entities(input_file, output_file,extras["splitter"])
-    
-# STAGE 6 .cst6 -> .st7
-@transform(input=split_sentence_and_entitites, filter=suffix(".st6"),output=".st7")
-def annotate_entities (input_file, output_file):
-    tasks.annotate_sentences_entities(input_file,output_file)
-
-# STAGE 7 .cst7 -> .conllu
-@transform(input=annotate_entities, filter=suffix(".st7"),output=".conllu")
-def make_IOB (input_file, output_file):
-    tasks.IOB(input_file,output_file)
-
-
-
-# STAGE 5 .cst5 -> .st6
-# In the first element of the extras recieves a list of dictionarys of postaggers in which the key is the postagger name and the value the actual postagger function
-# The postagger function must return a dictionary with two keys: 'tokens' and 'tags'. The first one containing the tokens created by the parser, the second containing tha tags
-# The postagger functions are in the file 'postaggers.py'
-# @transform(input=filter_sentences_with_mentions,filter=suffix(".st5"),output=".st6",extras=[[{"Polyglot":postaggers.polyglot_postagger}]])
-# def annotate_postag (input_file, output_file,extras):
-#     postaggers = extras[0]
-#     tasks.annotate_sentences_with_postaggers(input_file, output_file, postaggers)
-
-# MERGE between stages  & 2 .st1 ->  chunk.st1
-# @split(summarize_entity_names,".st1chunk")
-# def merge_csv_files(input_file, output_file,xtra={"split_size":10}):
-#     pass
-
-#STAGE 4 chunk[].st2 -> .st3
-# @transform(get_wikipedia_pages,
-#            suffix(".st2"),
-#            ".st3")
-# def match_entities (input_file, output_file):
-#     tasks.match_entities(input_file, output_file)
-
-# [deprecated] STAGE 2 SUBDIVIDE the files in chunks .st1 -> .cst1
-# chunk_extension = ".cst1"
-# @subdivide(summarize_entity_names,
-#            formatter(),
-#            "{path[0]}/{basename[0]}.*"+chunk_extension,
-#            "{path[0]}/{basename[0]}")
-# def subdivide_csv_files(input_file, output_files, output_file_name_stem):
-#     tasks.split_csv_file(input_file,output_file_name_stem,10,chunk_extension)
+# MERGE of the stage 1 files .st1 -> gazetteer.pickle
+@active_if(options.gazetteer)
+@merge(summarize_entity_names,run_config.work_file("gazetteer.pickle"))
+def build_gazetteer (input_files, output_file):
+    tasks.build_gazetteer(input_files, output_file)
+
+def gazetteer_file (input_files):
+    """
+    Returns the gazetteer among the input files of a task, or None when it is not used
+    """
+    return input_files[1] if options.gazetteer else None
+
+if options.fused:
+    # STAGES 3 TO 7 .cst2 -> .conllu
+    # Runs the stages below in memory, without writing their intermediate files
+    @transform(input=get_wikipedia_pages,filter=formatter(r"\.st2$"),add_inputs=add_inputs(build_gazetteer),output=iob_output,extras=[{"splitter":tasks.split_words}])
+    def make_IOB (input_files, output_file, extras):
+        tasks.fused_stages(input_files[0], output_file, extras["splitter"], workers=options.workers,
+                           gazetteer_file=gazetteer_file(input_files), keep_other_mentions=options.keep_other_mentions,
+                           cache_file=options.plain_text_cache, cache_size=options.plain_text_cache_size*1024**2,
+                           incremental=options.incremental, max_row_size=max_row_size, dedup_sentences=options.dedup_sentences,
+                           multi_type=options.multi_type)
+
+else:
+    # STAGE 3 .cst2 -> .st3
+    @transform(input=get_wikipedia_pages,filter=suffix(".st2"),output=".st3")
+    def get_article_plain_text (input_file, output_file):
+        tasks.get_wikipedia_plain_text(input_file, output_file, workers=options.workers, fmt=options.intermediate_format,
+                                       cache_file=options.plain_text_cache, cache_size=options.plain_text_cache_size*1024**2,
+                                       incremental=options.incremental, max_row_size=max_row_size)
+
+    # STAGE 3 .cst3 -> .st4
+    @transform(input=get_article_plain_text,filter=suffix(".st3"),output=".st4")
+    def split_sentences (input_file, output_file):
+        tasks.sentence_splitting(input_file, output_file, workers=options.workers, fmt=options.intermediate_format,
+                                 incremental=options.incremental, max_row_size=max_row_size)
+
+    # STAGE 4 .cst4 -> .st5
+    @transform(input=split_sentences,filter=suffix(".st4"),add_inputs=add_inputs(build_gazetteer),output=".st5")
+    def filter_sentences_with_mentions (input_files, output_file):
+        tasks.filter_sentences_with_entities(input_files[0], output_file, workers=options.workers,
+                                             gazetteer_file=gazetteer_file(input_files), keep_other_mentions=options.keep_other_mentions,
+                                             fmt=options.intermediate_format, incremental=options.incremental,
+                                             multi_type=options.multi_type)
+
+    # STAGE 5 .cst5 -> .st6
+    @transform(input=filter_sentences_with_mentions,filter=suffix(".st5"),output=".st6",extras=[{"splitter":tasks.split_words}])
+    def split_sentence_and_entitites (input_file, output_file,extras):
+        tasks.split_sentences_entities(input_file, output_file,extras["splitter"], workers=options.workers, fmt=options.intermediate_format,
+                                       incremental=options.incremental)
+
+    # STAGE 6 .cst6 -> .st7
+    @transform(input=split_sentence_and_entitites, filter=suffix(".st6"),output=".st7")
+    def annotate_entities (input_file, output_file):
+        tasks.annotate_sentences_entities(input_file,output_file, workers=options.workers, fmt=options.intermediate_format,
+                                          incremental=options.incremental)
+
+    # STAGE 7 .cst7 -> .conllu
+    @transform(input=annotate_entities, filter=formatter(r"\.st7$"),output=iob_output)
+    def make_IOB (input_file, output_file):
+        tasks.IOB(input_file,output_file, workers=options.workers, incremental=options.incremental, dedup_sentences=options.dedup_sentences)
+
+    # STAGE 5 .cst5 -> .pos
+    # In the extras recieves a dictionary of postaggers in which the key is the postagger name and the value the actual postagger function
+    # The postagger function must return a dictionary with two keys: 'tokens' and 'tags'. The first one containing the tokens created by the parser, the second containing tha tags
+    # The postagger functions are in the file 'postaggers.py', and are refered by their names in 'registry.py' so that
+    # they are only loaded by the processes tagging the sentences
+    @active_if(options.postag)
+    @transform(input=filter_sentences_with_mentions,filter=suffix(".st5"),output=".pos",extras=[{"Polyglot":"postagger.polyglot"}])
+    def annotate_postag (input_file, output_file, extras):
+        tasks.annotate_sentences_with_postaggers(input_file, output_file, extras, workers=options.workers,
+                                                 fmt=options.intermediate_format, incremental=options.incremental)
+
+if sharded:
+    # GATHER the stage 7 files of the shards .NNNNN.conllu -> .conllu
+    # The members of gzip files are concatenated too
+    @collate(make_IOB,
+             formatter(r"(?P<NAME>[^/]+)\.\d+(?P<EXTENSION>\.conllu(\.gz)?)$"),
+             run_config.output_path("{NAME[0]}{EXTENSION[0]}"))
+    def gather_IOB (input_files, output_file):
+        tasks.concatenate_files(input_files, output_file)
+
+    iob_task = gather_IOB
+else:
+    iob_task = make_IOB
 
+# MERGE of the metrics of the run .jsonl -> report.json
+# The metrics file is an input too, so the report is written again whenever a task appends to it
+@active_if(options.report is not None)
+@merge([iob_task] + ([options.metrics] if options.metrics is not None else []), options.report or "report.json")
+def report_statistics (input_files, output_file):
+    print(metrics.format_report(metrics.write_report(options.metrics, output_file, top=options.report_top)))
 
 #pipeline_run(["summarize_entity_names","split_csv_files"],forcedtorun_tasks=["summarize_entity_names","split_csv_files"])
-#pipeline_run(["summarize_entity_names","subdivide_csv_files","get_wikipedia_pages"],forcedtorun_tasks=["summarize_entity_names","subdivide_csv_files","get_wikipedia_pages"])
 
-if False:
-    pipeline_run(verbose=1,multiprocess=1)
-else:
-    #pipeline_run()
-    pipeline_run(["split_sentence_and_entitites","annotate_entities","make_IOB"],
-    forcedtorun_tasks=["split_sentence_and_entitites","annotate_entities","make_IOB"])
\ No newline at end of file
+# i.e. python pipeline.py -T make_IOB --forced_tasks split_sentence_and_entitites
+cmdline.run(options)
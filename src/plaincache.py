@@ -0,0 +1,109 @@
+""" plaincache.py - Defines an on-disk cache of the plain text of the Wikipedia articles """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+import hashlib
+import sqlite3
+import time
+
+# Default bound of the size of the cached texts, in bytes
+MAX_BYTES = 1024**3
+
+# Number of pending writes committed at once
+_FLUSH_SIZE = 1000
+
+class PlainTextCache:
+    """
+    SQLite cache of the plain text of the articles, keyed by a hash of their wikitext.
+
+    The key also hashes the 'version' of the parser, so texts cached by another version are never
+    returned. When the cached texts add up to more than 'max_bytes', the least recently used ones
+    are evicted. The file may be shared by tasks running at the same time.
+
+    Counts the 'hits' and 'misses' of 'get'.
+    """
+
+    def __init__(self, path, version="", max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._prefix = ("%s\n"%(version)).encode()
+        self._puts = []
+        self._touches = []
+
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS PlainText (key BLOB PRIMARY KEY, plainText TEXT, size INTEGER, used REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS PlainTextUsed ON PlainText (used)")
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def key(self, wiki_text):
+        """
+        Returns the key of the wikitext
+        """
+        return hashlib.sha256(self._prefix + wiki_text.encode()).digest()
+
+    def get(self, key):
+        """
+        Returns the cached plain text of the key, or None if it is not cached
+        """
+        result = self._conn.execute("SELECT plainText FROM PlainText WHERE key = ?", (key,)).fetchone()
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._touches.append((time.time(), key))
+        if len(self._touches) >= _FLUSH_SIZE:
+            self.flush()
+        return result[0]
+
+    def put(self, key, plain_text):
+        """
+        Caches the plain text of the key. Written to the file in batches (see 'flush')
+        """
+        self._puts.append((key, plain_text, len(plain_text.encode()), time.time()))
+        if len(self._puts) >= _FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the pending texts and access times, then evicts the least recently used texts
+        while the cache is larger than 'max_bytes'
+        """
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO PlainText VALUES (?,?,?,?)", self._puts)
+            self._conn.executemany("UPDATE PlainText SET used = ? WHERE key = ?", self._touches)
+            self._puts = []
+            self._touches = []
+
+            total = self._conn.execute("SELECT COALESCE(SUM(size),0) FROM PlainText").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            # The most recent access time among the texts to be evicted
+            threshold = None
+            for used, size in self._conn.execute("SELECT used, size FROM PlainText ORDER BY used"):
+                threshold = used
+                total -= size
+                if total <= self.max_bytes:
+                    break
+            self._conn.execute("DELETE FROM PlainText WHERE used <= ?", (threshold,))
+
+    def close(self):
+        self.flush()
+        self._conn.close()
@@ -1,8 +1,43 @@
-import polyglot
-from polyglot.text import Text, Word
+from functools import lru_cache
 
-def polyglot_postagger(sentence):    
-    """ 
+# polyglot is imported by the first tagged sentence of each process, so importing this module
+# is cheap (see 'registry.py')
+
+# Language of the sentences of the articles
+LANGUAGE = "pt"
+
+# Number of distinct sentences whose tags are kept by each process
+MEMO_SIZE = 100000
+
+# Taggers loaded by this process, by language
+_taggers = {}
+
+def _polyglot_tagger(language=LANGUAGE):
+    """
+    Returns the polyglot POS tagger of the language, loaded once for each process
+    """
+    if language not in _taggers:
+        from polyglot.tag import POSTagger
+        _taggers[language] = POSTagger(lang=language)
+    return _taggers[language]
+
+@lru_cache(maxsize=MEMO_SIZE)
+def _polyglot_tags(sentence):
+    """
+    Returns the pair (tokens, tags) of the sentence, as tuples.
+    Tags a sentence in a single pass, and repeated sentences only once (i.e. Wikipedia boilerplate).
+    """
+    from polyglot.text import Text
+    words = Text(sentence, hint_language_code=LANGUAGE).words
+    tokens = []
+    tags = []
+    for token, tag in _polyglot_tagger().annotate(words):
+        tokens.append(str(token))
+        tags.append(tag)
+    return tuple(tokens), tuple(tags)
+
+def polyglot_postagger(sentence):
+    """
     Annotates the sentence with its upostags
     Returns a dictionary with 2 keys:
      - tokens - List of the sentence tokens defined by the postagger
@@ -11,8 +46,18 @@ def polyglot_postagger(sentence):
     The first element of the 'tag' list is the annotation for the first element
     of the 'tokens' list
     """
-    text = Text(sentence,hint_language_code="pt")
-    tokens = [token for token, tag in text.pos_tags]
-    tags = [tag for token, tag in text.pos_tags]
-    return {"tokens":tokens,"tags":tags}
+    tokens, tags = _polyglot_tags(sentence)
+    return {"tokens":list(tokens),"tags":list(tags)}
+
+def polyglot_postagger_batch(sentences):
+    """
+    Annotates a list of sentences at once, as 'polyglot_postagger'.
+    Each distinct sentence of the list is tagged once.
+    Returns the list of the dictionaries of the sentences.
+    """
+    tagged = {sentence: _polyglot_tags(sentence) for sentence in set(sentences)}
+    return [{"tokens":list(tagged[sentence][0]),"tags":list(tagged[sentence][1])} for sentence in sentences]
 
+# Postaggers recieving a single sentence may have a 'batch' function recieving a list of sentences,
+# used by 'tasks.apply_postaggers'
+polyglot_postagger.batch = polyglot_postagger_batch
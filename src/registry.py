@@ -0,0 +1,61 @@
+""" registry.py - Defines the registry of the taggers and parsers used by the pipeline, loaded on first use """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+import importlib
+
+# Registered names and their loaders. A loader is either:
+#   - A string 'module' or 'module:attribute', imported on first use
+#   - A function with no arguments returning the object, called on first use
+_loaders = {
+    "parser.mwparserfromhell": "mwparserfromhell",
+    "postagger.polyglot": "postaggers:polyglot_postagger"}
+
+# Objects loaded by this process, by name
+_loaded = {}
+
+def register(name, loader):
+    """
+    Registers a tagger or parser under the name (see '_loaders'), replacing any previous one.
+    Nothing is imported until the name is used.
+    """
+    _loaders[name] = loader
+    _loaded.pop(name, None)
+
+def names():
+    """
+    Returns the sorted list of the registered names
+    """
+    return sorted(_loaders)
+
+def get(name):
+    """
+    Returns the object registered under the name, loading it once for each process
+    """
+    if name not in _loaded:
+        if name not in _loaders:
+            raise KeyError("Unknown tagger or parser '%s', expected one of %s"%(name, ", ".join(names())))
+
+        loader = _loaders[name]
+        if callable(loader):
+            _loaded[name] = loader()
+        else:
+            module_name, _, attribute = loader.partition(":")
+            loaded = importlib.import_module(module_name)
+            _loaded[name] = getattr(loaded, attribute) if attribute else loaded
+    return _loaded[name]
+
+def resolve(value):
+    """
+    Returns the registered object if the value is a registered name, or the value itself
+    """
+    if isinstance(value, str):
+        return get(value)
+    return value
@@ -0,0 +1,205 @@
+""" storage.py - Defines the serialization of the intermediate files of the pipeline """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+import annotations
+import argparse
+import struct
+import pickle
+import json
+import csv
+import sys
+import os
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+csv.field_size_limit(sys.maxsize)
+
+# Columns holding lists or dicts. In the CSV format they are written as JSON strings
+JSON_COLUMNS = {"names","page","sentences","mentions","mentionTypes","tokenizedSentences","tokenizedNames","annotated"}
+
+# Columns holding the packed matches of the names (see 'annotations.py'). In the CSV format they are
+# written as base64 strings, and in the binary formats as bytes
+ARRAY_COLUMNS = {"annotatedEntities"}
+
+# Formats of the intermediate files
+#   - csv - A CSV file, the lists and dicts of the columns in JSON_COLUMNS are JSON strings,
+#           and the arrays of the columns in ARRAY_COLUMNS base64 strings
+#   - msgpack - Length-prefixed msgpack records (requires the msgpack package)
+#   - pickle - Length-prefixed pickle records
+FORMATS = ("csv","msgpack","pickle")
+
+# The binary formats start with the magic bytes, the format name and a JSON list of the columns,
+# followed by the records: a 4 bytes little-endian length and the list of the row values
+_MAGIC = b"NERPIPE\x00"
+_LENGTH = struct.Struct("<I")
+
+def _serializer(fmt):
+    """
+    Returns the pair of functions (dumps, loads) of the binary format
+    """
+    if fmt == "pickle":
+        return (lambda values: pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)), pickle.loads
+    if fmt == "msgpack":
+        if msgpack is None:
+            raise ImportError("The 'msgpack' format requires the msgpack package")
+        return (lambda values: msgpack.packb(values, use_bin_type=True)), (lambda data: msgpack.unpackb(data, raw=False))
+    raise ValueError("Unknown intermediate format '%s', expected one of %s"%(fmt, ", ".join(FORMATS)))
+
+def encode_csv_row(row):
+    """
+    Returns a copy of the row in which the lists and dicts of the columns in JSON_COLUMNS are JSON strings,
+    and the arrays of the columns in ARRAY_COLUMNS base64 strings
+    """
+    return {column: json.dumps(value) if column in JSON_COLUMNS and not isinstance(value, str) else
+                    annotations.encode(value) if column in ARRAY_COLUMNS and not isinstance(value, str) else value
+            for column, value in row.items()}
+
+class RowReader:
+    """
+    Reads the rows of an intermediate file of any of the FORMATS, detected from the file contents.
+
+    Iterating over the reader yields a dict for each row. The values of the columns in 'decode' are
+    lists and dicts, or arrays for the columns in ARRAY_COLUMNS. The other columns in JSON_COLUMNS
+    and ARRAY_COLUMNS are left as they are stored, which is written back unchanged by a RowWriter.
+    If 'decode' is None, all of them are decoded.
+    """
+
+    def __init__(self, path, decode=None):
+        self.path = path
+        self.decode = JSON_COLUMNS | ARRAY_COLUMNS if decode is None else (JSON_COLUMNS | ARRAY_COLUMNS).intersection(decode)
+        self.fmt = None
+        self.fieldnames = None
+        self._file = None
+
+    def __enter__(self):
+        with open(self.path, 'rb') as file:
+            binary = file.read(len(_MAGIC)) == _MAGIC
+
+        if binary:
+            self._file = open(self.path, 'rb')
+            self._file.read(len(_MAGIC))
+            self.fmt = self._file.readline().decode().strip()
+            self.fieldnames = json.loads(self._file.readline().decode())
+            self._loads = _serializer(self.fmt)[1]
+        else:
+            self.fmt = "csv"
+            self._file = open(self.path, 'r')
+            self._reader = csv.DictReader(self._file)
+            self.fieldnames = self._reader.fieldnames
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+    def __iter__(self):
+        if self.fmt == "csv":
+            decode = [column for column in self.fieldnames or [] if column in self.decode and column in JSON_COLUMNS]
+            decode_arrays = [column for column in self.fieldnames or [] if column in self.decode and column in ARRAY_COLUMNS]
+            for row in self._reader:
+                for column in decode:
+                    row[column] = json.loads(row[column])
+                for column in decode_arrays:
+                    row[column] = annotations.decode(row[column])
+                yield row
+        else:
+            read = self._file.read
+            fieldnames = self.fieldnames
+            decode_arrays = [column for column in fieldnames if column in self.decode and column in ARRAY_COLUMNS]
+            while True:
+                length = read(_LENGTH.size)
+                if not length:
+                    break
+                row = dict(zip(fieldnames, self._loads(read(_LENGTH.unpack(length)[0]))))
+                for column in decode_arrays:
+                    row[column] = annotations.load(row[column])
+                yield row
+
+class RowWriter:
+    """
+    Writes rows into an intermediate file of one of the FORMATS
+
+    Rows are dicts with the 'fieldnames' keys. In the CSV format the lists and dicts of the columns
+    in JSON_COLUMNS are written as JSON strings, and strings are written unchanged. The arrays of the
+    columns in ARRAY_COLUMNS are written as base64 strings in the CSV format and as bytes in the others.
+    If 'append', the rows are appended to the file if it is not empty, i.e. a partial output of the
+    same format being resumed (see 'checkpoints.py').
+    """
+
+    def __init__(self, path, fieldnames, fmt="csv", append=False):
+        if fmt not in FORMATS:
+            raise ValueError("Unknown intermediate format '%s', expected one of %s"%(fmt, ", ".join(FORMATS)))
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.fmt = fmt
+        self.append = append
+        self._file = None
+
+    def __enter__(self):
+        append = self.append and os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        if self.fmt == "csv":
+            self._file = open(self.path, 'a' if append else 'w')
+            self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames)
+            if not append:
+                self._writer.writeheader()
+        else:
+            self._dumps = _serializer(self.fmt)[0]
+            self._array_columns = [i for i, column in enumerate(self.fieldnames) if column in ARRAY_COLUMNS]
+            self._file = open(self.path, 'ab' if append else 'wb')
+            if not append:
+                self._file.write(_MAGIC)
+                self._file.write(("%s\n%s\n"%(self.fmt, json.dumps(self.fieldnames))).encode())
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+    def tell(self):
+        """
+        Returns the number of bytes written so far
+        """
+        return self._file.tell()
+
+    def flush(self):
+        """
+        Writes the rows written so far to the disk
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def writerow(self, row):
+        if self.fmt == "csv":
+            self._writer.writerow(encode_csv_row(row))
+        else:
+            values = [row[column] for column in self.fieldnames]
+            for i in self._array_columns:
+                if not isinstance(values[i], bytes):
+                    values[i] = annotations.to_bytes(values[i])
+            data = self._dumps(values)
+            self._file.write(_LENGTH.pack(len(data)))
+            self._file.write(data)
+
+def convert_to_csv(input_file, output_file):
+    """
+    Writes the rows of an intermediate file of any of the FORMATS into a CSV file, for inspection
+    """
+    with RowReader(input_file) as inputs, RowWriter(output_file, inputs.fieldnames, "csv") as outputs:
+        for row in inputs:
+            outputs.writerow(row)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts an intermediate file of the pipeline into a CSV file")
+    parser.add_argument("input_file", help="A .stN file in any of the formats: %s"%(", ".join(FORMATS)))
+    parser.add_argument("output_file", help="The CSV file to be written")
+    args = parser.parse_args()
+    convert_to_csv(args.input_file, args.output_file)
@@ -9,29 +9,192 @@ __maintainer__ = "Daniel Specht Menezes"
 __email__ = "danielssmenezes@gmail.com"
 __status__ = "Development"
 
-from os.path import basename, splitext, getsize
-import mwparserfromhell
-import wikipedia
+from os.path import basename, dirname, abspath, splitext, getsize
+import articlestore
+import annotations
+import registry
+import plaincache
+import metrics
+import manifest
+import checkpoints
+import gazetteer
+import storage
+from functools import partial, lru_cache
+from operator import itemgetter, add
+import multiprocessing
+import threading
+import shutil
+import gzip
+import hashlib
+import glob
 import sqlite3
 #import nltk
 import json
 import csv
+import time
 import sys
+import os
 import re
 
 csv.field_size_limit(sys.maxsize)
 
-def summarize_entity_names(input_file,output_file):
+# Rows sent at once to each worker process by '_map_rows'
+CHUNK_SIZE = 16
+
+def _timed_call(function, row):
+    """
+    Returns the tuple (wall seconds, CPU seconds, function(row))
+    """
+    start, start_cpu = time.time(), time.process_time()
+    result = function(row)
+    return time.time() - start, time.process_time() - start_cpu, result
+
+def _row_article_id(row):
+    """
+    Returns the wikiPageID of a row, or of the row in the first element of a pair
+    """
+    if isinstance(row, tuple):
+        row = row[0]
+    return row.get("wikiPageID")
+
+def _map_window(function, window, pool, chunksize, manifest=None, stage=None):
+    """
+    Yields the pairs (row, function(row)) of the rows of the window, applying the function only to
+    the rows not found in the manifest, in the pool of processes if sent.
+    The time spent on each row is recorded in the stage metrics if they are enabled.
+    """
+    if manifest is None:
+        keys = [None] * len(window)
+        results = {}
+        missing = window
+    else:
+        keys = [manifest.key(row) for row in window]
+        results = manifest.get_many(keys)
+        missing = [row for row, key in zip(window, keys) if key not in results]
+
+    if stage is not None:
+        stage.rows_in += len(window)
+        stage.rows_out += len(window)
+
+    timed = stage is not None and stage.enabled
+    if timed:
+        function = partial(_timed_call, function)
+
+    computed = pool.imap(function, missing, chunksize) if pool is not None else map(function, missing)
+    if manifest is None and not timed:
+        yield from zip(window, computed)
+        return
+
+    for row, key in zip(window, keys):
+        if key in results:
+            yield row, results[key]
+            continue
+
+        result = next(computed)
+        if timed:
+            wall, cpu, result = result
+            stage.article(_row_article_id(row), wall, cpu)
+        if manifest is not None:
+            manifest.put(key, row, result)
+        yield row, result
+
+def _map_rows(function, rows, workers=1, chunksize=CHUNK_SIZE, manifest=None, stage=None):
+    """
+    Recieves:
+        - function - A picklable function, applied to each row
+        - rows - An iterable of rows, i.e. a csv.DictReader
+        - workers - The number of processes used. With 1 worker the rows are processed in this process
+        - chunksize - The number of rows sent at once to each worker process
+        - manifest - A 'manifest.Manifest' with the results of previous runs. Only the rows not
+          found in it are processed, and their results are added to it
+        - stage - The 'metrics.StageMetrics' counting the rows and timing each article
+
+    Yields the pairs (row, function(row)) in the same order as the recieved rows.
+    Only a bounded window of rows is read ahead, so the whole file is never held in memory.
+    """
+
+    # Ruffus runs each task in a daemonic process when multiprocess > 1, and these can't
+    # start a pool of their own. Use the multithread mode of Ruffus together with 'workers'.
+    if workers > 1 and multiprocessing.current_process().daemon:
+        print("Can't start %d workers inside a daemonic process, processing the rows serially"%(workers))
+        workers = 1
+
+    if workers <= 1 and manifest is None and (stage is None or not stage.enabled):
+        for row in rows:
+            yield row, function(row)
+        return
+
+    window_size = max(workers, 1) * chunksize * 4
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        window = []
+        for row in rows:
+            window.append(row)
+            if len(window) == window_size:
+                yield from _map_window(function, window, pool, chunksize, manifest, stage)
+                window = []
+        if window:
+            yield from _map_window(function, window, pool, chunksize, manifest, stage)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+def _open_manifest(output_file, function, incremental=False, row_key=None, dependencies=()):
+    """
+    Returns the manifest of the output file for the rows processed by the function, or None if
+    not 'incremental'. The results depend on the function and its code (see 'manifest.code_signature') and on
+    the strings returned by the functions in 'dependencies', i.e. versions or digests of the files read by the
+    function, called only if 'incremental'.
+    """
+    if not incremental:
+        return None
+    signature = "\n".join([manifest.code_signature(function)] + [dependency() for dependency in dependencies])
+    return manifest.Manifest(output_file, signature, row_key)
+
+def _close_manifest(input_file, row_manifest):
+    """
+    Prints the rows reused from the manifest and closes it
+    """
+    if row_manifest is not None:
+        print("%s: %d rows reused, %d rows processed"%(input_file, row_manifest.hits, row_manifest.misses))
+        row_manifest.close()
+
+# Optional columns carried unchanged by the stages from 'summarize_entity_names' to 'IOB', when recieved:
+#   - entityType - The IOB class of the entities of the row, i.e. PER (see 'summarize_entity_names')
+#   - mentionTypes - A JSON dict with the IOB class of the other known entities mentioned in the
+#     sentences of the row (see 'filter_sentences_with_entities')
+CARRIED_COLUMNS = ["entityType","mentionTypes"]
+
+def _carried_columns(inputs, output_columns):
+    """
+    Returns the columns of CARRIED_COLUMNS recieved by the RowReader 'inputs' and not among the output columns
+    """
+    return [column for column in CARRIED_COLUMNS if column in (inputs.fieldnames or []) and column not in output_columns]
+
+def _carry_columns(row, output_row):
+    """
+    Copies the columns of CARRIED_COLUMNS recieved in the row into the output row, unless already set
+    """
+    for column in CARRIED_COLUMNS:
+        if column in row and column not in output_row:
+            output_row[column] = row[column]
+
+@metrics.instrumented
+def summarize_entity_names(input_file,output_file,fmt="csv",entity_type=None):
     """ 
     Recieves a csv file with:
         - Column 'isPrimaryTopicOf' - The URL of the wiki page
         - Column 'wikiPageID' - The wikipedia page id
+        - Optional column 'entityType' - The IOB class of the entity, i.e. PER
         - Other columns are possible entity names.
           Many names may exist in the same column separated by ';;'
 
-    Writes a CSV file with:
+    Writes a file in the intermediate format 'fmt' (see 'storage.py') with:
         - The recieved WikiPageURL and wikiPageID columns
-        - Column 'names' - A JSON list containing the column names. No duplicate names.
+        - Column 'names' - A JSON list containing the names of the other columns, without the id and the URL.
+          No duplicate names, in the order of the columns, so the rows are the same in every run (see 'manifest.py')
+        - Column 'entityType' - The IOB class of the entity, carried by the following stages up to 'IOB'.
+        When the row has none, it is 'entity_type' or, if not sent, the class of the folder or of the name of the file (see '_entity_type_flag')
     """
 
     separator = ";;"
@@ -40,72 +203,174 @@ def summarize_entity_names(input_file,output_file):
     id_col = "wikiPageID"
     url_col = "isPrimaryTopicOf"
 
-    # Added output column
+    # Added output columns
     names_col = "names"
+    type_col = "entityType"
 
-    output_columns = [id_col,url_col,names_col]
+    output_columns = [id_col,url_col,names_col,type_col]
 
-    with open(input_file, 'r') as inputs, open(output_file, 'w') as outputs:
+    if entity_type is None:
+        entity_type = _entity_type_flag(input_file, required=False)
+
+    with open(input_file, 'r') as inputs, storage.RowWriter(output_file, output_columns, fmt) as outputs:
 
         CSV_inputs = csv.DictReader(inputs)
-        CSV_outputs = csv.DictWriter(outputs, fieldnames=output_columns)
-        CSV_outputs.writeheader()
 
+        stage = metrics.current_stage()
         for row in CSV_inputs: 
-            names = list(set(filter(None,[j for i in [v.split(separator) for v in row.values()] for j in i])))
-            names = json.dumps(names)
+            row_entity_type = row.pop(type_col, None) or entity_type or _entity_type_flag(input_file)
+            article_id = row.pop(id_col) # keeps id_col
+            url = row.pop(url_col) # keeps url_col
+            # Merge the cell values of the name columns only, removing empty string and splitting on given separator
+            names = list(dict.fromkeys(filter(None,[j for i in [v.split(separator) for v in row.values() if isinstance(v, str)] for j in i])))
 
             output_row = {
-                id_col:row.pop(id_col), # keeps id_col
-                url_col:row.pop(url_col), # keeps id_col
-                # Merge other cell values removing empty string and splitting on given separator
-                names_col:names}
-            CSV_outputs.writerow(output_row)
+                id_col:article_id,
+                url_col:url,
+                names_col:names,
+                type_col:row_entity_type}
+            outputs.writerow(output_row)
+            stage.rows_in += 1
+            stage.rows_out += 1
+            stage.count("names", len(names))
+
+# Opened database connections, one for each (process, thread, database)
+_connections = {}
+
+def _get_connection(db):
+    """
+    Recieves the path of a SQLite database
+    Returns a read-only connection to the database.
 
-def _get_article_info(article_id):
+    The connection is opened on the first call and reused by the following calls
+    made from the same process and thread.
     """
-    Recieves the wikipedia article id
-    Returns a json string containing a dict with the keys:
+    key = (os.getpid(), threading.get_ident(), db)
+    if key not in _connections:
+        # Imported here as urllib.request is slow to import (see 'benchmarks.benchmark_startup')
+        from urllib.request import pathname2url
+        _connections[key] = sqlite3.connect("file:%s?mode=ro" % pathname2url(db), uri=True)
+    return _connections[key]
+
+def _article_key(article_id):
+    """
+    Returns the id as an integer when possible, so that ids read from CSV files
+    and ids returned by the database can be compared
+    """
+    try:
+        return int(article_id)
+    except (TypeError, ValueError):
+        return article_id
+
+# Whether each of the recieved 'db' files is an article store (see 'articlestore.py')
+_article_stores = {}
+
+def _article_info(title, content):
+    """
+    Returns the dict of the article with the keys 'title' and 'text', or None if the text is empty
+    """
+    if not content:
+        return None
+    return {"title":title.replace("''","'"),"text":content.replace("''","'") }
+
+def _get_articles_info(article_ids, db):
+    """
+    Recieves a list of wikipedia article ids and the path of the articles database (see 'config.RunConfig')
+    Returns a dict mapping each id (see '_article_key') to a dict with the keys:
      - 'text' - The wikitext of the article
      - 'title' - The title of the article
 
-    If the article is not found ot the text is empty, returns none
+    If the article is not found, is found more than once or the text is empty, its value is None
+
+    The 'db' may be the SQLite dump or an article store packed from it (see 'articlestore.py').
     """
 
-    db = '/home/daniel/Documents/wikipedia dump/wikipedia2016.db'
-    conn = sqlite3.connect(db)
+    if db not in _article_stores:
+        _article_stores[db] = articlestore.is_article_store(db)
+
+    if _article_stores[db]:
+        store = articlestore.open_store(db)
+        articles = {}
+        for article_id in article_ids:
+            key = _article_key(article_id)
+            article = store.get(key)
+            articles[key] = _article_info(*article) if article else None
+        return articles
+
+    conn = _get_connection(db)
+    keys = list(set(_article_key(article_id) for article_id in article_ids))
     query = """
-            SELECT title, content
+            SELECT id, title, content
             FROM WikiElement
-            WHERE id == %s
-            """%(article_id)
-    #print(query)
-    result = conn.execute(query).fetchall()
+            WHERE id IN (%s)
+            """%(",".join("?"*len(keys)))
 
-    if not len(result) == 1:
-        return None
+    results = {key:[] for key in keys}
+    for article_id, title, content in conn.execute(query, keys):
+        results.setdefault(_article_key(article_id), []).append((title, content))
 
-    article = result[0]
+    articles = {}
+    for key, result in results.items():
+        articles[key] = _article_info(*result[0]) if len(result) == 1 else None
+    return articles
 
-    if not article[1]:
-        return None
-    
-    return json.dumps({"title":article[0].replace("''","'"),"text":article[1].replace("''","'") })
+def _get_article_info(article_id, db):
+    """
+    Recieves the wikipedia article id and the path of the articles database
+    Returns a dict with the keys:
+     - 'text' - The wikitext of the article
+     - 'title' - The title of the article
+
+    If the article is not found ot the text is empty, returns none
+    """
+    return _get_articles_info([article_id], db).get(_article_key(article_id))
+
+def _fetch_missing_articles(api_fetcher, articles, article_ids):
+    """
+    Fetches the articles of the ids whose value is None in the dict of '_get_articles_info' with
+    the 'fetcher.WikipediaFetcher', replacing their values with the fetched articles.
+    Returns the number of articles fetched.
+    """
+    missing = [article_id for article_id in article_ids if articles[_article_key(article_id)] is None]
+    if not missing:
+        return 0
 
-def get_wikipedia_page(input_file,output_file,discarded_file="./discarded.csv"):
+    n_fetched = 0
+    for article_id, article in api_fetcher.fetch(missing).items():
+        # Unlike the texts of the dump, the texts of the API are not escaped
+        if article is not None and article[1]:
+            articles[_article_key(article_id)] = {"title":article[0], "text":article[1]}
+            n_fetched += 1
+    return n_fetched
+
+@metrics.instrumented
+def get_wikipedia_page(input_file,output_file,db,discarded_file=None,batch_size=500,fmt="csv",
+                       api_url=None,api_options=None):
     """
-    Recieves a CSV file with:
+    Recieves a file in any of the intermediate formats (see 'storage.py') with:
         - Column 'isPrimaryTopicOf' - The URL of the wiki page
         - Column 'wikiPageID' - The wikipedia page id
         - Column 'names' - A JSON list containing the column names
 
-    Writes a CSV file with:
+    Writes a file in the intermediate format 'fmt' with:
         - The required columns for the the input file, discarding the others
         - Added column 'page' - A JSON dict containing the keys 'text' and 'title'
         The values of these kays may be an empty string
 
-        If the id of the wikipedia page yields more than one result, the line is discarded and logged into a file
-        'discarded_rows.csv'
+        If the id of the wikipedia page yields more than one result, the line is discarded and logged into
+        the CSV file 'discarded_file'. Unless sent, it is 'output_file.discarded', written by this task only,
+        so that the tasks run at once on several files or shards don't write into the same file.
+
+    The articles are fetched from the database 'db' in batches of 'batch_size' ids (SQLite limits a
+    query to 999 parameters in older versions), using a single connection for each worker.
+    The 'db' may also be an article store packed from the database (see 'articlestore.py').
+
+    If an 'api_url' is sent, the articles missing from the 'db' are fetched from the MediaWiki API at
+    that URL, i.e. https://pt.wikipedia.org/w/api.php, before being discarded. The 'api_options' are
+    the keyword arguments of the 'fetcher.WikipediaFetcher', i.e. {"concurrency":4, "rate":10.0, "cache_file":"api.cache"}.
+
+    The output is checkpointed after every batch (see 'checkpoints.py'), so an interrupted run is
+    resumed from the last checkpoint. Rows discarded after it may be logged twice into 'discarded_file'.
     """
 
     # Recieved, unchanged columns
@@ -118,19 +383,16 @@ def get_wikipedia_page(input_file,output_file,discarded_file="./discarded.csv"):
 
     output_columns = [id_col,url_col,names_col,page_col]
 
-    with open(input_file, 'r') as inputs, open(output_file, 'w') as outputs, open(discarded_file, 'a') as discarded:
+    stage = metrics.current_stage()
+    row_checkpoint = checkpoints.Checkpoint(input_file, output_file, fmt, interval=batch_size)
 
-        CSV_inputs = csv.DictReader(inputs)
-
-        CSV_outputs = csv.DictWriter(outputs, fieldnames=output_columns)
-        CSV_outputs.writeheader()
-
-        CSV_discarded = csv.DictWriter(discarded, fieldnames=CSV_inputs.fieldnames)
-        if getsize(discarded_file) == 0:
-            CSV_discarded.writeheader()
-
-        for row in CSV_inputs:
-            article_info = _get_article_info(row[id_col])
+    def write_batch(batch):
+        articles = _get_articles_info([row[id_col] for row in batch], db)
+        if api_fetcher is not None:
+            fetched[0] += _fetch_missing_articles(api_fetcher, articles, [row[id_col] for row in batch])
+        stage.rows_in += len(batch)
+        for row in batch:
+            article_info = articles[_article_key(row[id_col])]
             if article_info:
                 output_row = {
                     id_col:row[id_col], # keeps id_col
@@ -138,21 +400,217 @@ def get_wikipedia_page(input_file,output_file,discarded_file="./discarded.csv"):
                     names_col:row[names_col],
                     # Merge other cell values removing empty string and splitting on given separator
                     page_col:article_info}
-                CSV_outputs.writerow(output_row)
+                _carry_columns(row, output_row)
+                outputs.writerow(output_row)
+                stage.rows_out += 1
             else:
-                CSV_discarded.writerow(row)
+                CSV_discarded.writerow(storage.encode_csv_row(row))
+                stage.discarded += 1
+        row_checkpoint.update(outputs, batch[-1][id_col], files=[discarded])
+
+    start = time.time()
+    n_rows = 0
+    fetched = [0]
+
+    # The own discarded file of the task is appended to only when resuming its output
+    discarded_mode = 'a'
+    if discarded_file is None:
+        discarded_file = output_file + ".discarded"
+        discarded_mode = 'a' if row_checkpoint.resumed else 'w'
+
+    api_fetcher = None
+    if api_url is not None:
+        import fetcher
+        api_fetcher = fetcher.WikipediaFetcher(api_url, **(api_options or {}))
+
+    with storage.RowReader(input_file, decode=[]) as inputs, \
+         storage.RowWriter(row_checkpoint.partial_file, output_columns + _carried_columns(inputs, output_columns), fmt,
+                           append=row_checkpoint.resumed) as outputs, \
+         open(discarded_file, discarded_mode) as discarded:
+
+        CSV_discarded = csv.DictWriter(discarded, fieldnames=inputs.fieldnames)
+        if getsize(discarded_file) == 0:
+            CSV_discarded.writeheader()
 
-def get_wikipedia_plain_text(input_file, output_file):
+        batch = []
+        for row in row_checkpoint.skip(inputs):
+            batch.append(row)
+            if len(batch) == batch_size:
+                write_batch(batch)
+                n_rows += len(batch)
+                batch = []
+        if batch:
+            write_batch(batch)
+            n_rows += len(batch)
+
+    row_checkpoint.commit()
+    if api_fetcher is not None:
+        print("%s: %d articles fetched from %s in %d requests, %d could not be fetched"%(input_file, fetched[0], api_url, api_fetcher.requests, api_fetcher.failed))
+        stage.count("fetched_articles", fetched[0])
+        stage.count("failed_fetches", api_fetcher.failed)
+        api_fetcher.close()
+    elapsed = time.time() - start
+    print("%s: %d rows in %.1fs (%.1f rows/s)"%(input_file, n_rows, elapsed, n_rows/elapsed if elapsed else 0.0))
+
+def _plain_text(wiki_text):
+    """
+    Returns the plain text of the recieved wikitext.
+
+    Carriage returns are converted into line feeds, as reading the text back from a CSV file
+    would do, so that the following stages see the same text whether or not it was written to disk.
+    """
+    plain_text = registry.get("parser.mwparserfromhell").parse(wiki_text).strip_code()
+    return plain_text.replace("\r\n","\n").replace("\r","\n")
+
+# Line breaks of the plain text, converted into line feeds by '_plain_text'
+_LINE_BREAK = re.compile(r'\r\n|\r|\n')
+
+def iter_plain_text_paragraphs(wiki_text):
+    """
+    Yields the lines of the plain text of the recieved wikitext, one at a time, without joining
+    the whole plain text.
+
+    Yields the same non empty lines as splitting '_plain_text(wiki_text)' into lines. Only the empty
+    lines differ, as the excess line breaks are not collapsed, and these are skipped by the sentence splitting.
+    """
+    line = []
+    for node in registry.get("parser.mwparserfromhell").parse(wiki_text).nodes:
+        # As done by 'strip_code' for each node
+        stripped = node.__strip__(normalize=True, collapse=True, keep_template_params=False)
+        if not stripped:
+            continue
+
+        parts = _LINE_BREAK.split(str(stripped))
+        line.append(parts[0])
+        for part in parts[1:]:
+            yield "".join(line)
+            line = [part]
+    yield "".join(line)
+
+def _spill_large_rows(rows, row_size, max_row_size, spill_file, fieldnames, fmt="csv", append=False):
+    """
+    Recieves:
+        - rows - An iterable of rows, i.e. a storage.RowReader
+        - row_size - A function returning the size of a row, i.e. the length of its text
+        - max_row_size - The maximum size of the rows. If None, all the rows are yielded
+        - spill_file - The file of the rows larger than 'max_row_size', with the columns 'fieldnames'
+          in the intermediate format 'fmt'. It is removed when no row is larger
+        - append - If True, the spill file of a resumed run is kept, and the rows already in it are not
+          written again (see 'checkpoints.py')
+
+    Yields the rows up to 'max_row_size', writing the others into the spill file so that a huge
+    article doesn't exhaust the memory of a worker. The spill file can be processed later by the
+    same task, i.e. alone and with more memory.
+    """
+    spilled_ids = set()
+    if append and os.path.exists(spill_file):
+        with storage.RowReader(spill_file, decode=[]) as previous:
+            spilled_ids = {row.get("wikiPageID") for row in previous}
+    elif os.path.exists(spill_file):
+        os.remove(spill_file)
+
+    if max_row_size is None:
+        yield from rows
+        return
+
+    stage = metrics.current_stage()
+    spilled = None
+    try:
+        for row in rows:
+            size = row_size(row)
+            if size <= max_row_size:
+                yield row
+                continue
+
+            if row.get("wikiPageID") in spilled_ids:
+                stage.discarded += 1
+                continue
+            if spilled is None:
+                spilled = storage.RowWriter(spill_file, fieldnames, fmt, append=append).__enter__()
+            spilled.writerow(row)
+            stage.discarded += 1
+            print("Spilled article %s of size %d into %s"%(row.get("wikiPageID"), size, spill_file))
+    finally:
+        if spilled is not None:
+            spilled.__exit__(None, None, None)
+
+def _row_plain_text(row):
+    """
+    Returns the plain text of the article of the row of 'get_wikipedia_plain_text'
     """
-    Recieves a CSV file with:
+    return _plain_text(row["page"]["text"])
+
+def _parser_version():
+    """
+    Returns the version of the wikitext parser, on which the plain texts depend
+    """
+    return registry.get("parser.mwparserfromhell").__version__
+
+def _open_plain_text_cache(cache_file, cache_size=plaincache.MAX_BYTES):
+    """
+    Returns the cache of the plain texts in the file, keyed by the version of mwparserfromhell, or None if no file is sent
+    """
+    if cache_file is None:
+        return None
+    return plaincache.PlainTextCache(cache_file, _parser_version(), cache_size)
+
+def _with_cached_plain_text(rows, cache):
+    """
+    Yields the pairs (row, plain text) for the rows of the files with the column 'page'.
+    The plain text is the one found in the cache, or None if it must be parsed.
+    """
+    for row in rows:
+        if cache is None:
+            yield row, None
+        else:
+            yield row, cache.get(cache.key(row["page"]["text"]))
+
+def _cache_plain_text(cache, row, plain_text):
+    """
+    Caches the plain text parsed for the article of the row
+    """
+    if cache is not None:
+        cache.put(cache.key(row["page"]["text"]), plain_text)
+
+def _print_cache_counters(input_file, cache):
+    """
+    Prints the hits and misses of the cache while processing the file
+    """
+    if cache is not None:
+        print("%s: plain text cache %d hits, %d misses"%(input_file, cache.hits, cache.misses))
+
+def _row_cached_plain_text(item):
+    """
+    Returns the pair (parsed, plain text) of a pair of '_with_cached_plain_text'.
+    The text is parsed only if it was not cached.
+    """
+    row, plain_text = item
+    if plain_text is not None:
+        return False, plain_text
+    return True, _row_plain_text(row)
+
+@metrics.instrumented
+def get_wikipedia_plain_text(input_file, output_file, workers=1, fmt="csv", cache_file=None, cache_size=plaincache.MAX_BYTES, incremental=False,
+                             max_row_size=None):
+    """
+    Recieves a file in any of the intermediate formats (see 'storage.py') with:
         - Column 'isPrimaryTopicOf' - The URL of the wiki page
         - Column 'wikiPageID' - The wikipedia page id
         - Column 'names' - A JSON list containing the column names
         - Column 'page' - A JSON dict containing the keys 'text' and 'title'
 
-    Writes a CSV file with:
+    Writes a file in the intermediate format 'fmt' with:
         - The required columns for the the input file, except 'page'
         - Added column 'plainText' - A string containig the plain text of the article
+
+    The articles are parsed by 'workers' processes.
+    If a 'cache_file' is sent, the articles parsed in previous runs are read from the cache
+    (see 'plaincache.py') instead of being parsed again. The cache holds up to 'cache_size' bytes.
+    If 'incremental', only the rows not processed in previous runs are parsed (see 'manifest.py').
+    Articles whose wikitext is longer than 'max_row_size' characters are not parsed but written into
+    the file 'output_file.spill' (see '_spill_large_rows').
+    The output is checkpointed every 'checkpoints.INTERVAL' rows, so an interrupted run is resumed
+    from the last checkpoint (see 'checkpoints.py').
     """
 
     # Recieved columns
@@ -166,15 +624,21 @@ def get_wikipedia_plain_text(input_file, output_file):
 
     output_columns = [id_col,url_col,names_col,plain_text_col]
 
-    with open(input_file, 'r') as inputs, open(output_file, 'w') as outputs:
+    cache = _open_plain_text_cache(cache_file, cache_size)
+    row_manifest = _open_manifest(output_file, _row_cached_plain_text, incremental, row_key=itemgetter(0),
+                                  dependencies=[_parser_version])
+    row_checkpoint = checkpoints.Checkpoint(input_file, output_file, "%s\n%s"%(fmt, _parser_version()))
 
-        CSV_inputs = csv.DictReader(inputs)
-        CSV_outputs = csv.DictWriter(outputs, fieldnames=output_columns)
-        CSV_outputs.writeheader()
+    with storage.RowReader(input_file, decode=[page_col]) as inputs, \
+         storage.RowWriter(row_checkpoint.partial_file, output_columns + _carried_columns(inputs, output_columns), fmt,
+                           append=row_checkpoint.resumed) as outputs:
 
-        for row in CSV_inputs:
-            wiki_text = json.loads(row["page"])["text"]
-            plain_text = mwparserfromhell.parse(wiki_text).strip_code()
+        rows = _spill_large_rows(row_checkpoint.skip(inputs), lambda row: len(row[page_col]["text"]), max_row_size,
+                                 output_file + ".spill", inputs.fieldnames, inputs.fmt, append=row_checkpoint.resumed)
+        rows = _with_cached_plain_text(rows, cache)
+        for (row, _), (parsed, plain_text) in _map_rows(_row_cached_plain_text, rows, workers, manifest=row_manifest, stage=metrics.current_stage()):
+            if parsed:
+                _cache_plain_text(cache, row, plain_text)
 
             output_row = {
                 id_col:row[id_col],
@@ -182,12 +646,81 @@ def get_wikipedia_plain_text(input_file, output_file):
                 names_col: row[names_col],
                 plain_text_col: plain_text}
 
-            CSV_outputs.writerow(output_row)
+            _carry_columns(row, output_row)
+            outputs.writerow(output_row)
+            row_checkpoint.update(outputs, row[id_col])
 
-def _split_article_sentences(article_text):
+    row_checkpoint.commit()
+    _close_manifest(input_file, row_manifest)
+    if cache is not None:
+        _print_cache_counters(input_file, cache)
+        cache.close()
+
+# Paragraphs composed by 0 or more space characters
+_EMPTY_PARAGRAPH = re.compile(r'^\s*$')
+
+# Paragraphs of wikitext for displaying an image trough the "thumb" keyword i.e. thumb|25px|left
+_IMAGE_THUMB = re.compile(r'\|thumb\|?|\|?thumb\|')
+
+# Space between two sentences
+_SENTENCE_BOUNDARY = re.compile(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s')
+
+# Sentences ending in '.!?'
+_SENTENCE_END = re.compile(r'.+[\?|\!|\.]$')
+
+def iter_article_sentences(article_text):
     """
     Recieves a string containing the plain text of a wikipedia article
-    Returns a list containing the sentences of the recieved article text
+    Yields the sentences of the recieved article text, one at a time.
+
+    The text is read once, paragraph by paragraph:
+        - Paragraphs composed only by space characters or corresponding to an image thumb are skipped
+        - The other paragraphs are split into sentences
+        - Sentences not ending in '.!?' are skipped
+    """
+    text_length = len(article_text)
+    paragraph_start = 0
+    while paragraph_start <= text_length:
+        paragraph_end = article_text.find("\n", paragraph_start)
+        if paragraph_end == -1:
+            paragraph_end = text_length
+        paragraph = article_text[paragraph_start:paragraph_end]
+        paragraph_start = paragraph_end + 1
+
+        yield from _paragraph_sentences(paragraph)
+
+def iter_wikitext_sentences(wiki_text):
+    """
+    Recieves a string containing the wikitext of a wikipedia article
+    Yields the same sentences as 'iter_article_sentences(_plain_text(wiki_text))', one at a time,
+    stripping the wikitext paragraph by paragraph (see 'iter_plain_text_paragraphs')
+    """
+    for paragraph in iter_plain_text_paragraphs(wiki_text):
+        yield from _paragraph_sentences(paragraph)
+
+def _paragraph_sentences(paragraph):
+    """
+    Yields the sentences of a paragraph of plain text, as described in 'iter_article_sentences'
+    """
+    if _EMPTY_PARAGRAPH.match(paragraph) or _IMAGE_THUMB.match(paragraph):
+        return
+
+    sentence_start = 0
+    for boundary in _SENTENCE_BOUNDARY.finditer(paragraph):
+        sentence = paragraph[sentence_start:boundary.start()]
+        sentence_start = boundary.end()
+        if _SENTENCE_END.match(sentence):
+            yield sentence
+
+    sentence = paragraph[sentence_start:]
+    if _SENTENCE_END.match(sentence):
+        yield sentence
+
+def split_article_sentences_listwise(article_text):
+    """
+    Returns the list of the sentences of the recieved article text, building the list of the paragraphs
+    and of their sentences, then filtering them.
+    Reference implementation of 'iter_article_sentences', kept for comparison (see 'benchmarks.py' and 'test_tasks.py').
     """
 
     def not_image_thumb(paragraph):
@@ -195,7 +728,7 @@ def _split_article_sentences(article_text):
         True if the paragraph is wikitext for displaying an image trough the "thumb" keyword
         i.e. thumb|25px|left
         """
-        return not bool(re.match("\|thumb\|?|\|?thumb\|",paragraph))
+        return not bool(re.match(r"\|thumb\|?|\|?thumb\|",paragraph))
 
     def split_sentences(text):
         """
@@ -208,14 +741,14 @@ def _split_article_sentences(article_text):
 
     # Remove empty paragraphs, composed by 0 or more space characters
     paragraphs = list(filter(lambda x: not bool(re.match(r'^\s*$', x)) , paragraphs))
-    
+
     # Remove the paragraphs corresponding to an image thumb
     paragraphs = list(filter(not_image_thumb, paragraphs))
-    
+
     # Split the paragraphs into sentences
     # i.e [pragraph1,paragraph] -> [[p1_sent1,p1_sent2],[p2_sent1]]
     sentences = list(map(split_sentences,paragraphs))
-    
+
     # Single list i.e. [[1,2],[3]] -> [1,2,3]
     sentences = [j for i in sentences for j in i]
 
@@ -224,17 +757,36 @@ def _split_article_sentences(article_text):
 
     return sentences
 
-def sentence_splitting (input_file, output_file):
+def _split_article_sentences(article_text):
+    """
+    Recieves a string containing the plain text of a wikipedia article
+    Returns a list containing the sentences of the recieved article text (see 'iter_article_sentences')
+    """
+    return list(iter_article_sentences(article_text))
+
+def _row_sentences(row):
+    """
+    Returns the list of the sentences of the row of 'sentence_splitting'
+    """
+    return _split_article_sentences(row["plainText"])
+
+@metrics.instrumented
+def sentence_splitting (input_file, output_file, workers=1, fmt="csv", incremental=False, max_row_size=None):
     """
-    Recieves a CSV file with:
+    Recieves a file in any of the intermediate formats (see 'storage.py') with:
         - Column 'isPrimaryTopicOf' - The URL of the wiki page
         - Column 'wikiPageID' - The wikipedia page id
         - Column 'names' - A JSON list containing the column names
         - Column 'plainText' - A string containig the plain text of the article
 
-    Writes a CSV file with:
+    Writes a file in the intermediate format 'fmt' with:
         - The required columns for the the input file, except 'plainText'
         - Added 'sentences' column - a list with the extracted sentences from the recieved 'plainText'
+
+    The articles are split by 'workers' processes.
+    If 'incremental', only the rows not processed in previous runs are split (see 'manifest.py').
+    Articles whose plain text is longer than 'max_row_size' characters are not split but written into
+    the file 'output_file.spill' (see '_spill_large_rows').
     """
     # Recieved columns
     id_col = "wikiPageID"
@@ -247,15 +799,16 @@ def sentence_splitting (input_file, output_file):
 
     output_columns = [id_col,url_col,names_col,sentences_col]
 
-    with open(input_file, 'r') as inputs, open(output_file, 'w') as outputs:
+    row_manifest = _open_manifest(output_file, _row_sentences, incremental)
+    stage = metrics.current_stage()
 
-        CSV_inputs = csv.DictReader(inputs)
-        CSV_outputs = csv.DictWriter(outputs, fieldnames=output_columns)
-        CSV_outputs.writeheader()
+    with storage.RowReader(input_file, decode=[]) as inputs, \
+         storage.RowWriter(output_file, output_columns + _carried_columns(inputs, output_columns), fmt) as outputs:
 
-        for row in CSV_inputs:
-            
-            sentences = json.dumps(_split_article_sentences(row[plain_text_col]))
+        rows = _spill_large_rows(inputs, lambda row: len(row[plain_text_col]), max_row_size, output_file + ".spill", inputs.fieldnames, inputs.fmt)
+        for row, sentences in _map_rows(_row_sentences, rows, workers, manifest=row_manifest, stage=stage):
+            if stage.enabled:
+                stage.count("sentences", len(sentences))
 
             output_row = {
                 id_col:row[id_col],
@@ -263,7 +816,10 @@ def sentence_splitting (input_file, output_file):
                 names_col: row[names_col],
                 sentences_col: sentences}
 
-            CSV_outputs.writerow(output_row)
+            _carry_columns(row, output_row)
+            outputs.writerow(output_row)
+
+    _close_manifest(input_file, row_manifest)
 
 def filter_sentences_by_mentions(sentences,names):
     """
@@ -278,18 +834,137 @@ def filter_sentences_by_mentions(sentences,names):
             sents.append(sentence)
     return sents
 
-def filter_sentences_with_entities (input_file, output_file):
+def tag_sentences_mentions(sentences,names,entities_gazetteer,keep_other_mentions=False):
+    """
+    Recieves:
+        - sentences - A list of sentences
+        - names - A list of names
+        - entities_gazetteer - A gazetteer.Gazetteer of the names of all the known entities
+        - keep_other_mentions - Keeps the sentences mentioning only entities other than the recieved names
+
+    Scans each sentence once with the gazetteer, finding the known names as whole words only (see
+    'gazetteer.Gazetteer.find'), so that i.e. a name "7" isn't found in "17 de maio".
+    Returns the pair (sentences, mentions):
+        - sentences - The sentences in which at least one of the names appear
+        - mentions - For each returned sentence, the list of all the known names appearing in it
+    The names missing from the gazetteer are searched as 'filter_sentences_by_mentions' does.
+    """
+
+    name_ids = set()
+    missing_names = []
+    for name in names:
+        name_id = entities_gazetteer.name_id(name)
+        if name_id is None:
+            missing_names.append(name)
+        else:
+            name_ids.add(name_id)
+
+    sents = []
+    mentions = []
+    for sentence in sentences:
+        found = entities_gazetteer.find(sentence, whole_words=True)
+        # Names missing from the gazetteer are searched as 'filter_sentences_by_mentions' does
+        if found and (keep_other_mentions or not name_ids.isdisjoint(found)) or any(name in sentence for name in missing_names):
+            sents.append(sentence)
+            mentions.append(sorted(entities_gazetteer.names[name_id] for name_id in found))
+    return sents, mentions
+
+@metrics.instrumented
+def build_gazetteer(input_files, output_file):
+    """
+    Recieves a list of files with:
+        - Column 'wikiPageID' - The wikipedia page id
+        - Column 'names' - A JSON list containing the column names
+
+    Writes a gazetteer.Gazetteer of all the names of the files, associating each name to the
+    pairs (id, IOB class) of the pages it names. The class is the one in the column 'entityType',
+    or the class of the folder or name of the file for files without it.
+    The ids and URLs of the pages are left out, as listed as names by older versions of 'summarize_entity_names'.
+    """
+
+    # Recieved columns
+    id_col = "wikiPageID"
+    url_col = "isPrimaryTopicOf"
+    names_col = "names"
+    type_col = "entityType"
+
+    stage = metrics.current_stage()
+    entities_gazetteer = gazetteer.Gazetteer()
+    for input_file in input_files:
+        file_entity_type = _entity_type_flag(input_file, required=False)
+        with storage.RowReader(input_file, decode=[names_col]) as inputs:
+            for row in inputs:
+                entity_type = row.get(type_col) or file_entity_type or _entity_type_flag(input_file)
+                for name in row[names_col]:
+                    if name not in (row[id_col], row.get(url_col)):
+                        entities_gazetteer.add(name, (row[id_col], entity_type))
+                stage.rows_in += 1
+    stage.rows_out = len(entities_gazetteer)
+
+    entities_gazetteer.save(output_file)
+
+def _known_entity_type(entities_gazetteer, name):
+    """
+    Returns the IOB class of the entities named by the name in the gazetteer of 'build_gazetteer'.
+    A name of entities of several classes gets the class of most of them, the first in alphabetical order on a tie.
+    """
+    counts = {}
+    for _, entity_type in entities_gazetteer.values[entities_gazetteer.name_id(name)]:
+        counts[entity_type] = counts.get(entity_type, 0) + 1
+    return max(sorted(counts), key=counts.get) if counts else ""
+
+def _mention_types(entities_gazetteer, mentions, names):
+    """
+    Returns the dict of the IOB class of each known name in the mentions of the sentences (see
+    'tag_sentences_mentions'), except the recieved names of the article
+    """
+    names = set(names)
+    return {name: _known_entity_type(entities_gazetteer, name)
+            for sentence_mentions in mentions for name in sentence_mentions if name not in names}
+
+def _row_filtered_sentences(row, gazetteer_file=None, keep_other_mentions=False, multi_type=False):
     """
-    Recieves a CSV file with:
+    Returns the list of the sentences mentioning the names of the row of 'filter_sentences_with_entities'
+    When a gazetteer is sent, also returns the list of the mentions of each sentence (see 'tag_sentences_mentions'),
+    and if 'multi_type', the IOB class of the other mentioned names (see '_mention_types')
+    """
+    sentences = row["sentences"]
+    names = row["names"]
+    if gazetteer_file is None:
+        return filter_sentences_by_mentions(sentences,names), None
+
+    entities_gazetteer = gazetteer.load(gazetteer_file)
+    sentences, mentions = tag_sentences_mentions(sentences, names, entities_gazetteer, keep_other_mentions)
+    if multi_type:
+        return sentences, mentions, _mention_types(entities_gazetteer, mentions, names)
+    return sentences, mentions
+
+@metrics.instrumented
+def filter_sentences_with_entities (input_file, output_file, workers=1, gazetteer_file=None, keep_other_mentions=False, fmt="csv", incremental=False,
+                                    multi_type=False):
+    """
+    Recieves a file in any of the intermediate formats (see 'storage.py') with:
         - Column 'isPrimaryTopicOf' - The URL of the wiki page
         - Column 'wikiPageID' - The wikipedia page id
         - Column 'names' - A JSON list containing the column names
         - Column 'sentences' - A list with the extracted sentences from the recieved 'plainText'
 
-    Writes a CSV file with:
+    Writes a file in the intermediate format 'fmt' with:
         - The required recieved columns.
         - The sentences in the column "sentence" that don't mention any of the names of the column
-        "names" will be removed       
+        "names" will be removed
+
+    If the file of a gazetteer of all the entities is sent (see 'build_gazetteer'), each sentence is
+    scanned once with it and the CSV file also has:
+        - Added 'mentions' column - A JSON list with the list of the known names mentioned in each sentence
+    With 'keep_other_mentions', the sentences mentioning only other entities are kept too. It requires
+    'multi_type', as otherwise those mentions would be labelled 'O' in the dataset.
+    With 'multi_type', the file also has:
+        - Added 'mentionTypes' column - A JSON dict with the IOB class of each known name mentioned in the
+        sentences other than the names of the row, so that 'IOB' labels them with their own class
+
+    The articles are filtered by 'workers' processes.
+    If 'incremental', only the rows not processed in previous runs are filtered (see 'manifest.py').
     """
     # Recieved columns
     id_col = "wikiPageID"
@@ -297,28 +972,91 @@ def filter_sentences_with_entities (input_file, output_file):
     names_col = "names"
     sentences_col = "sentences"
 
-    output_columns = [id_col,url_col,names_col,sentences_col]
-
-    with open(input_file, 'r') as inputs, open(output_file, 'w') as outputs:
+    # Added columns
+    mentions_col = "mentions"
+    mention_types_col = "mentionTypes"
 
-        CSV_inputs = csv.DictReader(inputs)
-        CSV_outputs = csv.DictWriter(outputs, fieldnames=output_columns)
-        CSV_outputs.writeheader()
+    if multi_type and gazetteer_file is None:
+        raise ValueError("The 'multi_type' mode requires a gazetteer")
+    if keep_other_mentions and not multi_type:
+        raise ValueError("'keep_other_mentions' requires the 'multi_type' mode")
 
-        for row in CSV_inputs:
-            sentences = json.loads(row[sentences_col])
-            names = json.loads(row[names_col])
+    output_columns = [id_col,url_col,names_col,sentences_col]
+    if gazetteer_file is not None:
+        output_columns.append(mentions_col)
+    if multi_type:
+        output_columns.append(mention_types_col)
+
+    row_function = partial(_row_filtered_sentences, gazetteer_file=gazetteer_file, keep_other_mentions=keep_other_mentions)
+    if multi_type:
+        row_function = partial(row_function, multi_type=True)
+    row_manifest = _open_manifest(output_file, row_function, incremental,
+                                  dependencies=[partial(manifest.file_digest, gazetteer_file)] if gazetteer_file is not None else [])
+    stage = metrics.current_stage()
+
+    with storage.RowReader(input_file, decode=[sentences_col,names_col]) as inputs, \
+         storage.RowWriter(output_file, output_columns + _carried_columns(inputs, output_columns), fmt) as outputs:
+
+        for row, filtered in _map_rows(row_function, inputs, workers, manifest=row_manifest, stage=stage):
+            if stage.enabled:
+                stage.count("sentences", len(filtered[0]))
+                stage.count("articles_without_sentences", not filtered[0])
 
             output_row = {
                 id_col:row[id_col],
                 url_col:row[url_col],
                 names_col: row[names_col],
-                sentences_col:json.dumps(filter_sentences_by_mentions(sentences,names))}
-            CSV_outputs.writerow(output_row)
+                sentences_col:filtered[0]}
+            if gazetteer_file is not None:
+                output_row[mentions_col] = filtered[1]
+            if multi_type:
+                output_row[mention_types_col] = filtered[2]
+            _carry_columns(row, output_row)
+            outputs.writerow(output_row)
+
+    _close_manifest(input_file, row_manifest)
+
+# Tokens of a sentence:
+#   - '.', '?' or '!' followed by one of them or ending the sentence
+#   - ',' or ':' followed by a space or ending the sentence
+#   - Words, made of any other characters except spaces
+_WORD_TOKEN = re.compile(r'[.?!](?=[.?!]|\Z)|[,:](?= |\Z)|(?:[^ ,:.?!]+|[,:](?! |\Z)|[.?!](?![.?!]|\Z))+')
 
 def split_words (sentence):
     """
     Returns the words of the recieved sentence
+
+    The sentence is split on spaces. The characters ',' and ':' are tokens when followed by a space or
+    ending the sentence, and the characters '.', '?' and '!' are tokens when followed by one of them or
+    ending the sentence, i.e. "Today, allright?" -> ["Today", ",", "allright", "?"]
+    """
+    return _WORD_TOKEN.findall(sentence)
+
+def split_words_batch (sentences):
+    """
+    Returns the list of the words of each of the recieved sentences (see 'split_words')
+    """
+    findall = _WORD_TOKEN.findall
+    return [findall(sentence) for sentence in sentences]
+
+# Number of distinct sentences whose words are kept by each process (see 'intern_words')
+SENTENCE_MEMO_SIZE = 100000
+
+@lru_cache(maxsize=SENTENCE_MEMO_SIZE)
+def intern_words (word_splitter, sentence):
+    """
+    Returns the words of the sentence split by the word splitter, splitting each distinct sentence
+    once for each process.
+
+    The same sentences repeat across articles and entity types (i.e. infobox leftovers and navigation
+    boilerplate), and the returned list is shared by all of them, so it must not be changed.
+    """
+    return word_splitter(sentence)
+
+def split_words_charwise (sentence):
+    """
+    Returns the words of the recieved sentence, reading it one character at a time.
+    Reference implementation of 'split_words', kept for comparison (see 'benchmarks.py').
     """
     tokens =[]
     token = []
@@ -372,19 +1110,35 @@ def split_words (sentence):
     #words = nltk.word_tokenize
 
 
-def split_sentences_entities (input_file, output_file,word_splitter):
+def _row_tokenized(row, word_splitter):
+    """
+    Returns the lists of the tokenized names and sentences of the row of 'split_sentences_entities'
+    The names are followed by the other mentioned names of the column 'mentionTypes', if any, in alphabetical order.
+    """
+    tokenized_names = [word_splitter(name) for name in row["names"] + sorted(row.get("mentionTypes") or {})]
+    tokenized_sentences = [intern_words(word_splitter, sentence) for sentence in row["sentences"]]
+    return tokenized_names, tokenized_sentences
+
+@metrics.instrumented
+def split_sentences_entities (input_file, output_file,word_splitter,workers=1,fmt="csv",incremental=False):
     """
-     - word_splitter - A function for splitting a sentence into words
+     - word_splitter - A picklable function for splitting a sentence into words
+     - workers - The number of processes splitting the articles
+     - incremental - Splits only the rows not processed in previous runs (see 'manifest.py')
 
-    Recieves a CSV file with:
+    Recieves a file in any of the intermediate formats (see 'storage.py') with:
         - Column 'isPrimaryTopicOf' - The URL of the wiki page
         - Column 'wikiPageID' - The wikipedia page id
         - Column 'names' - A JSON list containing the column names
         - Column 'sentences' column - a list with the extracted sentences from the article
 
-    Writes a CSV file with:
+    Writes a file in the intermediate format 'fmt' with:
         - Added 'tokenizedSentences' column - A json list of the tokens of the sentence
-        - Added 'tokenizedNames' column - A json list of the tokens of the names
+        - Added 'tokenizedNames' column - A json list of the tokens of the names. If the row has the column
+        'mentionTypes' (see 'filter_sentences_with_entities'), followed by the tokens of the names in it
+        in alphabetical order, so that they are matched along with the names of the row
+
+    Each distinct sentence is split once for each process (see 'intern_words').
     """
 
     # Recieved columns
@@ -392,6 +1146,7 @@ def split_sentences_entities (input_file, output_file,word_splitter):
     url_col = "isPrimaryTopicOf"
     names_col = "names"
     sentences_col = "sentences"
+    mention_types_col = "mentionTypes"
 
     # Added columns
     tokenized_sentences_col = "tokenizedSentences"
@@ -399,18 +1154,16 @@ def split_sentences_entities (input_file, output_file,word_splitter):
 
     output_columns = [id_col,url_col,names_col,sentences_col,tokenized_names_col,tokenized_sentences_col]
 
-    with open(input_file, 'r') as inputs, open(output_file, 'w') as outputs:
-
-        CSV_inputs = csv.DictReader(inputs)
-        CSV_outputs = csv.DictWriter(outputs, fieldnames=output_columns)
-        CSV_outputs.writeheader()
+    row_function = partial(_row_tokenized, word_splitter=word_splitter)
+    row_manifest = _open_manifest(output_file, row_function, incremental)
+    stage = metrics.current_stage()
 
-        for row in CSV_inputs:
-            sentences = json.loads(row[sentences_col])
-            names = json.loads(row[names_col])
+    with storage.RowReader(input_file, decode=[sentences_col,names_col,mention_types_col]) as inputs, \
+         storage.RowWriter(output_file, output_columns + _carried_columns(inputs, output_columns), fmt) as outputs:
 
-            tokenized_sentences = json.dumps([split_words(sentence) for sentence in sentences])
-            tokenized_names = json.dumps([split_words(name) for name in names])
+        for row, (tokenized_names, tokenized_sentences) in _map_rows(row_function, inputs, workers, manifest=row_manifest, stage=stage):
+            if stage.enabled:
+                stage.count("tokens", sum(map(len, tokenized_sentences)))
 
             output_row = {
                 id_col:row[id_col],
@@ -420,65 +1173,82 @@ def split_sentences_entities (input_file, output_file,word_splitter):
                 tokenized_names_col: tokenized_names,
                 tokenized_sentences_col: tokenized_sentences}
 
-            CSV_outputs.writerow(output_row)
+            _carry_columns(row, output_row)
+            outputs.writerow(output_row)
 
-def score_counter(sentence_tokens,entity_tokens,sentence_index=0,entity_index=0,current_score=0,exact_matching=True):
-    """
-    Recieved
-        - sentence_tokens - The tokens of the sentence
-        - entity_tokens - The tokens of the entity
-        - sentence_index - The current index of the sentence
-        - entity_index - The current index of the entity
-        - current_score=0 - The current score of the entity
+    _close_manifest(input_file, row_manifest)
 
-    Returns the score of the entity.
-    The score is an integer that indicates how many tokens of the entity in order are present in the
-    sentence starting from the recieved sentence_index.
-    """
+# Positions of the trie node fields, see 'build_entities_trie'
+_CHILDREN = 0
+_ENTITY = 1
+_SUBTREE_ENTITY = 2
 
-    def counter_aux(sentence_tokens,entity_tokens,sentence_index,entity_index,current_score):
-        """
-        Auxiliary recursive function for the 'score_counter' function.
-        Does not check for exact matching.
-        """
-       
-        if sentence_tokens[sentence_index] == entity_tokens[entity_index]:
-            # Reached last token of the sentence or entity
-            if sentence_index+1 == len(sentence_tokens) or entity_index+1 == len(entity_tokens):
-                return current_score+1
-            return counter_aux(sentence_tokens, entity_tokens, sentence_index+1, entity_index+1, current_score+1)
-        return current_score
-
-    score = counter_aux(sentence_tokens,entity_tokens,sentence_index,entity_index,current_score)
-    # If exact matching selected, ignore other cases
-    if exact_matching and not score == len(entity_tokens):
-        return 0
-    return score
+def build_entities_trie(tokenized_entities):
+    """
+    Recieves:
+        tokenized_entities - List of the tokenized entities
 
-def match_entities(tokenized_entities, tokenized_sentence, exact_matching=True):
+    Returns the token trie of the entities, to be built once and used for matching many sentences.
+    Each node is a list [children, entity, subtree_entity] in which:
+        - 'children' - Dict mapping the next token to the child node
+        - 'entity' - The greatest id of the entities ending in the node, or -1
+        - 'subtree_entity' - The greatest id of the entities passing trough the node
+    """
+    root = [{}, -1, -1]
+    for entity_id, entity_tokens in enumerate(tokenized_entities):
+        node = root
+        for token in entity_tokens:
+            node = node[_CHILDREN].setdefault(token, [{}, -1, -1])
+            node[_SUBTREE_ENTITY] = entity_id
+        node[_ENTITY] = entity_id
+    return root
+
+def match_entities(tokenized_entities, tokenized_sentence, exact_matching=True, trie=None):
     """
     Recieves:
         tokenized_entities - List of the tokenized entities
         tokenized_sentence - The sentence tokens
         exact_matching - Flag that indicates if only exact matchings of the entities will be considered.
-            An exact matching occurs when the full text of the entity name is present
+            An exact matching occurs when the full text of the entity name is present.
+            Otherwise the longest sequence of the first tokens of an entity is matched.
+        trie - The trie of the tokenized entities (see 'build_entities_trie'). Built if not sent
+
+    The sentence is read from left to right, matching the longest entity starting at each token.
+    On a tie the entity of greatest id is matched. The matches don't overlap.
 
     Returns:
-        List [[(init,end) ...] ...] in which:
-            - 'init','end' - The segment of occurence of the entity
+        List [[(init,offset) ...] ...] in which:
+            - 'init' - The index of the first token of the occurence of the entity
+            - 'offset' - The index of the last token of the occurence, relative to 'init'
             - The matches of the specific entity are in the id of returned list which is the same as its id in the recieved list
     """
+    if trie is None:
+        trie = build_entities_trie(tokenized_entities)
+
+    entity_field = _ENTITY if exact_matching else _SUBTREE_ENTITY
+
     matches = [[] for i in range(len(tokenized_entities))]
+    n_tokens = len(tokenized_sentence)
     i=0
-    while i < len(tokenized_sentence):
-        entity_scores = [score_counter(tokenized_sentence, entity_tokens, i, exact_matching=exact_matching) for entity_tokens in tokenized_entities]
-        entity_score,entity_id = max([(v,i) for i,v in enumerate(entity_scores)])
-        
+    while i < n_tokens:
+        entity_score = 0
+        entity_id = -1
+
+        # Walk down the trie while the tokens match
+        node = trie
+        j = i
+        while j < n_tokens:
+            node = node[_CHILDREN].get(tokenized_sentence[j])
+            if node is None:
+                break
+            j += 1
+            if node[entity_field] >= 0:
+                entity_score = j - i
+                entity_id = node[entity_field]
+
         # Entity matches
         if entity_score != 0:
-            a = [i,entity_score-1]
-            
-            matches[entity_id].append(a)
+            matches[entity_id].append([i,entity_score-1])
         i = i + max([entity_score,1])
 
     return matches
@@ -488,9 +1258,32 @@ def match_entities(tokenized_entities, tokenized_sentence, exact_matching=True):
 #matches = match_entities(tokenized_entities,tokenized_sentence,True)
 #print(matches)
 
-def annotate_sentences_entities (input_file, output_file):
+def _annotate_entities(tokenized_names, tokenized_sentences, exact_matching=True):
+    """
+    Returns the matches of the names in the sentences, packed as an array (see 'annotations.py'),
+    building the trie of the names once
+    """
+    trie = build_entities_trie(tokenized_names)
+    return annotations.pack(match_entities(tokenized_names,tokenized_sentence,exact_matching,trie) for tokenized_sentence in tokenized_sentences)
+
+def _unmatched_names(names, annotated_entities):
+    """
+    Returns the names of an article never matched in its sentences, from their packed matches.
+    The names are the first of the tokenized names (see '_entity_types')
+    """
+    matched = set(annotated_entities[1::annotations.FIELDS])
+    return [name for entity_index, name in enumerate(names) if entity_index not in matched]
+
+def _row_annotated_entities(row, exact_matching=True):
     """
-    Recieves a CSV file with:
+    Returns the packed matches of the names in the sentences of the row of 'annotate_sentences_entities'
+    """
+    return _annotate_entities(row["tokenizedNames"], row["tokenizedSentences"], exact_matching)
+
+@metrics.instrumented
+def annotate_sentences_entities (input_file, output_file, workers=1, exact_matching=True, fmt="csv", incremental=False):
+    """
+    Recieves a file in any of the intermediate formats (see 'storage.py') with:
         - Column 'isPrimaryTopicOf' - The URL of the wiki page
         - Column 'wikiPageID' - The wikipedia page id
         - Column 'names' - A JSON list containing the column names
@@ -498,10 +1291,16 @@ def annotate_sentences_entities (input_file, output_file):
         - Column 'tokenizedSentences' - A json list of the tokens of the sentence
         - Column 'tokenizedNames' - A json list of the tokens of the names
 
-    Writes a CSV file with:
-        - Added 'annotatedEntities' - a structure in the format [ [(init,end),(init,end) ...] [(init,end),(init,end) ...] ...]
-        The first element of the list is a list corresponding to the occurences of the name of index of same index in the column 'sentences'
-        The 'init' and 'end' are the beginning and end of the name in the tokens of the sentence in the column 'tokenizedSentence'
+    Writes a file in the intermediate format 'fmt' with:
+        - Added 'annotatedEntities' - The matches of the names, a flat array of quadruples (sentence, entity, start, length)
+        The 'sentence' is the index of the sentence in the column 'tokenizedSentences' and 'entity' the index of the name in the column 'tokenizedNames'
+        The 'start' and 'length' are the first token of the name in the tokens of the sentence and its number of tokens
+        The array is written as a base64 string in the CSV format (see 'annotations.py')
+
+    The sentences are annotated by 'workers' processes.
+    The names never matched in the sentences of their article are counted in the metrics (see 'metrics.report').
+    With 'exact_matching' set to False, prefixes of the names are matched too (see 'match_entities').
+    If 'incremental', only the rows not processed in previous runs are annotated (see 'manifest.py').
     """
 
     # Recieved columns
@@ -517,17 +1316,18 @@ def annotate_sentences_entities (input_file, output_file):
 
     output_columns = [id_col,url_col,names_col,sentences_col,tokenized_sentences_col,tokenized_names_col,annotated_entities_col]
 
-    with open(input_file, 'r') as inputs, open(output_file, 'w') as outputs:
-
-        CSV_inputs = csv.DictReader(inputs)
-        CSV_outputs = csv.DictWriter(outputs, fieldnames=output_columns)
-        CSV_outputs.writeheader()
+    row_function = partial(_row_annotated_entities, exact_matching=exact_matching)
+    row_manifest = _open_manifest(output_file, row_function, incremental)
+    stage = metrics.current_stage()
 
-        for row in CSV_inputs:
-            tokenized_sentences = json.loads(row[tokenized_sentences_col])
-            tokenized_names = json.loads(row[tokenized_names_col])
+    with storage.RowReader(input_file, decode=[tokenized_sentences_col,tokenized_names_col]) as inputs, \
+         storage.RowWriter(output_file, output_columns + _carried_columns(inputs, output_columns), fmt) as outputs:
 
-            annotated_entities = [match_entities(tokenized_names,tokenized_sentence) for tokenized_sentence in tokenized_sentences]
+        for row, annotated_entities in _map_rows(row_function, inputs, workers, manifest=row_manifest, stage=stage):
+            if stage.enabled:
+                names = json.loads(row[names_col]) if isinstance(row[names_col], str) else row[names_col]
+                stage.count("mentions", len(annotated_entities) // annotations.FIELDS)
+                stage.aliases(names, _unmatched_names(names, annotated_entities), pseudo_names=(row[id_col], row[url_col]))
 
             output_row = {
                 id_col: row[id_col],
@@ -538,237 +1338,444 @@ def annotate_sentences_entities (input_file, output_file):
                 tokenized_names_col: row[tokenized_names_col],
                 annotated_entities_col: annotated_entities}
 
-            CSV_outputs.writerow(output_row)
+            _carry_columns(row, output_row)
+            outputs.writerow(output_row)
+
+    _close_manifest(input_file, row_manifest)
+
+# IOB classes of the entities of the input files, by the name of their folder or of the file
+ENTITY_TYPES = {"Person":"PER","Organisation":"ORG","Place":"LOC"}
+
+def _entity_type_flag(file_name, required=True):
+    """
+    Returns the IOB class of the entities of the recieved file (see 'ENTITY_TYPES'), from the name of its
+    folder or else from its name up to the first '.', i.e. 'Person/part0.csv' or 'data/Person.00001.st7'.
+    Used for the rows without the column 'entityType' (see 'summarize_entity_names').
+    If neither is in ENTITY_TYPES, raises a ValueError, or returns None if not 'required'.
+    """
+    for name in (basename(dirname(abspath(file_name))), basename(file_name).split(".")[0]):
+        if name in ENTITY_TYPES:
+            return ENTITY_TYPES[name]
+    if required:
+        raise ValueError("Can't resolve the entity type of %s: neither its folder nor its name is one of %s"%(file_name, ", ".join(sorted(ENTITY_TYPES))))
+    return None
+
+def _entity_types(names, entity_type, mention_types=None):
+    """
+    Returns the list of the IOB class of each entity matched in an article, in the order of its tokenized
+    names (see '_row_tokenized'): the class of the article for its names, followed by the classes of
+    the other mentioned names in 'mention_types', in alphabetical order
+    """
+    if not entity_type:
+        raise ValueError("The entities %s have no IOB class: the row has no 'entityType' and the file no entity type"%(json.dumps(names)))
+    mention_types = mention_types or {}
+    return [entity_type] * len(names) + [mention_types[name] for name in sorted(mention_types)]
+
+def _iob_sentences(tokenized_sentences, annotated_entities, type_flag, entity_types=None):
+    """
+    Recieves:
+        - tokenized_sentences - The tokens of each sentence
+        - annotated_entities - The packed matches of the sentences (see 'annotations.py')
+        - type_flag - The class of the entities (see '_entity_type_flag')
+        - entity_types - The class of each entity (see '_entity_types'), overriding 'type_flag'
+
+    Returns the pair (sentences, counts):
+        - sentences - The list of the IOB lines of each sentence, each ending with an empty line
+        - counts - For each sentence, the pair (tokens, classes) of its number of tokens and the list of
+          the class of each mention labelled in it, taken from its labels (see '_count_iob_sentences')
+    """
+
+    # Labels written after each token, including the separator and the line end, by class
+    classes = set(entity_types) if entity_types is not None else {type_flag}
+    inside_labels = {entity_class: "\tI-%s\n"%(entity_class) for entity_class in classes}
+    outside_label = "\tO\n"
+    begin_labels = {entity_class: "\tB-%s\n"%(entity_class) for entity_class in classes}
+    begin_classes = {label: entity_class for entity_class, label in begin_labels.items()}
+
+    sentences_labels = [[outside_label] * len(tokens) for tokens in tokenized_sentences]
+
+    for sentence_index, entity_index, start, length in annotations.iter_matches(annotated_entities):
+        entity_class = entity_types[entity_index] if entity_types is not None else type_flag
+        labels = sentences_labels[sentence_index]
+        labels[start] = begin_labels[entity_class]
+        labels[start+1:start+length] = [inside_labels[entity_class]] * (length - 1)
+
+    sentences = ["".join(map(add, tokens, labels)) + "\n" for tokens, labels in zip(tokenized_sentences, sentences_labels)]
+    counts = [(len(labels), [begin_classes[label] for label in labels if label in begin_classes]) for labels in sentences_labels]
+    return sentences, counts
+
+def _iob_article(names, tokenized_sentences, annotated_entities, type_flag, entity_types=None):
+    """
+    Returns the pair (lines, counts) of the IOB lines of the article sentences, each sentence preceded
+    by 'names', the JSON list of the names of the article, and of the counts of the sentences (see '_iob_sentences')
+    """
+    sentences, counts = _iob_sentences(tokenized_sentences, annotated_entities, type_flag, entity_types)
+    return "".join(names + sentence for sentence in sentences), counts
+
+def _write_unique_sentences(outputs, names, sentences, written):
+    """
+    Writes the IOB lines of the sentences of an article (see '_iob_sentences') not written before,
+    each preceded by 'names'. The hashes of the written sentences are kept in the set 'written'.
+    Returns the list of the indexes of the written sentences.
+    """
+    unique = []
+    for index, sentence in enumerate(sentences):
+        key = hashlib.sha1(sentence.encode()).digest()
+        if key in written:
+            continue
+        written.add(key)
+        unique.append(index)
+        outputs.write(names + sentence)
+    return unique
+
+def _count_iob_sentences(stage, counts):
+    """
+    Adds the number of sentences, tokens and mentions of each class of the written IOB sentences of an
+    article to the counters of the stage, from the counts of the sentences returned by '_iob_sentences'
+    """
+    stage.count("sentences", len(counts))
+    for tokens, classes in counts:
+        stage.counters["tokens"] += tokens
+        for entity_class in classes:
+            stage.counters["mentions:" + entity_class] += 1
+
+def _row_entity_types(row, type_flag):
+    """
+    Returns the class of each entity of the row (see '_entity_types'). The class of the names of the
+    row is the one in the column 'entityType' if it has one, or else 'type_flag'
+    """
+    return _entity_types(row["names"], row.get("entityType") or type_flag, row.get("mentionTypes"))
+
+def _row_iob(row, type_flag):
+    """
+    Returns the IOB lines of the row of 'IOB' and the counts of its sentences (see '_iob_article')
+    """
+    return _iob_article(json.dumps(row["names"]), row["tokenizedSentences"], row["annotatedEntities"], type_flag, _row_entity_types(row, type_flag))
+
+def _row_iob_sentences(row, type_flag):
+    """
+    Returns the list of the IOB lines of each sentence of the row of 'IOB' and their counts (see '_iob_sentences')
+    """
+    return _iob_sentences(row["tokenizedSentences"], row["annotatedEntities"], type_flag, _row_entity_types(row, type_flag))
+
+# Size of the write buffer of the .conll files, so that the articles are written to the disk in bulk
+_IOB_BUFFER_SIZE = 1 << 20
+
+def _open_iob_output(output_file):
+    """
+    Returns the text file to which the IOB lines are written, compressed with gzip if its name ends with '.gz'
+    """
+    if output_file.endswith(".gz"):
+        return gzip.open(output_file, 'wt')
+    return open(output_file, 'w', buffering=_IOB_BUFFER_SIZE)
 
 # Artigo original - https://arxiv.org/pdf/cmp-lg/9505040.pdf
-def IOB (input_file, output_file):
+@metrics.instrumented
+def IOB (input_file, output_file, workers=1, incremental=False, dedup_sentences=False):
     """
-    Recieves a CSV file with:
+    Recieves a file in any of the intermediate formats (see 'storage.py') with:
         - Column 'isPrimaryTopicOf' - The URL of the wiki page
         - Column 'wikiPageID' - The wikipedia page id
         - Column 'names' - A JSON list containing the column names
         - Column 'sentences' - A list with the extracted sentences from the article
         - Column 'tokenizedSentences' - A json list of the tokens of the sentence
         - Column 'tokenizedNames' - A json list of the tokens of the names
-        - Column 'annotatedEntities' - A structure in the format [ [(init,end),(init,end) ...] [(init,end),(init,end) ...] ...]
-        The first element of the list is a list corresponding to the occurences of the name of index of same index in the column 'sentences'
-        The 'init' and 'end' are the beginning and end of the name in the tokens of the sentence in the column 'tokenizedSentence'
+        - Column 'annotatedEntities' - The packed matches of the names (see 'annotate_sentences_entities' and 'annotations.py')
+        Files written by older versions, with the matches in the nested format of 'match_entities', are read too
+        - Optional column 'entityType' - The IOB class of the entities of the row, i.e. PER
+        - Optional column 'mentionTypes' - The IOB class of the other names matched (see 'filter_sentences_with_entities')
 
-    Writes a .conll file in the IOB format
+    Writes a .conll file in the IOB format, compressed with gzip if the name of the file ends with '.gz'.
+    The class of the entities of rows without the column 'entityType' is resolved from the path of the input file.
+
+    If 'incremental', only the rows not processed in previous runs are written again (see 'manifest.py').
+    If 'dedup_sentences', the annotated sentences already written into the file are dropped, so the
+    sentences repeated by several articles are written once.
     """
 
     # Recieved columns
-    id_col = "wikiPageID"
-    url_col = "isPrimaryTopicOf"
     names_col = "names"
-    sentences_col = "sentences"
     tokenized_sentences_col = "tokenizedSentences"
-    tokenized_names_col = "tokenizedNames"
     annotated_entities_col = "annotatedEntities"
+    mention_types_col = "mentionTypes"
 
-    with open(input_file, 'r') as inputs, open(output_file, 'w') as outputs:
+    type_flag = _entity_type_flag(input_file, required=False)
 
-        CSV_inputs = csv.DictReader(inputs)
+    row_function = partial(_row_iob_sentences if dedup_sentences else _row_iob, type_flag=type_flag)
+    row_manifest = _open_manifest(output_file, row_function, incremental)
+    stage = metrics.current_stage()
+    written = set()
+    duplicates = 0
 
-        inside_flag = "I"
-        outside_flag = "O"
-        begin_flag = "B"
-
-        org_flag = "ORG"
-        location_flag = "LOC"
-        person_flag = "PER"
-
-        for row in CSV_inputs:
-            sentence_tokens = json.loads(row[tokenized_sentences_col])
-            annotated_entities = json.loads(row[annotated_entities_col])
-
-            sentences = json.loads(row[sentences_col])
-            names = json.loads(row[names_col])
-            
-            for sentence_index, sentence_matches in enumerate(annotated_entities):
-                corresponding_sentence = sentences[sentence_index]
-
-                lines = [{"token":token,"position":outside_flag,"class":""} for token in sentence_tokens[sentence_index] ]
-            
-                for entity_index, entity_matches in enumerate(sentence_matches):
-                    corresponding_entity = names[entity_index]
-
-                    for match in entity_matches:
-                        
-                        # TODO: Change to inform the entity type elsewhere
-                        # i.e. entity_type = entity["type"]
-                        type_flag = ""
-                        if "Person" in input_file:
-                            type_flag = person_flag
-                        elif "Organisation" in input_file:
-                            type_flag = org_flag
-                        elif "Place" in input_file:
-                            type_flag = location_flag
-
-                        # print(annotated_entities)
-                        # print(matches)
-                        # print(match)
-                        init = match[0]
-                        end = match[1]
-
-                        lines[init]["position"] = begin_flag
-                        lines[init]["class"] = type_flag
-
-                        for i in range(init+1,end+1):
-                            lines[init]["position"] = inside_flag
-                            lines[init]["class"] = type_flag
-
-                outputs.write(row[names_col])
-                for line in lines:
-                    if line["position"] == outside_flag:
-                        outputs.write("%s\t%s\n"%(line["token"],line["position"]))
-                    else:
-                        outputs.write("%s\t%s-%s\n"%(line["token"],line["position"],line["class"]))
-                outputs.write("\n")
+    with storage.RowReader(input_file, decode=[names_col,tokenized_sentences_col,annotated_entities_col,mention_types_col]) as inputs, _open_iob_output(output_file) as outputs:
 
-def apply_postaggers (sentences,postaggers):
-    return [{"sentence":sentence,"annotations": {postagger_name:postagger_function(sentence) for postagger_name, postagger_function in postaggers.items()}} for sentence in sentences]
+        for row, (lines, counts) in _map_rows(row_function, inputs, workers, manifest=row_manifest, stage=stage):
+            if dedup_sentences:
+                unique = _write_unique_sentences(outputs, json.dumps(row[names_col]), lines, written)
+                duplicates += len(lines) - len(unique)
+                counts = [counts[index] for index in unique]
+            else:
+                outputs.write(lines)
+            if stage.enabled:
+                _count_iob_sentences(stage, counts)
+
+    if dedup_sentences:
+        print("%s: %d duplicate sentences dropped"%(input_file, duplicates))
+        stage.count("duplicate_sentences", duplicates)
+    _close_manifest(input_file, row_manifest)
 
-def annotate_sentences_with_postaggers (input_file, output_file, postaggers):
+def _row_fused(item, type_flag, word_splitter, exact_matching=True, gazetteer_file=None, keep_other_mentions=False, keep_plain_text=False,
+               dedup_sentences=False, multi_type=False):
+    """
+    Recieves a pair (row, plain text) of '_with_cached_plain_text'
+    Returns the tuple (plain text if it was parsed or None, IOB lines of the row of 'fused_stages', names
+    never matched in the sentences). If 'dedup_sentences', the IOB lines are the list of the lines of each
+    sentence (see '_iob_sentences').
+
+    Unless 'keep_plain_text', the parsed plain text is not kept: the sentences are split and filtered
+    paragraph by paragraph (see 'iter_wikitext_sentences'), and None is returned instead of it.
+    """
+    row, plain_text = item
+    names = row["names"]
+    parsed = plain_text is None
+    if plain_text is not None:
+        sentences = iter_article_sentences(plain_text)
+    elif keep_plain_text:
+        plain_text = _row_plain_text(row)
+        sentences = iter_article_sentences(plain_text)
+    else:
+        sentences = iter_wikitext_sentences(row["page"]["text"])
+
+    mention_types = None
+    if gazetteer_file is None:
+        sentences = filter_sentences_by_mentions(sentences, names)
+    else:
+        entities_gazetteer = gazetteer.load(gazetteer_file)
+        sentences, mentions = tag_sentences_mentions(sentences, names, entities_gazetteer, keep_other_mentions)
+        if multi_type:
+            mention_types = _mention_types(entities_gazetteer, mentions, names)
+
+    tokenized_sentences = [intern_words(word_splitter, sentence) for sentence in sentences]
+    tokenized_names = [word_splitter(name) for name in names + sorted(mention_types or {})]
+
+    annotated_entities = _annotate_entities(tokenized_names, tokenized_sentences, exact_matching)
+    entity_types = _entity_types(names, row.get("entityType") or type_flag, mention_types)
+
+    unmatched_names = _unmatched_names(names, annotated_entities)
+
+    if dedup_sentences:
+        return plain_text if parsed else None, _iob_sentences(tokenized_sentences, annotated_entities, type_flag, entity_types), unmatched_names
+    return plain_text if parsed else None, _iob_article(json.dumps(names), tokenized_sentences, annotated_entities, type_flag, entity_types), unmatched_names
+
+@metrics.instrumented
+def fused_stages (input_file, output_file, word_splitter=split_words, workers=1, exact_matching=True, gazetteer_file=None, keep_other_mentions=False,
+                  cache_file=None, cache_size=plaincache.MAX_BYTES, incremental=False, max_row_size=None, dedup_sentences=False,
+                  multi_type=False):
     """
-    Recieves a CSV file with:
+     - word_splitter - A picklable function for splitting a sentence into words
+     - workers - The number of processes processing the articles
+     - exact_matching - If False, prefixes of the names are matched too (see 'match_entities')
+     - gazetteer_file, keep_other_mentions - Filter the sentences as 'filter_sentences_with_entities'. 'keep_other_mentions' requires 'multi_type'
+     - cache_file, cache_size - Cache the plain texts as 'get_wikipedia_plain_text'
+     - incremental - Processes only the rows not processed in previous runs (see 'manifest.py')
+     - max_row_size - Spills the articles longer than it as 'get_wikipedia_plain_text'
+     - dedup_sentences - Drops the annotated sentences already written as 'IOB'
+     - multi_type - Labels the other known names mentioned with their own class, as 'filter_sentences_with_entities'
+
+    Runs the stages from 'get_wikipedia_plain_text' to 'IOB' in a single pass, keeping each
+    article in memory instead of writing the intermediate files. The written file is the same
+    as the one written by running the stages one after the other.
+    Unless the plain texts are cached, each article is stripped and split paragraph by paragraph,
+    without holding its whole plain text.
+
+    Recieves a file in any of the intermediate formats (see 'storage.py') with:
         - Column 'isPrimaryTopicOf' - The URL of the wiki page
         - Column 'wikiPageID' - The wikipedia page id
         - Column 'names' - A JSON list containing the column names
-        - Column 'sentences' column - a list with the extracted sentences from the article
+        - Column 'page' - A JSON dict containing the keys 'text' and 'title'
 
-    Writes a CSV file with:
-        - The required recieved columns except "sentences"
-        - Added "annottations" column - A empty json with dict : {}
+    Writes a .conll file in the IOB format, compressed with gzip if the name of the file ends with '.gz'
     """
 
+    type_flag = _entity_type_flag(input_file, required=False)
+
+    row_function = partial(_row_fused, type_flag=type_flag, word_splitter=word_splitter, exact_matching=exact_matching,
+                           gazetteer_file=gazetteer_file, keep_other_mentions=keep_other_mentions, keep_plain_text=cache_file is not None)
+    if dedup_sentences:
+        row_function = partial(row_function, dedup_sentences=True)
+    if multi_type:
+        if gazetteer_file is None:
+            raise ValueError("The 'multi_type' mode requires a gazetteer")
+        row_function = partial(row_function, multi_type=True)
+    elif keep_other_mentions:
+        raise ValueError("'keep_other_mentions' requires the 'multi_type' mode")
+
     # Recieved columns
-    id_col = "wikiPageID"
-    url_col = "isPrimaryTopicOf"
     names_col = "names"
-    sentences_col = "sentences"
-
-    # Added columns
-    annotated_col = "annotated"
-    output_columns = [id_col,url_col,names_col,annotated_col]
+    page_col = "page"
 
-    with open(input_file, 'r') as inputs, open(output_file, 'w') as outputs:
+    cache = _open_plain_text_cache(cache_file, cache_size)
+    dependencies = [_parser_version]
+    if gazetteer_file is not None:
+        dependencies.append(partial(manifest.file_digest, gazetteer_file))
+    row_manifest = _open_manifest(output_file, row_function, incremental, row_key=itemgetter(0), dependencies=dependencies)
+    stage = metrics.current_stage()
+    written = set()
+    duplicates = 0
+
+    with storage.RowReader(input_file, decode=[names_col,page_col]) as inputs, _open_iob_output(output_file) as outputs:
+
+        rows = _spill_large_rows(inputs, lambda row: len(row[page_col]["text"]), max_row_size, output_file + ".spill", inputs.fieldnames, inputs.fmt)
+        rows = _with_cached_plain_text(rows, cache)
+        for (row, _), (plain_text, (lines, counts), unmatched_names) in _map_rows(row_function, rows, workers, manifest=row_manifest, stage=stage):
+            if plain_text is not None:
+                _cache_plain_text(cache, row, plain_text)
+            if dedup_sentences:
+                unique = _write_unique_sentences(outputs, json.dumps(row[names_col]), lines, written)
+                duplicates += len(lines) - len(unique)
+                counts = [counts[index] for index in unique]
+            else:
+                outputs.write(lines)
+            if stage.enabled:
+                _count_iob_sentences(stage, counts)
+                stage.aliases(row[names_col], unmatched_names, pseudo_names=(row.get("wikiPageID"), row.get("isPrimaryTopicOf")))
+
+    if dedup_sentences:
+        print("%s: %d duplicate sentences dropped"%(input_file, duplicates))
+        stage.count("duplicate_sentences", duplicates)
+    _close_manifest(input_file, row_manifest)
+    if cache is not None:
+        _print_cache_counters(input_file, cache)
+        cache.close()
 
-        CSV_inputs = csv.DictReader(inputs)
-        CSV_outputs = csv.DictWriter(outputs, fieldnames=output_columns)
-        CSV_outputs.writeheader()
+def apply_postaggers (sentences,postaggers):
+    """
+    Recieves a list of sentences and a dict of postaggers (see 'postaggers.py')
+    Returns, for each sentence, a dict with the sentence and the annotations of each postagger.
 
-        for row in CSV_inputs:
-            sentences = json.loads(row[sentences_col])
+    The postaggers may be functions or names of the registry (see 'registry.py'), loaded on first use.
+    Postaggers with a 'batch' function tag all the sentences in a single call.
+    """
+    annotations = {}
+    for postagger_name, postagger_function in postaggers.items():
+        postagger_function = registry.resolve(postagger_function)
+        batch_function = getattr(postagger_function, "batch", None)
+        if batch_function is not None:
+            annotations[postagger_name] = batch_function(sentences)
+        else:
+            annotations[postagger_name] = [postagger_function(sentence) for sentence in sentences]
+    return [{"sentence":sentence,"annotations": {postagger_name:annotations[postagger_name][i] for postagger_name in postaggers}}
+            for i, sentence in enumerate(sentences)]
 
-            output_row = {
-                id_col:row[id_col],
-                url_col:row[url_col],
-                names_col: row[names_col],
-                annotated_col: apply_postaggers(sentences,postaggers)}
-            CSV_outputs.writerow(output_row)
+def _row_postags(row, postaggers):
+    """
+    Returns the annotations of the sentences of the row of 'annotate_sentences_with_postaggers'
+    """
+    return apply_postaggers(row["sentences"], postaggers)
 
-# [DEPRECATED]
-def request_wikipedia_pages (input_file, output_file):
+@metrics.instrumented
+def annotate_sentences_with_postaggers (input_file, output_file, postaggers, workers=1, fmt="csv", incremental=False):
     """
-    Recieves a CSV file with:
+    Recieves a file in any of the intermediate formats (see 'storage.py') with:
         - Column 'isPrimaryTopicOf' - The URL of the wiki page
         - Column 'wikiPageID' - The wikipedia page id
         - Column 'names' - A JSON list containing the column names
+        - Column 'sentences' column - a list with the extracted sentences from the article
 
-    Writes a CSV file with:
-        - The 'URL','id' and 'names' columns in the input file
-        - Column 'page' - A JSON dict containing the keys 'text' and 'links'
-        containing the text and links of the Wikipedia page
-        If an exception was raised while getting the page, the row is discarded
-    """
+    Writes a file in the intermediate format 'fmt' with:
+        - The required recieved columns except "sentences"
+        - Added "annotated" column - A list with a dict for each sentence with the keys 'sentence'
+          and 'annotations', the dict of the annotations of each postagger (see 'apply_postaggers')
 
-    def request_page (wikiPageId):
-        """
-        Returns a dict with the keys:
-            - 'text' - The wikipedia page plain text
-            - 'links' - The referenced Wikipedia links
-        """
-        wikiPage = wikipedia.page(wikiPageId)
-        print(wikiPage.url)
-        # Removes the section titiles i.e. "=== Title ==="
-        return {"text":re.sub('=+ .* =+','',wikiPage.content,flags=re.MULTILINE),
-                "links":wikiPage.links}
+    The articles are tagged by 'workers' processes, each one loading the postaggers once.
+    The 'postaggers' are a dict of the names of the postaggers to functions or names of the registry (see 'registry.py').
+    If 'incremental', only the rows not processed in previous runs are tagged (see 'manifest.py').
+    """
 
-    # Recieved, unchanged columns
+    # Recieved columns
     id_col = "wikiPageID"
     url_col = "isPrimaryTopicOf"
     names_col = "names"
+    sentences_col = "sentences"
 
-    # Adipedia.set_rate_limiting(rate_limit=False)
-    wikipedia.set_lang("pt")
-    with open(input_file, 'r') as inputs, open(output_file, 'w') as outputs:
+    # Added columns
+    annotated_col = "annotated"
+    output_columns = [id_col,url_col,names_col,annotated_col]
 
-        CSV_inputs = csv.DictReader(inputs)
-        CSV_outputs = csv.DictWriter(outputs, fieldnames=output_columns)
-        CSV_outputs.writeheader()
+    row_function = partial(_row_postags, postaggers=postaggers)
+    row_manifest = _open_manifest(output_file, row_function, incremental)
 
-        for row in CSV_inputs:
-            try:
-                output_row = {
-                    id_col:row[id_col], # keeps id_col
-                    url_col:row[url_col], # keeps url_col
-                    names_col:row[names_col], # keeps name_col
-                    page_col:request_page(row[id_col])} # gets Wikipedia page
-                CSV_outputs.writerow(output_row)
-            except:
-                pass
-    output_columns = [id_col,url_col,names_col,page_col]
+    with storage.RowReader(input_file, decode=[sentences_col]) as inputs, storage.RowWriter(output_file, output_columns, fmt) as outputs:
 
-    wikipedia.set_rate_limiting(rate_limit=False)
-    wikipedia.set_lang("pt")
-    with open(input_file, 'r') as inputs, open(output_file, 'w') as outputs:
+        for row, annotated in _map_rows(row_function, inputs, workers, manifest=row_manifest, stage=metrics.current_stage()):
 
-        CSV_inputs = csv.DictReader(inputs)
-        CSV_outputs = csv.DictWriter(outputs, fieldnames=output_columns)
-        CSV_outputs.writeheader()
+            output_row = {
+                id_col:row[id_col],
+                url_col:row[url_col],
+                names_col: row[names_col],
+                annotated_col: annotated}
+            outputs.writerow(output_row)
 
-        for row in CSV_inputs:
-            try:
-                output_row = {
-                    id_col:row[id_col], # keeps id_col
-                    url_col:row[url_col], # keeps url_col
-                    names_col:row[names_col], # keeps name_col
-                    page_col:request_page(row[id_col])} # gets Wikipedia page
-                CSV_outputs.writerow(output_row)
-            except:
-                pass
+    _close_manifest(input_file, row_manifest)
 
-# [DEPRECATED]
-def split_csv_file(file_path,file_name_stem,chunks,extension):
+@metrics.instrumented
+def shard_file(input_file, output_file_stem, shard_rows=None, shard_bytes=None, extension=".cst1"):
     """
-    Splits a file into chunks saving those into files with a specified name format
-    The name format is as follows: [file_name_stem].[nth_chunk][extension] 
+    Splits a file into shards in a single pass, saving those into files with a specified name format
+    The name format is as follows: [output_file_stem].[nth_shard][extension], with 'nth_shard' zero padded
+    so that the shards sort in the order of their rows. Shards left by previous runs are removed.
 
     Recieves:
-        - file_path - The path of the file to be splitted
-        - file_name_stem - The basic format from which the new file name must be build upon
-        - chunks - The quantity of 'chunk files' in which the sent file must be splitted
-        - extension - The file extension of the chunks created
+        - input_file - A file in any of the intermediate formats (see 'storage.py'), i.e. a .st1 file
+        - output_file_stem - The basic format from which the new file names must be build upon
+        - shard_rows - The maximum number of rows of each shard
+        - shard_bytes - The maximum size in bytes of each shard. A shard has at least one row
+        - extension - The file extension of the shards created
+
+    The shards are written in the format of the input file. An empty input file yields one empty shard.
+    Returns the list of the written shards.
     """
-
-    n_lines = sum(1 for line in csv.DictReader(open(file_path,"r")))
-    n_rest = n_lines%chunks
-    chunk_size = int(n_lines/chunks)
-
-    with open(file_path,"r") as file:
-        csv_file = csv.DictReader(file)
-        
-        for nth_chunk in range(chunks):
-            # [file_name_steam].[nth][extension]
-            chunk_file_name = file_name_stem +"."+str(nth_chunk) + extension
-            with open(chunk_file_name,"w") as chunk_file:
-                writer = csv.DictWriter(chunk_file,csv_file.fieldnames)                
-                writer.writeheader()
-
-                for i in range(chunk_size):
-                    writer.writerow(csv_file.__next__())
-
-                if n_rest > 0:
-                    n_rest-=1
-                    writer.writerow(csv_file.__next__())
+    if shard_rows is None and shard_bytes is None:
+        raise ValueError("Either 'shard_rows' or 'shard_bytes' must be sent")
+
+    for old_shard in glob.glob(glob.escape(output_file_stem) + ".*" + extension):
+        os.remove(old_shard)
+
+    stage = metrics.current_stage()
+    shards = []
+
+    with storage.RowReader(input_file, decode=[]) as inputs:
+
+        def open_shard():
+            shards.append("%s.%05d%s"%(output_file_stem, len(shards), extension))
+            return storage.RowWriter(shards[-1], inputs.fieldnames, inputs.fmt).__enter__()
+
+        outputs = open_shard()
+        n_rows = 0
+        try:
+            for row in inputs:
+                if n_rows and ((shard_rows is not None and n_rows >= shard_rows) or
+                               (shard_bytes is not None and outputs.tell() >= shard_bytes)):
+                    outputs.__exit__(None, None, None)
+                    outputs = open_shard()
+                    n_rows = 0
+
+                outputs.writerow(row)
+                n_rows += 1
+                stage.rows_in += 1
+                stage.rows_out += 1
+        finally:
+            outputs.__exit__(None, None, None)
+
+    return shards
+
+@metrics.instrumented
+def concatenate_files(input_files, output_file):
+    """
+    Concatenates the files into the output file in the order of their names, i.e. the .conllu
+    files of the shards written by 'shard_file'
+    """
+    with open(output_file, 'wb') as outputs:
+        for input_file in sorted(input_files):
+            with open(input_file, 'rb') as inputs:
+                shutil.copyfileobj(inputs, outputs)
@@ -0,0 +1,40 @@
+""" test_annotations.py - Defines the tests of the packed matches of the names (see 'annotations.py'), run with pytest """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from array import array
+import json
+
+import annotations
+
+# Matches of 2 names in 3 sentences, in the nested format of 'tasks.match_entities'
+NESTED = [[[[0, 1]], []], [[], []], [[[3, 0], [7, 2]], [[5, 0]]]]
+
+def test_pack_and_unpack():
+    packed = annotations.pack(NESTED)
+    assert packed == array(annotations.TYPECODE, [0, 0, 0, 2, 2, 0, 3, 1, 2, 0, 7, 3, 2, 1, 5, 1])
+    assert list(annotations.iter_matches(packed)) == [(0, 0, 0, 2), (2, 0, 3, 1), (2, 0, 7, 3), (2, 1, 5, 1)]
+    assert annotations.unpack(packed, 3, 2) == NESTED
+
+def test_unpack_without_matches():
+    assert annotations.pack([[[], []], []]) == array(annotations.TYPECODE)
+    assert annotations.unpack(array(annotations.TYPECODE), 2, 2) == [[[], []], [[], []]]
+
+def test_bytes_and_base64():
+    packed = annotations.pack(NESTED)
+    data = annotations.to_bytes(packed)
+    assert data == b"".join(value.to_bytes(4, "little", signed=True) for value in packed)
+    assert annotations.from_bytes(data) == packed
+    assert annotations.decode(annotations.encode(packed)) == packed
+
+def test_load_any_form():
+    packed = annotations.pack(NESTED)
+    for value in (packed, annotations.to_bytes(packed), annotations.encode(packed), json.dumps(NESTED), NESTED):
+        assert annotations.load(value) == packed
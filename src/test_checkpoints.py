@@ -0,0 +1,141 @@
+""" test_checkpoints.py - Defines the tests of resuming the interrupted tasks (see 'checkpoints.py'), run with pytest """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from os.path import exists
+import json
+import os
+import sqlite3
+
+import pytest
+
+import checkpoints
+import storage
+import tasks
+
+COLUMNS = ["wikiPageID","isPrimaryTopicOf","names"]
+
+class Crash(Exception):
+    """
+    Raised by the tasks of the tests to interrupt them
+    """
+
+def _write_input(path, article_ids):
+    """
+    Writes a stage 1 file with a row for each of the ids
+    """
+    with storage.RowWriter(path, COLUMNS) as outputs:
+        for article_id in article_ids:
+            outputs.writerow({"wikiPageID":article_id, "isPrimaryTopicOf":"http://pt.wikipedia.org/?curid=%s"%(article_id),
+                              "names":["Artigo %s"%(article_id)]})
+
+def _read_ids(path):
+    with storage.RowReader(path) as inputs:
+        return [row["wikiPageID"] for row in inputs]
+
+def _copy_rows(input_file, output_file, interval=4, crash_at=None):
+    """
+    Task copying the rows of the input file, checkpointed every 'interval' rows and interrupted
+    before writing the row at the position 'crash_at', counted from 1
+    """
+    row_checkpoint = checkpoints.Checkpoint(input_file, output_file, "csv", interval=interval)
+    with storage.RowReader(input_file) as inputs, \
+         storage.RowWriter(row_checkpoint.partial_file, COLUMNS, append=row_checkpoint.resumed) as outputs:
+        for position, row in enumerate(row_checkpoint.skip(inputs), row_checkpoint.rows + 1):
+            if position == crash_at:
+                raise Crash()
+            outputs.writerow(row)
+            row_checkpoint.update(outputs, row["wikiPageID"])
+    row_checkpoint.commit()
+
+def test_resumes_after_a_crash(tmp_path):
+    input_file, output_file = str(tmp_path / "input.st1"), str(tmp_path / "output.st2")
+    article_ids = [str(article_id) for article_id in range(1, 20)]
+    _write_input(input_file, article_ids)
+
+    with pytest.raises(Crash):
+        _copy_rows(input_file, output_file, crash_at=11)
+    assert not exists(output_file)
+    with open(output_file + ".checkpoint") as file:
+        assert json.load(file)["rows"] == 8
+
+    _copy_rows(input_file, output_file)
+    assert _read_ids(output_file) == article_ids
+    assert not exists(output_file + ".checkpoint")
+    assert not exists(output_file + ".partial")
+
+def test_resumes_at_the_position_of_repeated_ids(tmp_path):
+    input_file, output_file = str(tmp_path / "input.st1"), str(tmp_path / "output.st2")
+    article_ids = ["1", "2", "3"] * 5
+    _write_input(input_file, article_ids)
+
+    with pytest.raises(Crash):
+        _copy_rows(input_file, output_file, crash_at=10)
+    _copy_rows(input_file, output_file)
+    assert _read_ids(output_file) == article_ids
+
+def test_starts_over_when_the_input_changed(tmp_path):
+    input_file, output_file = str(tmp_path / "input.st1"), str(tmp_path / "output.st2")
+    _write_input(input_file, [str(article_id) for article_id in range(10, 30)])
+    with pytest.raises(Crash):
+        _copy_rows(input_file, output_file, crash_at=11)
+
+    # An input of the same size and modification time, in which the checkpointed article moved
+    stat = os.stat(input_file)
+    article_ids = [str(article_id) for article_id in range(29, 9, -1)]
+    _write_input(input_file, article_ids)
+    os.utime(input_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.path.getsize(input_file) == stat.st_size
+
+    _copy_rows(input_file, output_file)
+    assert _read_ids(output_file) == article_ids
+
+def test_starts_over_when_the_checkpointed_article_is_gone(tmp_path):
+    input_file, output_file = str(tmp_path / "input.st1"), str(tmp_path / "output.st2")
+    _write_input(input_file, [str(article_id) for article_id in range(10, 30)])
+    with pytest.raises(Crash):
+        _copy_rows(input_file, output_file, crash_at=11)
+
+    stat = os.stat(input_file)
+    article_ids = [str(article_id) for article_id in range(10, 17)] + [str(article_id) for article_id in range(70, 83)]
+    _write_input(input_file, article_ids)
+    os.utime(input_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.path.getsize(input_file) == stat.st_size
+
+    _copy_rows(input_file, output_file)
+    assert _read_ids(output_file) == article_ids
+
+def test_get_wikipedia_page_resumes_after_a_crash(tmp_path, monkeypatch):
+    db = str(tmp_path / "wikipedia.db")
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE WikiElement (id INTEGER PRIMARY KEY, title TEXT, content TEXT)")
+    conn.executemany("INSERT INTO WikiElement VALUES (?,?,?)", [(article_id, "Artigo %d"%(article_id), "Texto %d"%(article_id)) for article_id in range(1, 24)])
+    conn.commit()
+    conn.close()
+
+    input_file, output_file = str(tmp_path / "input.st1"), str(tmp_path / "output.st2")
+    article_ids = [str(article_id) for article_id in range(1, 27)]
+    _write_input(input_file, article_ids)
+
+    # Interrupted while fetching the third batch
+    get_articles_info = tasks._get_articles_info
+    def crash_on_third_batch(ids, db):
+        if "11" in ids:
+            raise Crash()
+        return get_articles_info(ids, db)
+    monkeypatch.setattr(tasks, "_get_articles_info", crash_on_third_batch)
+    with pytest.raises(Crash):
+        tasks.get_wikipedia_page(input_file, output_file, db, batch_size=5)
+    monkeypatch.undo()
+
+    tasks.get_wikipedia_page(input_file, output_file, db, batch_size=5)
+    with storage.RowReader(output_file) as inputs:
+        assert [(row["wikiPageID"], row["page"]["title"]) for row in inputs] == [(str(article_id), "Artigo %d"%(article_id)) for article_id in range(1, 24)]
+    assert _read_ids(output_file + ".discarded") == ["24", "25", "26"]
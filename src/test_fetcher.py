@@ -0,0 +1,105 @@
+""" test_fetcher.py - Defines the tests of the client of the MediaWiki API against its local stand-in (see 'fetcher.py'), run with pytest """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+import sqlite3
+
+import pytest
+
+import fetcher
+
+# Articles of the dump served by the MockServer, by id
+ARTICLES = {page_id: ("Artigo %d"%(page_id), "Texto do artigo %d. "%(page_id) * page_id) for page_id in range(1, 13)}
+
+# Id of no article of the dump
+MISSING_ID = "999"
+
+@pytest.fixture
+def dump(tmp_path):
+    """
+    The SQLite dump of the ARTICLES
+    """
+    db = str(tmp_path / "wikipedia.db")
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE WikiElement (id INTEGER PRIMARY KEY, title TEXT, content TEXT)")
+    conn.executemany("INSERT INTO WikiElement VALUES (?,?,?)", [(page_id, title, text) for page_id, (title, text) in ARTICLES.items()])
+    conn.commit()
+    conn.close()
+    return db
+
+def _fetch(api_url, page_ids, **options):
+    """
+    Returns the pair (articles, fetcher) of the articles fetched from the API by a closed fetcher
+    """
+    options.setdefault("rate", 0)
+    options.setdefault("backoff", 0.01)
+    with fetcher.WikipediaFetcher(api_url, **options) as api_fetcher:
+        return api_fetcher.fetch(page_ids), api_fetcher
+
+def test_follows_the_continuation(dump):
+    page_ids = [str(page_id) for page_id in ARTICLES] + [MISSING_ID]
+    with fetcher.MockServer(dump, page_limit=3) as server:
+        articles, api_fetcher = _fetch(server.url, page_ids, batch_size=fetcher.BATCH_SIZE)
+    assert articles == dict({str(page_id): article for page_id, article in ARTICLES.items()}, **{MISSING_ID: None})
+    assert server.requests == api_fetcher.requests == 4
+    assert api_fetcher.failed == 0
+
+def test_retries_the_failed_requests(dump):
+    page_ids = [str(page_id) for page_id in ARTICLES]
+    with fetcher.MockServer(dump, fail_every=3) as server:
+        articles, api_fetcher = _fetch(server.url, page_ids, batch_size=2, concurrency=1)
+    assert articles == {str(page_id): article for page_id, article in ARTICLES.items()}
+    assert api_fetcher.retried == 2
+    assert api_fetcher.failed == 0
+
+def test_follows_the_redirects(dump):
+    page_ids = [str(page_id) for page_id in ARTICLES]
+    with fetcher.MockServer(dump) as server:
+        moved_url = server.url.replace(server.PATH, "/api.php")
+        articles, api_fetcher = _fetch(moved_url, page_ids, batch_size=4, concurrency=1)
+    assert articles == {str(page_id): article for page_id, article in ARTICLES.items()}
+    # The permanent redirect is followed once, the following requests are sent to the API
+    assert server.requests == api_fetcher.requests == 4
+
+def test_caches_only_the_missing_pages(dump, tmp_path):
+    cache_file = str(tmp_path / "api.cache")
+    page_ids = [str(page_id) for page_id in ARTICLES] + [MISSING_ID]
+    with fetcher.MockServer(dump, page_limit=3) as server:
+        # Responses truncated without a continuation, as by a broken API
+        complete_response = server._response
+        def truncated_response(*args):
+            response = complete_response(*args)
+            response.pop("continue", None)
+            return response
+        server._response = truncated_response
+        articles, api_fetcher = _fetch(server.url, page_ids, batch_size=fetcher.BATCH_SIZE, cache_file=cache_file)
+    assert [page_id for page_id, article in articles.items() if article is not None] == ["1", "2", "3"]
+    assert api_fetcher.failed == len(ARTICLES) - 3
+
+    cache = fetcher.ResponseCache(cache_file)
+    try:
+        assert sorted(cache.get_many(server.url, page_ids)) == ["1", "2", "3", MISSING_ID]
+        assert cache.get_many(server.url, [MISSING_ID]) == {MISSING_ID: (None, None)}
+    finally:
+        cache.close()
+
+def test_api_errors_are_not_cached(dump, tmp_path):
+    cache_file = str(tmp_path / "api.cache")
+    page_ids = [str(page_id) for page_id in range(1, fetcher.BATCH_SIZE + 2)]
+    with fetcher.MockServer(dump) as server:
+        articles, api_fetcher = _fetch(server.url, page_ids, batch_size=len(page_ids), cache_file=cache_file)
+    assert set(articles.values()) == {None}
+    assert api_fetcher.failed == len(page_ids)
+
+    cache = fetcher.ResponseCache(cache_file)
+    try:
+        assert cache.get_many(server.url, page_ids) == {}
+    finally:
+        cache.close()
@@ -0,0 +1,45 @@
+""" test_gazetteer.py - Defines the tests of the multi-pattern matcher of the names of the entities (see 'gazetteer.py'), run with pytest """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+import gazetteer
+
+NAMES = ["7", "Lisboa", "Rio", "Rio de Janeiro", "Ltda."]
+
+def test_finds_the_names_as_substrings():
+    entities_gazetteer = gazetteer.Gazetteer(NAMES)
+    for text in ["A 17 de maio houve festa.", "Rio de Janeiro e Lisboa", "Riozinho", "Lisboa-Ltda. 7", ""]:
+        assert entities_gazetteer.mentions(text) == sorted(name for name in NAMES if name in text)
+
+def test_finds_the_names_as_whole_words():
+    entities_gazetteer = gazetteer.Gazetteer(NAMES)
+    assert entities_gazetteer.mentions("A 17 de maio houve festa.", whole_words=True) == []
+    assert entities_gazetteer.mentions("Riozinho", whole_words=True) == []
+    assert entities_gazetteer.mentions("No Rio de Janeiro, a 7 de maio.", whole_words=True) == ["7", "Rio", "Rio de Janeiro"]
+    assert entities_gazetteer.mentions("Lisboa-Ltda. 17", whole_words=True) == ["Lisboa", "Ltda."]
+    assert entities_gazetteer.mentions("7", whole_words=True) == ["7"]
+
+def test_values_of_the_names(tmp_path):
+    entities_gazetteer = gazetteer.Gazetteer()
+    assert entities_gazetteer.add("Lisboa", ("7", "LOC")) == entities_gazetteer.add("Lisboa", ("8", "ORG"))
+    entities_gazetteer.add("Silva", ("1990", "PER"))
+    assert entities_gazetteer.add("") is None
+    assert len(entities_gazetteer) == 2
+    assert "Silva" in entities_gazetteer and "Silv" not in entities_gazetteer
+    assert entities_gazetteer.values[entities_gazetteer.name_id("Lisboa")] == {("7", "LOC"), ("8", "ORG")}
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "gazetteer.pickle")
+    entities_gazetteer = gazetteer.Gazetteer(NAMES)
+    entities_gazetteer.save(path)
+    loaded = gazetteer.load(path)
+    assert loaded is gazetteer.load(path)
+    assert loaded.names == NAMES
+    assert loaded.mentions("No Rio de Janeiro, a 7 de maio.", whole_words=True) == ["7", "Rio", "Rio de Janeiro"]
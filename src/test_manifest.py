@@ -0,0 +1,84 @@
+""" test_manifest.py - Defines the tests of the manifests of the outputs of the pipeline (see 'manifest.py'), run with pytest """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from array import array
+from functools import partial
+import importlib
+import sqlite3
+import sys
+
+import manifest
+
+ROWS = [{"wikiPageID":str(article_id), "names":["Artigo %d"%(article_id)], "annotatedEntities":array("i", [0, 0, 0, article_id])}
+        for article_id in range(1, 1201)]
+
+def _run(output_file, signature, rows):
+    """
+    Returns the pair (hits, misses) of a run computing the results of the rows with the manifest,
+    recording the results missing from it
+    """
+    row_manifest = manifest.Manifest(output_file, signature)
+    keys = [row_manifest.key(row) for row in rows]
+    results = row_manifest.get_many(keys)
+    for key, row in zip(keys, rows):
+        if key in results:
+            assert results[key] == row["wikiPageID"]
+        else:
+            row_manifest.put(key, row, row["wikiPageID"])
+    row_manifest.close()
+    return row_manifest.hits, row_manifest.misses
+
+def test_reuses_the_results_of_the_same_rows(tmp_path):
+    output_file = str(tmp_path / "output.st6")
+    assert _run(output_file, "signature", ROWS) == (0, len(ROWS))
+    assert _run(output_file, "signature", ROWS) == (len(ROWS), 0)
+
+    changed = ROWS[:10] + [dict(row, names=row["names"] + ["Outro nome"]) for row in ROWS[10:20]]
+    assert _run(output_file, "signature", changed) == (10, 10)
+
+def test_removes_the_rows_not_found_in_a_run(tmp_path):
+    output_file = str(tmp_path / "output.st6")
+    _run(output_file, "signature", ROWS)
+    _run(output_file, "signature", ROWS[:5])
+    conn = sqlite3.connect(output_file + ".manifest")
+    assert conn.execute("SELECT COUNT(*) FROM Rows").fetchone()[0] == 5
+    conn.close()
+    assert _run(output_file, "signature", ROWS[:10]) == (5, 5)
+
+def test_invalidated_by_another_signature(tmp_path):
+    output_file = str(tmp_path / "output.st6")
+    _run(output_file, "signature", ROWS)
+    assert _run(output_file, "another signature", ROWS) == (0, len(ROWS))
+
+def test_code_signature_changes_with_the_code(tmp_path, monkeypatch):
+    module_file = tmp_path / "manifest_stage.py"
+    module_file.write_text("def stage(row, option=1):\n    return row\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = importlib.import_module("manifest_stage")
+    try:
+        function = partial(module.stage, option=2)
+        signature = manifest.code_signature(function)
+        assert signature.startswith("manifest_stage.stage(option=2)\nversion %d\n"%(manifest.MANIFEST_VERSION))
+        assert manifest.code_signature(function) == signature
+        assert manifest.code_signature(partial(module.stage, option=3)) != signature
+
+        module_file.write_text("def stage(row, option=1):\n    return dict(row)\n")
+        assert manifest.code_signature(function) != signature
+    finally:
+        del sys.modules["manifest_stage"]
+
+def test_select_in_batches(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "keys.db"))
+    conn.execute("CREATE TABLE Keys (key INTEGER PRIMARY KEY)")
+    conn.executemany("INSERT INTO Keys VALUES (?)", [(key,) for key in range(0, 3000, 2)])
+    rows = list(manifest.select_in(conn, "SELECT key FROM Keys WHERE key IN (%s)", range(2000), batch_size=300))
+    assert sorted(key for (key,) in rows) == list(range(0, 2000, 2))
+    conn.close()
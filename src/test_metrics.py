@@ -0,0 +1,78 @@
+""" test_metrics.py - Defines the tests of the metrics of the stages and of their report (see 'metrics.py'), run with pytest """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+import pytest
+
+import metrics
+import storage
+import tasks
+
+@pytest.fixture
+def metrics_file(tmp_path):
+    """
+    The metrics file of the stages run by a test, disabled again when it ends
+    """
+    path = str(tmp_path / "metrics.jsonl")
+    metrics.configure(path)
+    yield path
+    metrics.configure(None)
+
+def _write_tokenized(path, rows):
+    """
+    Writes a stage 4 file (see 'tasks.split_sentences_entities') of the rows with the columns
+    'wikiPageID', 'isPrimaryTopicOf', 'names' and 'sentences'
+    """
+    columns = ["wikiPageID","isPrimaryTopicOf","names","sentences","tokenizedNames","tokenizedSentences"]
+    with storage.RowWriter(path, columns) as outputs:
+        for row in rows:
+            row["tokenizedNames"], row["tokenizedSentences"] = tasks._row_tokenized(row, tasks.split_words)
+            outputs.writerow(row)
+
+def test_report_counts_the_names_only(tmp_path, metrics_file):
+    input_file, output_file = str(tmp_path / "Person" / "person.st4"), str(tmp_path / "Person" / "person.st6")
+    (tmp_path / "Person").mkdir()
+    _write_tokenized(input_file, [
+        {"wikiPageID":"1990", "isPrimaryTopicOf":"http://pt.wikipedia.org/wiki/João_Silva", "names":["João Silva", "Silva", "Joãozinho"],
+         "sentences":["João Silva nasceu em 1990 .", "Silva morreu ."]},
+        # As written by older versions of 'summarize_entity_names', with the id and URL among the names
+        {"wikiPageID":"7", "isPrimaryTopicOf":"http://pt.wikipedia.org/wiki/Maria", "names":["http://pt.wikipedia.org/wiki/Maria", "7", "Maria"],
+         "sentences":["Maria nasceu a 7 de maio ."]}])
+
+    tasks.annotate_sentences_entities(input_file, output_file)
+
+    statistics = metrics.report(metrics_file, top=5)
+    stage = statistics["stages"]["annotate_sentences_entities"]
+    assert (stage["files"], stage["rows_in"], stage["rows_out"]) == (1, 2, 2)
+    assert stage["counters"]["mentions"] == 4
+    assert statistics["aliases"] == {"aliases":4, "matched":3, "hit_rate":0.75, "unmatched":[("Joãozinho", 1)]}
+    assert sorted(record["wikiPageID"] for record in statistics["slowest_articles"]) == ["1990", "7"]
+
+    text = metrics.format_report(statistics)
+    assert "Aliases: 3 of 4 matched (75.0%)" in text
+    assert "Joãozinho" in text
+    assert "http://" not in text
+
+def test_iob_counts_come_from_the_labels(tmp_path, metrics_file):
+    input_file, output_file = str(tmp_path / "Person" / "person.st6"), str(tmp_path / "Person" / "person.conllu")
+    (tmp_path / "Person").mkdir()
+    # Tokens with tabs and line breaks, written as they are to the IOB lines
+    row = {"wikiPageID":"1990", "isPrimaryTopicOf":"http://pt.wikipedia.org/wiki/João_Silva", "names":["João Silva", "Silva"],
+           "tokenizedSentences":[["João", "Silva", "viu", "a\tB-LOC", "."], ["Silva", "saiu\n\n", "."]]}
+    row["annotatedEntities"] = tasks._annotate_entities([["João", "Silva"], ["Silva"]], row["tokenizedSentences"])
+    with storage.RowWriter(input_file, list(row)) as outputs:
+        outputs.writerow(row)
+
+    tasks.IOB(input_file, output_file)
+
+    counters = metrics.report(metrics_file)["stages"]["IOB"]["counters"]
+    assert (counters["sentences"], counters["tokens"]) == (2, 8)
+    assert counters["mentions:PER"] == 2
+    assert "mentions:LOC" not in counters
@@ -0,0 +1,82 @@
+""" test_storage.py - Defines the tests of the serialization of the intermediate files (see 'storage.py'), run with pytest """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from array import array
+
+import pytest
+
+import annotations
+import storage
+
+COLUMNS = ["wikiPageID","isPrimaryTopicOf","names","sentences","tokenizedNames","tokenizedSentences","annotatedEntities","entityType"]
+
+ROWS = [
+    {"wikiPageID":"1990", "isPrimaryTopicOf":"http://pt.wikipedia.org/wiki/João_Silva", "names":["João Silva", "Silva"],
+     "sentences":["João Silva nasceu, \"em\" Lisboa;\nmorreu em 2020."], "tokenizedNames":[["João", "Silva"], ["Silva"]],
+     "tokenizedSentences":[["João", "Silva", "nasceu", ",", "\"em\"", "Lisboa;", "morreu", "em", "2020", "."]],
+     "annotatedEntities":array(annotations.TYPECODE, [0, 0, 0, 2, 0, 1, 1, 1]), "entityType":"PER"},
+    {"wikiPageID":"7", "isPrimaryTopicOf":"", "names":[], "sentences":[], "tokenizedNames":[], "tokenizedSentences":[],
+     "annotatedEntities":array(annotations.TYPECODE), "entityType":""},
+]
+
+# The FORMATS, skipped when their package is not installed
+FORMATS = [pytest.param(fmt, marks=pytest.mark.skipif(fmt == "msgpack" and storage.msgpack is None, reason="msgpack is not installed"))
+           for fmt in storage.FORMATS]
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_round_trip(tmp_path, fmt):
+    path = str(tmp_path / "rows.st6")
+    with storage.RowWriter(path, COLUMNS, fmt) as outputs:
+        for row in ROWS:
+            outputs.writerow(row)
+
+    with storage.RowReader(path) as inputs:
+        assert inputs.fmt == fmt
+        assert inputs.fieldnames == COLUMNS
+        assert list(inputs) == ROWS
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_undecoded_columns_are_written_back_unchanged(tmp_path, fmt):
+    path, copy = str(tmp_path / "rows.st6"), str(tmp_path / "copy.st6")
+    with storage.RowWriter(path, COLUMNS, fmt) as outputs:
+        for row in ROWS:
+            outputs.writerow(row)
+
+    with storage.RowReader(path, decode=[]) as inputs, storage.RowWriter(copy, inputs.fieldnames, fmt) as outputs:
+        for row in inputs:
+            outputs.writerow(row)
+    with open(path, 'rb') as original, open(copy, 'rb') as copied:
+        assert original.read() == copied.read()
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_appends_to_a_partial_output(tmp_path, fmt):
+    path = str(tmp_path / "rows.st6")
+    for row in ROWS:
+        with storage.RowWriter(path, COLUMNS, fmt, append=True) as outputs:
+            outputs.writerow(row)
+
+    with storage.RowReader(path) as inputs:
+        assert list(inputs) == ROWS
+
+def test_converts_to_csv(tmp_path):
+    path, csv_file = str(tmp_path / "rows.st6"), str(tmp_path / "rows.csv")
+    with storage.RowWriter(path, COLUMNS, "pickle") as outputs:
+        for row in ROWS:
+            outputs.writerow(row)
+
+    storage.convert_to_csv(path, csv_file)
+    with storage.RowReader(csv_file) as inputs:
+        assert inputs.fmt == "csv"
+        assert list(inputs) == ROWS
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        storage.RowWriter("rows.st6", COLUMNS, "json")
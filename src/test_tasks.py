@@ -0,0 +1,112 @@
+""" test_tasks.py - Defines the tests of the task functions of the pipeline (see 'tasks.py'), run with pytest """
+
+__author__ = "Daniel Specht Menezes"
+__copyright__ = "Copyright 2018, Daniel Specht Silva Menezes"
+__credits__ = ["Daniel Specht Menezes"]
+__license__ = "Apache License 2.0"
+__version__ = "1.0"
+__maintainer__ = "Daniel Specht Menezes"
+__email__ = "danielssmenezes@gmail.com"
+__status__ = "Development"
+
+from os.path import dirname, join
+import csv
+import json
+
+import pytest
+
+import storage
+import tasks
+
+# Texts of articles and their sentences as split by the original, list-based sentence splitting
+with open(join(dirname(__file__), "fixtures", "sentences.json")) as file:
+    SPLIT_SENTENCES = json.load(file)
+
+def _write_entities(path, rows):
+    """
+    Writes the input .csv file of 'summarize_entity_names' with the rows, dicts of the columns
+    'isPrimaryTopicOf', 'wikiPageID' and 'name'
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', newline='') as file:
+        CSV_outputs = csv.DictWriter(file, fieldnames=["isPrimaryTopicOf","wikiPageID","name"])
+        CSV_outputs.writeheader()
+        CSV_outputs.writerows(rows)
+
+def _summarized_entities(tmp_path):
+    """
+    Returns the .st1 files of a Place "Lisboa" with the id 7 and a Person "João Silva" with the id 1990
+    """
+    place = tmp_path / "Place" / "place.csv"
+    person = tmp_path / "Person" / "person.csv"
+    _write_entities(place, [{"isPrimaryTopicOf":"http://pt.wikipedia.org/wiki/Lisboa", "wikiPageID":"7", "name":"Lisboa"}])
+    _write_entities(person, [{"isPrimaryTopicOf":"http://pt.wikipedia.org/wiki/João_Silva", "wikiPageID":"1990", "name":"João Silva;;Silva"}])
+
+    summarized = []
+    for input_file in (place, person):
+        output_file = str(input_file.with_suffix(".st1"))
+        tasks.summarize_entity_names(str(input_file), output_file)
+        summarized.append(output_file)
+    return summarized
+
+def test_summarized_names_leave_out_the_id_and_url(tmp_path):
+    place, person = _summarized_entities(tmp_path)
+    with storage.RowReader(person) as inputs:
+        rows = list(inputs)
+    assert [row["names"] for row in rows] == [["João Silva", "Silva"]]
+    assert rows[0]["wikiPageID"] == "1990"
+    assert rows[0]["entityType"] == "PER"
+
+def test_numeric_ids_are_not_labelled(tmp_path):
+    gazetteer_file = str(tmp_path / "gazetteer.pickle")
+    tasks.build_gazetteer(_summarized_entities(tmp_path), gazetteer_file)
+
+    row = {"names":["João Silva", "Silva"], "sentences":["João Silva nasceu em Lisboa a 7 de maio de 1990 ."]}
+    row["sentences"], mentions, row["mentionTypes"] = tasks._row_filtered_sentences(row, gazetteer_file, multi_type=True)
+    assert row["mentionTypes"] == {"Lisboa":"LOC"}
+
+    tokenized_names, tokenized_sentences = tasks._row_tokenized(row, tasks.split_words)
+    annotated_entities = tasks._annotate_entities(tokenized_names, tokenized_sentences)
+    lines, counts = tasks._iob_sentences(tokenized_sentences, annotated_entities, "PER", tasks._entity_types(row["names"], "PER", row["mentionTypes"]))
+    labels = dict(line.split("\t") for line in lines[0].splitlines() if line)
+    assert labels["João"] == "B-PER"
+    assert labels["Lisboa"] == "B-LOC"
+    assert labels["7"] == "O"
+    assert labels["1990"] == "O"
+    assert counts == [(len(tokenized_sentences[0]), ["PER", "LOC"])]
+
+def test_other_mentions_are_whole_words(tmp_path):
+    gazetteer_file = str(tmp_path / "gazetteer.pickle")
+    tasks.build_gazetteer(_summarized_entities(tmp_path), gazetteer_file)
+
+    row = {"names":["João Silva", "Silva"], "sentences":["A 17 de maio houve festa.", "Lisboalândia abriu.", "Lisboa é a capital."]}
+    sentences, mentions, mention_types = tasks._row_filtered_sentences(row, gazetteer_file, keep_other_mentions=True, multi_type=True)
+    assert sentences == ["Lisboa é a capital."]
+    assert mentions == [["Lisboa"]]
+    assert mention_types == {"Lisboa":"LOC"}
+
+@pytest.mark.parametrize("article", [article for article in SPLIT_SENTENCES if "plainText" in article])
+def test_splits_the_sentences_of_the_plain_text_as_before(article):
+    assert list(tasks.iter_article_sentences(article["plainText"])) == article["sentences"]
+    assert tasks.split_article_sentences_listwise(article["plainText"]) == article["sentences"]
+
+@pytest.mark.parametrize("article", [article for article in SPLIT_SENTENCES if "wikiText" in article])
+def test_splits_the_sentences_of_the_wikitext_as_before(article):
+    assert list(tasks.iter_article_sentences(tasks._plain_text(article["wikiText"]))) == article["sentences"]
+    assert list(tasks.iter_wikitext_sentences(article["wikiText"])) == article["sentences"]
+
+def test_iob_tags_the_tokens_inside_the_mentions(tmp_path):
+    (tmp_path / "Person").mkdir()
+    input_file, output_file = str(tmp_path / "Person" / "person.st6"), str(tmp_path / "Person" / "person.conllu")
+    row = {"wikiPageID":"1990", "isPrimaryTopicOf":"http://pt.wikipedia.org/wiki/João_da_Silva", "names":["João da Silva", "Silva"],
+           "sentences":["Hoje João da Silva e Silva saíram ."]}
+    row["tokenizedNames"], row["tokenizedSentences"] = tasks._row_tokenized(row, tasks.split_words)
+    row["annotatedEntities"] = tasks._annotate_entities(row["tokenizedNames"], row["tokenizedSentences"])
+    with storage.RowWriter(input_file, list(row)) as outputs:
+        outputs.writerow(row)
+
+    tasks.IOB(input_file, output_file)
+    with open(output_file) as file:
+        lines = file.read().split("\n")
+    assert lines[0].endswith("Hoje\tO")
+    assert lines[1:7] == ["João\tB-PER", "da\tI-PER", "Silva\tI-PER", "e\tO", "Silva\tB-PER", "saíram\tO"]